@@ -0,0 +1,132 @@
+# -----------------------------------------------------------
+# Copyright (c) 2023 Lauris BH
+# SPDX-License-Identifier: MIT
+# -----------------------------------------------------------
+
+"""Report how connection use scales with account count.
+
+Compares separate `KarcherHome` instances to `KarcherFleet` against local
+fake API server. Run with `python -m benchmarks.bench_fleet` from the
+repository root. Works without network access, MQTT connections are only
+counted, not opened.
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import tempfile
+import time
+
+from aiohttp import web
+
+from karcher.auth import Domains
+from karcher.cache import DomainCache
+from karcher.consts import Region
+from karcher.fleet import KarcherFleet
+from karcher.karcher import KarcherHome
+from karcher.mqtt import MqttHub
+
+MQTT_URL = 'mqtt.example.com:1883'
+
+
+def make_token(user_id: str) -> str:
+    payload = json.dumps({
+        'value': json.dumps({'id': user_id}),
+        'exp': int(time.time() + 3600),
+    })
+    return 'h.' + base64.b64encode(payload.encode()).decode().rstrip('=') + '.s'
+
+
+async def devices(req):
+    # Simulate server processing time
+    await asyncio.sleep(0.005)
+    return web.json_response({'code': 0, 'result': []})
+
+
+async def run_separate(cache: DomainCache, tokens, rounds: int):
+    homes = []
+    for token in tokens:
+        kh = await KarcherHome.create(country='LV', domain_cache=cache)
+        kh.login_token(token, 'm')
+        homes.append(kh)
+    for _ in range(rounds):
+        await asyncio.gather(*(kh.get_devices() for kh in homes))
+
+    connections = 0
+    for kh in homes:
+        stats = kh._pool.stats()['api']
+        connections += stats.in_use + stats.idle
+    # Each instance has own MQTT client with a network thread
+    mqtt = len(homes)
+    for kh in homes:
+        await kh.close()
+    return len(homes), connections, mqtt
+
+
+async def run_fleet(cache: DomainCache, tokens, rounds: int):
+    fleet = KarcherFleet(domain_cache=cache)
+    homes = []
+    for i, token in enumerate(tokens):
+        homes.append(await fleet.add_account(
+            str(i), country='LV', auth_token=token, mqtt_token='m'))
+    for _ in range(rounds):
+        await asyncio.gather(*(kh.get_devices() for kh in homes))
+
+    # Count shared MQTT connections without connecting
+    hub = MqttHub()
+    clients = [hub.client('mqtt.example.com', 1883, kh._session.user_id, 'm')
+               for kh in homes]
+    res = fleet.resources()
+    mqtt = hub.connections
+    for client in clients:
+        client.disconnect()
+    await fleet.close()
+    return res.http_pools, res.http_connections, mqtt
+
+
+async def run(counts, users: int, rounds: int):
+    app = web.Application()
+    app.router.add_get(
+        '/smart-home-service/smartHome/user/getDeviceInfoByUserId/{user}', devices)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    base_url = 'http://127.0.0.1:' + str(runner.addresses[0][1])
+
+    print(f'{"accounts":>8} | {"separate: pools":>15} {"http":>6} {"mqtt":>6} '
+          f'| {"fleet: pools":>12} {"http":>6} {"mqtt":>6}')
+    with tempfile.TemporaryDirectory() as path:
+        cache = DomainCache(path)
+        domains = Domains()
+        domains.app_api = base_url
+        domains.mqtt = MQTT_URL
+        cache.put(Region.EU, domains)
+
+        for count in counts:
+            tokens = [make_token('u' + str(i % (users or count))) for i in range(count)]
+            separate = await run_separate(cache, tokens, rounds)
+            fleet = await run_fleet(cache, tokens, rounds)
+            print(f'{count:>8} | {separate[0]:>15} {separate[1]:>6} {separate[2]:>6} '
+                  f'| {fleet[0]:>12} {fleet[1]:>6} {fleet[2]:>6}')
+
+    await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--accounts', default='1,10,100', help='comma separated account counts')
+    parser.add_argument(
+        '--users', type=int, default=0,
+        help='distinct users accounts log in as, 0 for one per account')
+    parser.add_argument('--rounds', type=int, default=3, help='requests per account')
+    args = parser.parse_args()
+
+    counts = [int(c) for c in args.accounts.split(',')]
+    asyncio.run(run(counts, args.users, args.rounds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+# -----------------------------------------------------------
+# Copyright (c) 2023 Lauris BH
+# SPDX-License-Identifier: MIT
+# -----------------------------------------------------------
+
+"""Compare eager dictionary map decoding with lazy typed map access.
+
+Run with `python -m benchmarks.bench_map` from the repository root.
+"""
+
+import time
+import tracemalloc
+
+from karcher.map import Map
+from karcher.synthetic import generate_map
+
+
+def build_large_map(
+        size: int = 1000,
+        path_points: int = 50000,
+        rooms: int = 30) -> bytes:
+    rm = generate_map(42, size, size, rooms=rooms, path_points=path_points)
+    return rm.SerializeToString()
+
+
+def measure(name: str, fn, data: bytes):
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn(data)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{name:<28} {elapsed * 1000:10.1f} ms {peak / 1024 / 1024:10.1f} MiB')
+
+
+def eager(data: bytes):
+    return Map.parse(data).data['charge_station']
+
+
+def lazy(data: bytes):
+    return Map.parse(data).charge_station
+
+
+def selective(data: bytes):
+    return Map.parse(data, fields=['chargeStation']).charge_station
+
+
+def lazy_grid(data: bytes):
+    m = Map.parse(data)
+    return m.charge_station, m.grid
+
+
+if __name__ == '__main__':
+    payload = build_large_map()
+    print(f'map payload: {len(payload) / 1024 / 1024:.1f} MiB')
+    measure('eager data dict', eager, payload)
+    measure('lazy charge station', lazy, payload)
+    measure('selective charge station', selective, payload)
+    measure('lazy charge station + grid', lazy_grid, payload)
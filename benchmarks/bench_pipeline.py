@@ -0,0 +1,81 @@
+# -----------------------------------------------------------
+# Copyright (c) 2023 Lauris BH
+# SPDX-License-Identifier: MIT
+# -----------------------------------------------------------
+
+"""Benchmark map download pipeline stages on synthetic maps.
+
+Run with `python -m benchmarks.bench_pipeline` from the repository root.
+Works without network access.
+"""
+
+import argparse
+import time
+import tracemalloc
+
+from google.protobuf.json_format import MessageToDict
+
+from karcher.consts import Product
+from karcher.map import Map
+from karcher.synthetic import generate_map
+from karcher.utils import decrypt_map, encrypt_map, snake_case_fields
+
+SN = 'SN0000000000001'
+MAC = '00:11:22:33:44:55'
+PRODUCT = Product.RCV5
+
+
+def measure(name: str, fn, repeat: int, setup=None):
+    """Run `fn` `repeat` times, print best time and peak of traced memory.
+
+    If `setup` is provided, it is run before each run without measuring it
+    and its result is passed to `fn`.
+    """
+    best = None
+    peak = 0
+    result = None
+    for _ in range(repeat):
+        args = () if setup is None else (setup(),)
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+        _, run_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        best = elapsed if best is None else min(best, elapsed)
+        peak = max(peak, run_peak)
+    print(f'{name:<24} {best * 1000:10.1f} ms {peak / 1024 / 1024:10.1f} MiB')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--size', type=int, default=800, help='grid size in cells')
+    parser.add_argument('--rooms', type=int, default=8)
+    parser.add_argument('--objects', type=int, default=20)
+    parser.add_argument('--path', type=int, default=20000, help='path points')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rm = generate_map(args.seed, args.size, args.size, rooms=args.rooms,
+                      objects=args.objects, path_points=args.path)
+    data = rm.SerializeToString()
+    encrypted = encrypt_map(SN, MAC, PRODUCT, data)
+    print(f'map {args.size}x{args.size}: {len(data) / 1024 / 1024:.2f} MiB, '
+          f'encrypted {len(encrypted) / 1024 / 1024:.2f} MiB')
+
+    repeat = args.repeat
+    measure('decrypt', lambda: decrypt_map(SN, MAC, PRODUCT, encrypted), repeat)
+    measure('Map.parse', lambda: Map.parse(data), repeat)
+    measure('grid', _grids, repeat, setup=lambda: Map.parse(data))
+    d = measure('MessageToDict', lambda: MessageToDict(rm), repeat)
+    measure('snake_case_fields', lambda: snake_case_fields(d), repeat)
+
+
+def _grids(m: Map):
+    return m.grid, m.room_grid
+
+
+if __name__ == '__main__':
+    main()
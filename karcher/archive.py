@@ -0,0 +1,208 @@
+# -----------------------------------------------------------
+# Copyright (c) 2023 Lauris BH
+# SPDX-License-Identifier: MIT
+# -----------------------------------------------------------
+
+"""Append-only archive of historical maps."""
+
+import mmap
+import os
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+from .exception import KarcherHomeException
+from .map import Map
+
+ARCHIVE_MAGIC = b'KMAPARC1'
+
+INDEX_DTYPE = np.dtype([
+    ('timestamp', '<i8'),
+    ('map_head_id', '<i8'),
+    ('offset', '<u8'),
+    ('meta_size', '<u4'),
+    ('grid_size', '<u4'),
+    ('room_size', '<u4'),
+    ('size_x', '<u4'),
+    ('size_y', '<u4'),
+    ('reserved', '<u4'),
+])
+
+
+def _align(n: int) -> int:
+    return (n + 7) & ~7
+
+
+class MapArchive:
+    """Append-only archive of map versions of a single device.
+
+    Each map is stored as a column of the protobuf message without grids,
+    followed by occupancy grid and room matrix columns aligned to 8 bytes.
+    A fixed size index of `(timestamp, map_head_id, offset, ...)` records is
+    kept in a separate file. Data file is read through `mmap`, so grids of
+    archived maps are NumPy views and are not loaded until accessed.
+    """
+
+    DATA_FILE = 'maps.bin'
+    INDEX_FILE = 'index.bin'
+
+    def __init__(self, path: str):
+        self._path = path
+        self._lock = threading.Lock()
+        self._mm = None
+        os.makedirs(path, exist_ok=True)
+        self._data_path = os.path.join(path, self.DATA_FILE)
+        self._index_path = os.path.join(path, self.INDEX_FILE)
+        self._index = self._load_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def _load_index(self) -> np.ndarray:
+        try:
+            with open(self._index_path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return np.zeros(0, dtype=INDEX_DTYPE)
+        if data[:len(ARCHIVE_MAGIC)] != ARCHIVE_MAGIC:
+            raise KarcherHomeException(
+                -2, 'Invalid map archive index: ' + self._index_path)
+        data = data[len(ARCHIVE_MAGIC):]
+        count = len(data) // INDEX_DTYPE.itemsize
+        if len(data) % INDEX_DTYPE.itemsize != 0:
+            # Drop partially written last record, so appends stay aligned
+            os.truncate(
+                self._index_path, len(ARCHIVE_MAGIC) + count * INDEX_DTYPE.itemsize)
+        return np.frombuffer(data, dtype=INDEX_DTYPE, count=count).copy()
+
+    @property
+    def index(self) -> np.ndarray:
+        """Index records as a NumPy structured array."""
+        with self._lock:
+            index = self._index.view()
+        index.flags.writeable = False
+        return index
+
+    def append(self, m: Map, timestamp: Optional[int] = None) -> int:
+        """Append map to archive and return its record number.
+
+        Timestamp defaults to the map upload date, or current time if map
+        has no upload date.
+        """
+
+        if timestamp is None:
+            ext = m.ext_info
+            timestamp = ext.map_upload_date if ext is not None else 0
+            if timestamp == 0:
+                timestamp = int(time.time())
+
+        rm = m.robot_map.__class__()
+        rm.CopyFrom(m.robot_map)
+        rm.ClearField('mapData')
+        rm.ClearField('roomMatrix')
+        meta = rm.SerializeToString()
+        grid = m.grid.tobytes() if m.grid is not None else b''
+        room = m.room_grid.tobytes() if m.room_grid is not None else b''
+
+        record = np.zeros(1, dtype=INDEX_DTYPE)
+        record['timestamp'] = timestamp
+        record['map_head_id'] = m.robot_map.mapHead.mapHeadId
+        record['meta_size'] = len(meta)
+        record['grid_size'] = len(grid)
+        record['room_size'] = len(room)
+        record['size_x'] = m.size_x
+        record['size_y'] = m.size_y
+
+        with self._lock:
+            with open(self._data_path, 'ab') as f:
+                offset = f.seek(0, os.SEEK_END)
+                if offset == 0:
+                    f.write(ARCHIVE_MAGIC)
+                    offset = len(ARCHIVE_MAGIC)
+                record['offset'] = offset
+                for buf in (meta, grid, room):
+                    f.write(buf)
+                    f.write(bytes(_align(len(buf)) - len(buf)))
+            # Index is written last, so it never points to incomplete data
+            with open(self._index_path, 'ab') as f:
+                if f.seek(0, os.SEEK_END) == 0:
+                    f.write(ARCHIVE_MAGIC)
+                f.write(record.tobytes())
+            self._index = np.concatenate((self._index, record))
+            return len(self._index) - 1
+
+    def find(self, timestamp: int) -> Optional[int]:
+        """Number of the last record at or before timestamp."""
+        with self._lock:
+            idx = np.flatnonzero(self._index['timestamp'] <= timestamp)
+        if len(idx) == 0:
+            return None
+        return int(idx[-1])
+
+    def _buffer(self, end: int) -> mmap.mmap:
+        if self._mm is None or len(self._mm) < end:
+            with open(self._data_path, 'rb') as f:
+                # Previous mapping is released once no views reference it
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mm) < end:
+            raise KarcherHomeException(-2, 'Invalid map archive: truncated data file')
+        return self._mm
+
+    def _columns(self, i: int):
+        with self._lock:
+            r = self._index[i]
+            grid_offset = int(r['offset']) + _align(int(r['meta_size']))
+            room_offset = grid_offset + _align(int(r['grid_size']))
+            buf = self._buffer(room_offset + int(r['room_size']))
+        return r, buf, grid_offset, room_offset
+
+    def grid(self, i: int) -> Optional[np.ndarray]:
+        """Occupancy grid of archived map as a read-only view."""
+        r, buf, offset, _ = self._columns(i)
+        return _view(buf, offset, r['grid_size'], r['size_x'], r['size_y'])
+
+    def room_grid(self, i: int) -> Optional[np.ndarray]:
+        """Room matrix of archived map as a read-only view."""
+        r, buf, _, offset = self._columns(i)
+        return _view(buf, offset, r['room_size'], r['size_x'], r['size_y'])
+
+    def load(self, i: int) -> Map:
+        """Load archived map, grids are views over the archive file."""
+        r, buf, grid_offset, room_offset = self._columns(i)
+        offset = int(r['offset'])
+        m = Map.parse(buf[offset:offset + int(r['meta_size'])])
+        m.set_grids(
+            _view(buf, grid_offset, r['grid_size'], r['size_x'], r['size_y']),
+            _view(buf, room_offset, r['room_size'], r['size_x'], r['size_y']))
+        return m
+
+    def close(self):
+        with self._lock:
+            if self._mm is not None:
+                try:
+                    self._mm.close()
+                except BufferError:
+                    # Loaded maps still reference the mapping
+                    pass
+                self._mm = None
+
+
+def _view(
+        buf,
+        offset: int,
+        size: int,
+        size_x: int,
+        size_y: int) -> Optional[np.ndarray]:
+    size = int(size)
+    if size == 0:
+        return None
+    grid = np.frombuffer(buf, dtype=np.uint8, count=size, offset=offset)
+    return grid.reshape(int(size_y), int(size_x))
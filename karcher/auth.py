@@ -60,17 +60,21 @@ class Session:
         self.auth_token = ''
         self.mqtt_token = ''
 
+    @property
+    def expires_at(self) -> int:
+        """Auth token expiry timestamp, 0 if unknown."""
+        try:
+            return int(_token_payload(self.auth_token).get('exp', 0))
+        except (AttributeError, IndexError, TypeError, ValueError):
+            return 0
+
     @staticmethod
     def from_token(auth_token: str, mqtt_token: str):
         """Create session from auth and MQTT tokens."""
         sess = Session()
 
         # Get user ID from auth token
-        token_data = auth_token.split(".")[1]
-        missing_padding = len(token_data) % 4
-        if missing_padding:
-            token_data += '=' * (4 - missing_padding)
-        data = json.loads(base64.b64decode(token_data))
+        data = _token_payload(auth_token)
         auth = json.loads(data["value"])
 
         sess.user_id = auth["id"]
@@ -78,3 +82,11 @@ class Session:
         sess.mqtt_token = mqtt_token
 
         return sess
+
+
+def _token_payload(auth_token: str) -> dict:
+    token_data = auth_token.split(".")[1]
+    missing_padding = len(token_data) % 4
+    if missing_padding:
+        token_data += '=' * (4 - missing_padding)
+    return json.loads(base64.b64decode(token_data))
@@ -0,0 +1,265 @@
+# -----------------------------------------------------------
+# Copyright (c) 2023 Lauris BH
+# SPDX-License-Identifier: MIT
+# -----------------------------------------------------------
+
+import collections
+from dataclasses import asdict, dataclass
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+from .auth import Domains
+from .consts import PROTOCOL_VERSION, TENANT_ID, Region
+
+# Age in seconds after which cached domains are revalidated
+DOMAIN_CACHE_TTL = 24 * 3600
+
+
+@dataclass
+class MapCacheEntry:
+    """Map cache entry class."""
+
+    digest: str
+    size: int
+    upload_date: int = 0
+    etag: str = ''
+    stored_time: int = 0
+
+
+class MapCache:
+    """On-disk map cache.
+
+    Stores decrypted map data content-addressed by its SHA-256 digest, so
+    identical maps are stored only once. Entries are keyed by device serial
+    number and map ID and evicted in least recently used order when the
+    total size of stored maps exceeds `max_size` bytes. Reads only update
+    recency in memory, it is stored with the next change of the index.
+
+    Methods doing disk I/O are thread-safe, so they can be run outside of
+    the event loop.
+
+    Attributes:
+        hits -- number of maps served from cache
+        misses -- number of maps that had to be downloaded
+    """
+
+    INDEX_FILE = 'index.json'
+
+    def __init__(self, path: str, max_size: int = 256 * 1024 * 1024):
+        self._path = path
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def _key(sn: str, map_id: int) -> str:
+        return sn + '/' + str(map_id)
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self._path, digest + '.bin')
+
+    def _load(self):
+        try:
+            with open(os.path.join(self._path, self.INDEX_FILE), 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        for k, v in data:
+            entry = MapCacheEntry(**v)
+            if os.path.exists(self._blob_path(entry.digest)):
+                self._entries[k] = entry
+
+    def _save(self):
+        tmp = os.path.join(self._path, self.INDEX_FILE + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump([(k, asdict(v)) for k, v in self._entries.items()], f)
+        os.replace(tmp, os.path.join(self._path, self.INDEX_FILE))
+
+    @property
+    def size(self) -> int:
+        """Total size of stored maps in bytes."""
+        with self._lock:
+            return self._size()
+
+    def _size(self) -> int:
+        return sum({e.digest: e.size for e in self._entries.values()}.values())
+
+    def lookup(self, sn: str, map_id: int) -> Optional[MapCacheEntry]:
+        """Get cache entry metadata without reading map data."""
+        with self._lock:
+            return self._entries.get(self._key(sn, map_id))
+
+    def get(self, sn: str, map_id: int, upload_date: int = None) -> Optional[bytes]:
+        """Get cached map data.
+
+        If `upload_date` is provided, cached map is only returned if it has
+        the same upload date.
+        """
+        key = self._key(sn, map_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None \
+                    or (upload_date is not None and entry.upload_date != upload_date):
+                self.misses += 1
+                return None
+
+        try:
+            with open(self._blob_path(entry.digest), 'rb') as f:
+                data = f.read()
+        except OSError:
+            data = None
+
+        with self._lock:
+            if data is None:
+                # Entries without data are dropped from index when it is loaded
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def add_miss(self):
+        """Count map that had to be downloaded without a cache lookup."""
+        with self._lock:
+            self.misses += 1
+
+    def put(
+            self,
+            sn: str,
+            map_id: int,
+            data: bytes,
+            upload_date: int = 0,
+            etag: str = ''):
+        """Store map data."""
+        digest = hashlib.sha256(data).hexdigest()
+        key = self._key(sn, map_id)
+        with self._lock:
+            path = self._blob_path(digest)
+            if not os.path.exists(path):
+                tmp = path + '.tmp'
+                with open(tmp, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp, path)
+
+            old = self._entries.pop(key, None)
+            self._entries[key] = MapCacheEntry(
+                digest, len(data), upload_date, etag or '', int(time.time()))
+            if old is not None:
+                self._release(old.digest)
+            self._evict()
+            self._save()
+
+    def invalidate(self, sn: str, map_id: int = None):
+        """Remove device maps from cache."""
+        with self._lock:
+            for key in list(self._entries.keys()):
+                if key == self._key(sn, map_id) \
+                        or (map_id is None and key.startswith(sn + '/')):
+                    self._release(self._entries.pop(key).digest)
+            self._save()
+
+    def _evict(self):
+        while len(self._entries) > 1 and self._size() > self._max_size:
+            _, entry = self._entries.popitem(last=False)
+            self._release(entry.digest)
+
+    def _release(self, digest: str):
+        for e in self._entries.values():
+            if e.digest == digest:
+                return
+        try:
+            os.remove(self._blob_path(digest))
+        except OSError:
+            pass
+
+
+@dataclass
+class DomainCacheEntry:
+    """Domain cache entry class."""
+
+    app_api: str
+    mqtt: str
+    stored_time: int = 0
+
+    @property
+    def domains(self) -> Domains:
+        d = Domains()
+        d.app_api = self.app_api
+        d.mqtt = self.mqtt
+        return d
+
+
+class DomainCache:
+    """On-disk cache of API and MQTT domains.
+
+    Entries are keyed by region, tenant ID and protocol version. Entries
+    older than `ttl` seconds are still returned, but are stale and should
+    be revalidated.
+    """
+
+    FILE = 'domains.json'
+
+    def __init__(self, path: str, ttl: int = DOMAIN_CACHE_TTL):
+        self._path = path
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def _key(region: Region, tenant_id: str, version: str) -> str:
+        return Region(region).value + '/' + tenant_id + '/' + version
+
+    def _load(self):
+        try:
+            with open(os.path.join(self._path, self.FILE), 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        for k, v in data.items():
+            self._entries[k] = DomainCacheEntry(**v)
+
+    def _save(self):
+        tmp = os.path.join(self._path, self.FILE + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({k: asdict(v) for k, v in self._entries.items()}, f)
+        os.replace(tmp, os.path.join(self._path, self.FILE))
+
+    def get(
+            self,
+            region: Region,
+            tenant_id: str = TENANT_ID,
+            version: str = PROTOCOL_VERSION) -> Optional[DomainCacheEntry]:
+        """Get cached domains entry, fresh or stale."""
+        with self._lock:
+            return self._entries.get(self._key(region, tenant_id, version))
+
+    def is_stale(self, entry: DomainCacheEntry) -> bool:
+        """Check if entry is older than TTL."""
+        return entry.stored_time + self._ttl <= time.time()
+
+    def put(
+            self,
+            region: Region,
+            domains: Domains,
+            tenant_id: str = TENANT_ID,
+            version: str = PROTOCOL_VERSION):
+        """Store domains."""
+        with self._lock:
+            self._entries[self._key(region, tenant_id, version)] = DomainCacheEntry(
+                domains.app_api, domains.mqtt, int(time.time()))
+            self._save()
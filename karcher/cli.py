@@ -3,13 +3,16 @@
 # SPDX-License-Identifier: MIT
 # -----------------------------------------------------------
 
+from array import array
 import asyncio
 import click
 import dataclasses
 import json
 import logging
 from functools import wraps
+import numpy as np
 
+from karcher.cache import DomainCache
 from karcher.exception import KarcherHomeException
 from karcher.karcher import KarcherHome
 
@@ -31,6 +34,8 @@ class EnhancedJSONEncoder(json.JSONEncoder):
     def default(self, o):
         if dataclasses.is_dataclass(o):
             return dataclasses.asdict(o)
+        if isinstance(o, (array, np.ndarray)):
+            return o.tolist()
         return super().default(o)
 
 
@@ -39,10 +44,12 @@ class GlobalContextObject:
             self,
             debug: int = 0,
             output: str = 'json',
-            country: str = 'GB'):
+            country: str = 'GB',
+            domain_cache: DomainCache = None):
         self.debug = debug
         self.output = output
         self.country = country
+        self.domain_cache = domain_cache
 
     def print(self, result):
         data_variable = getattr(result, 'data', None)
@@ -67,8 +74,13 @@ class GlobalContextObject:
     '--country',
     default='GB',
     help='Country of the server to query. Default: "GB"')
+@click.option(
+    '--cache-dir',
+    default=None,
+    envvar='KARCHER_CACHE_DIR',
+    help='Directory to cache server URLs in between runs.')
 @click.pass_context
-def cli(ctx: click.Context, debug: int, output: str, country: str):
+def cli(ctx: click.Context, debug: int, output: str, country: str, cache_dir: str):
     """Tool for connectiong and getting information from Kärcher Home Robots."""
     level = logging.INFO
     if debug > 0:
@@ -76,8 +88,12 @@ def cli(ctx: click.Context, debug: int, output: str, country: str):
 
     logging.basicConfig(level=level)
 
+    domain_cache = None
+    if cache_dir is not None:
+        domain_cache = DomainCache(cache_dir)
+
     ctx.obj = GlobalContextObject(
-        debug=debug, output=output, country=country.upper())
+        debug=debug, output=output, country=country.upper(), domain_cache=domain_cache)
 
 
 def safe_cli():
@@ -97,7 +113,8 @@ def safe_cli():
 async def urls(ctx: click.Context):
     """Get URL information."""
 
-    kh = await KarcherHome.create(country=ctx.obj.country)
+    kh = await KarcherHome.create(
+        country=ctx.obj.country, domain_cache=ctx.obj.domain_cache)
     d = await kh.get_urls()
     await kh.close()
 
@@ -112,7 +129,8 @@ async def urls(ctx: click.Context):
 async def login(ctx: click.Context, username: str, password: str):
     """Get user session tokens."""
 
-    kh = await KarcherHome.create(country=ctx.obj.country)
+    kh = await KarcherHome.create(
+        country=ctx.obj.country, domain_cache=ctx.obj.domain_cache)
 
     ctx.obj.print(await kh.login(username, password))
 
@@ -128,7 +146,8 @@ async def login(ctx: click.Context, username: str, password: str):
 async def devices(ctx: click.Context, username: str, password: str, auth_token: str):
     """List all devices."""
 
-    kh = await KarcherHome.create(country=ctx.obj.country)
+    kh = await KarcherHome.create(
+        country=ctx.obj.country, domain_cache=ctx.obj.domain_cache)
     if auth_token is not None:
         kh.login_token(auth_token, '')
     elif username is not None and password is not None:
@@ -165,7 +184,8 @@ async def device_properties(
         device_id: str):
     """Get device properties."""
 
-    kh = await KarcherHome.create(country=ctx.obj.country)
+    kh = await KarcherHome.create(
+        country=ctx.obj.country, domain_cache=ctx.obj.domain_cache)
     if auth_token is not None:
         kh.login_token(auth_token, mqtt_token)
     elif username is not None and password is not None:
@@ -0,0 +1,71 @@
+# -----------------------------------------------------------
+# Copyright (c) 2023 Lauris BH
+# SPDX-License-Identifier: MIT
+# -----------------------------------------------------------
+
+"""Coalescing of concurrent identical API calls."""
+
+import asyncio
+from dataclasses import dataclass, replace
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable
+
+# Endpoints that are coalesced by default
+COALESCED_ENDPOINTS = ('get_urls', 'get_user_info', 'get_devices')
+
+
+@dataclass
+class CoalesceStats:
+    """Call coalescing statistics class.
+
+    Attributes:
+        calls -- total number of calls
+        coalesced -- number of calls that shared an already running call
+    """
+
+    calls: int = 0
+    coalesced: int = 0
+
+
+class SingleFlight:
+    """Runs only one of concurrent identical calls.
+
+    Calls to enabled endpoints with the same key share a single running
+    call and all get its result or exception. Shared call is not cancelled
+    when one of the callers is cancelled.
+    """
+
+    def __init__(self, endpoints: Iterable[str] = COALESCED_ENDPOINTS):
+        self.endpoints = set(endpoints)
+        self._running = {}
+        self._stats = {}
+
+    async def run(
+            self,
+            endpoint: str,
+            key: Hashable,
+            fn: Callable[[], Awaitable[Any]]) -> Any:
+        stats = self._stats.setdefault(endpoint, CoalesceStats())
+        stats.calls += 1
+        if endpoint not in self.endpoints:
+            return await fn()
+
+        key = (endpoint, key)
+        task = self._running.get(key)
+        if task is not None:
+            stats.coalesced += 1
+        else:
+            task = asyncio.ensure_future(fn())
+            self._running[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Future):
+        if self._running.get(key) is task:
+            del self._running[key]
+        if not task.cancelled():
+            # Mark exception as retrieved in case all callers were cancelled
+            task.exception()
+
+    def stats(self) -> Dict[str, CoalesceStats]:
+        """Get statistics by endpoint."""
+        return {k: replace(v) for k, v in self._stats.items()}
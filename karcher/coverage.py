@@ -0,0 +1,142 @@
+# -----------------------------------------------------------
+# Copyright (c) 2023 Lauris BH
+# SPDX-License-Identifier: MIT
+# -----------------------------------------------------------
+
+"""Cleaned area coverage computed from the robot path."""
+
+from typing import Dict, Optional
+
+import numpy as np
+
+from .map import Map
+from .path import sample_polyline
+
+
+class CoverageMap:
+    """Cleaned cells raster.
+
+    Rasterizes robot path onto the map grid using a round brush of
+    `brush_width` meters. New path points can be added incrementally, only
+    the new segments are drawn.
+    """
+
+    def __init__(self, m: Map, brush_width: float = 0.3):
+        self._map = m
+        self._pose_id = None
+        self._consumed = 0
+        self._last = None
+        self.mask = np.zeros((m.size_y, m.size_x), dtype=bool)
+        self._brush_width = brush_width
+        self._brush = _make_brush(brush_width / m.resolution)
+
+    @staticmethod
+    def from_map(m: Map, brush_width: float = 0.3):
+        """Create coverage from map history path."""
+        c = CoverageMap(m, brush_width)
+        c.update_from_map(m)
+        return c
+
+    def reset(self):
+        """Clear coverage."""
+        self.mask[:] = False
+        self._pose_id = None
+        self._consumed = 0
+        self._last = None
+
+    def update_from_map(self, m: Map):
+        """Add path points from newer version of the same map.
+
+        Only points that were not seen before are drawn. If the history
+        pose ID changes, coverage is reset. If map grid geometry changes,
+        whole path is drawn again on the new grid.
+        """
+        if m.robot_map.mapHead != self._map.robot_map.mapHead:
+            self._map = m
+            self.mask = np.zeros((m.size_y, m.size_x), dtype=bool)
+            self._brush = _make_brush(self._brush_width / m.resolution)
+            self._consumed = 0
+            self._last = None
+        self._map = m
+
+        if not m.robot_map.HasField('historyPose'):
+            return
+        pose = m.robot_map.historyPose
+        if self._pose_id != pose.poseId or len(pose.points) < self._consumed:
+            self.reset()
+            self._pose_id = pose.poseId
+        if len(pose.points) == self._consumed:
+            return
+        points = np.array(
+            [(p.x, p.y) for p in pose.points[self._consumed:]], dtype=np.float64)
+        self._consumed = len(pose.points)
+        self.update(points)
+
+    def update(self, points: np.ndarray):
+        """Draw path through given `(N, 2)` world coordinates."""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if len(points) == 0:
+            return
+        px, py = self._map.world_to_pixel(points[:, 0], points[:, 1], True)
+        path = np.stack((px, py), axis=1)
+        if self._last is not None:
+            path = np.concatenate((self._last[np.newaxis, :], path))
+        self._last = path[-1]
+        self._stamp(sample_polyline(path))
+
+    def _stamp(self, samples: np.ndarray):
+        cells = np.unique(np.rint(samples).astype(np.intp), axis=0)
+        cells = (cells[:, np.newaxis, :] + self._brush[np.newaxis, :, :]).reshape(-1, 2)
+        ok = self._map.in_bounds(cells[:, 0], cells[:, 1])
+        self.mask[cells[ok, 1], cells[ok, 0]] = True
+
+    def _floor(self) -> Optional[np.ndarray]:
+        if self._map.room_grid is not None:
+            return self._map.room_grid > 0
+        if self._map.grid is not None:
+            return self._map.grid > 0
+        return None
+
+    @property
+    def coverage(self) -> float:
+        """Share of floor cells that are cleaned, between 0 and 1.
+
+        Floor is taken from the room matrix, or from known cells of the
+        occupancy grid when map has no rooms.
+        """
+        floor = self._floor()
+        if floor is None:
+            return 0.0
+        total = np.count_nonzero(floor)
+        if total == 0:
+            return 0.0
+        return np.count_nonzero(self.mask & floor) / total
+
+    def room_coverage(self) -> Dict[int, float]:
+        """Share of cleaned cells for each room, between 0 and 1."""
+        grid = self._map.room_grid
+        if grid is None:
+            return {}
+        total = np.bincount(grid.ravel(), minlength=256)
+        cleaned = np.bincount(grid[self.mask], minlength=256)
+        return {
+            int(i): float(cleaned[i] / total[i])
+            for i in np.nonzero(total[1:])[0] + 1
+        }
+
+    def room_mask(self, room_id: int) -> np.ndarray:
+        """Cleaned cells mask of a single room."""
+        grid = self._map.room_grid
+        if grid is None:
+            return np.zeros_like(self.mask)
+        return self.mask & (grid == room_id)
+
+
+def _make_brush(width: float) -> np.ndarray:
+    """Cell offsets covered by round brush of given width in cells."""
+    r = max(width / 2, 0.5)
+    n = int(np.ceil(r))
+    dy, dx = np.mgrid[-n:n + 1, -n:n + 1]
+    inside = dx * dx + dy * dy <= r * r
+    return np.stack((dx[inside], dy[inside]), axis=1)
+
@@ -3,6 +3,7 @@
 # SPDX-License-Identifier: MIT
 # -----------------------------------------------------------
 
+from array import array
 from dataclasses import dataclass, fields
 from enum import Enum
 import json
@@ -132,14 +133,14 @@ class DeviceProperties:
     quiet_end_time: int = 0
     broken_clean: int = 0
     privacy: DevicePropertiesPrivacy
-    cur_path: List[float]
+    cur_path: array
     dust_action: int = 0
     voice_type: int = 0
     quiet_status: DevicePropertiesQuiet
     last_update_time: int = 0
 
     def __init__(self, **kwargs):
-        setattr(self, 'cur_path', [])
+        setattr(self, 'cur_path', array('f'))
         setattr(self, 'net_status', DevicePropertiesNetwork())
         setattr(self, 'order_total', DevicePropertiesOrderTotal())
         setattr(self, 'privacy', DevicePropertiesPrivacy())
@@ -155,6 +156,9 @@ class DeviceProperties:
             if k in names:
                 if k == 'firmware_code':
                     v = int(v)
+                elif k == 'cur_path':
+                    # Compact float32 storage of flat x, y path coordinates
+                    v = array('f', v)
                 if v != getattr(self, k):
                     setattr(self, k, v)
                     updated = True
@@ -0,0 +1,365 @@
+# -----------------------------------------------------------
+# Copyright (c) 2023 Lauris BH
+# SPDX-License-Identifier: MIT
+# -----------------------------------------------------------
+
+"""Incremental differences between two versions of a map."""
+
+from dataclasses import dataclass
+import math
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from . import mapdata_pb2
+
+if TYPE_CHECKING:
+    from .map import CurrentPose, Map, MapHead, Pose
+
+# Size of grid tiles used to group changed cells into patches
+DIFF_TILE_SIZE = 32
+
+# Sections handled explicitly, all other sections are replaced as a whole
+_DIFF_FIELDS = (
+    'mapHead', 'mapData', 'roomMatrix', 'historyPose', 'chargeStation',
+    'currentPose', 'virtualWalls', 'navigationPoints', 'roomDataInfo',
+)
+
+
+@dataclass(eq=False)
+class GridPatch:
+    """Changed grid region class.
+
+    `cells` is a `(height, width)` array of new values for the region
+    starting at grid cell `x`, `y`.
+    """
+    __slots__ = ('x', 'y', 'cells')
+
+    x: int
+    y: int
+    cells: np.ndarray
+
+
+@dataclass
+class ItemChanges:
+    """Added, removed and changed map items matched by their ID."""
+    __slots__ = ('added', 'removed', 'changed')
+
+    added: List[Any]
+    removed: List[int]
+    changed: List[Any]
+
+    def __bool__(self) -> bool:
+        return len(self.added) > 0 or len(self.removed) > 0 or len(self.changed) > 0
+
+
+@dataclass(eq=False)
+class PathPatch:
+    """Robot path points added since previous map version.
+
+    Points replace path starting from index `start`, so `start` of 0
+    replaces the whole path.
+    """
+    __slots__ = ('pose_id', 'start', 'points', 'update')
+
+    pose_id: int
+    start: int
+    points: np.ndarray
+    update: np.ndarray
+
+
+@dataclass(eq=False)
+class MapDiff:
+    """Map difference class.
+
+    `head` is set only when map header has changed. If grid size or
+    resolution has changed, grid patches cover whole grids. `pose_delta` is
+    robot movement as `(dx, dy, dphi)`. Sections not covered by other fields
+    are stored in `sections` by protobuf field name and are replaced as a
+    whole, `None` meaning that the section was removed.
+    """
+    __slots__ = ('base_version', 'version', 'head', 'grid', 'room_grid',
+                 'rooms', 'virtual_walls', 'navigation_points',
+                 'charge_station', 'current_pose', 'pose_delta', 'path',
+                 'sections')
+
+    base_version: str
+    version: str
+    head: Optional['MapHead']
+    grid: List[GridPatch]
+    room_grid: List[GridPatch]
+    rooms: ItemChanges
+    virtual_walls: ItemChanges
+    navigation_points: ItemChanges
+    charge_station: Optional['Pose']
+    current_pose: Optional['CurrentPose']
+    pose_delta: Optional[Tuple[float, float, float]]
+    path: Optional[PathPatch]
+    sections: Dict[str, Any]
+
+    @property
+    def empty(self) -> bool:
+        return (self.head is None and len(self.grid) == 0
+                and len(self.room_grid) == 0 and not self.rooms
+                and not self.virtual_walls and not self.navigation_points
+                and self.charge_station is None and self.current_pose is None
+                and self.path is None and len(self.sections) == 0)
+
+
+def diff_maps(old: 'Map', new: 'Map') -> MapDiff:
+    """Compute difference from `old` to `new` map."""
+
+    old_rm, new_rm = old.robot_map, new.robot_map
+    sections = {}
+
+    head = None
+    if old_rm.mapHead != new_rm.mapHead:
+        head = new.head
+    resized = (head is not None and (old.size_x, old.size_y, old.resolution)
+               != (new.size_x, new.size_y, new.resolution))
+
+    patches = []
+    for name, old_grid, new_grid in (('mapData', old.grid, new.grid),
+                                     ('roomMatrix', old.room_grid, new.room_grid)):
+        if new_grid is None:
+            if old_grid is not None:
+                sections[name] = None
+            patches.append([])
+        elif old_grid is None or resized:
+            patches.append([GridPatch(0, 0, new_grid.copy())])
+        else:
+            patches.append(_grid_patches(old_grid, new_grid))
+
+    rooms = _item_changes(old.rooms, new.rooms, lambda r: r.room_id)
+    walls = _item_changes(old.virtual_walls, new.virtual_walls, lambda a: a.area_index)
+    points = _item_changes(
+        old.navigation_points, new.navigation_points, lambda p: p.point_id)
+    for name, changes in (('roomDataInfo', rooms), ('virtualWalls', walls),
+                          ('navigationPoints', points)):
+        if changes is None:
+            sections[name] = list(getattr(new_rm, name))
+
+    charge_station = None
+    if old_rm.chargeStation != new_rm.chargeStation:
+        charge_station = new.charge_station
+        if charge_station is None:
+            sections['chargeStation'] = None
+
+    current_pose = None
+    pose_delta = None
+    if old_rm.currentPose != new_rm.currentPose:
+        current_pose = new.current_pose
+        if current_pose is None:
+            sections['currentPose'] = None
+        elif old.current_pose is not None:
+            prev = old.current_pose
+            dphi = (current_pose.phi - prev.phi + math.pi) % (2 * math.pi) - math.pi
+            pose_delta = (current_pose.x - prev.x, current_pose.y - prev.y, dphi)
+
+    path = None
+    if old_rm.historyPose != new_rm.historyPose:
+        path = _path_patch(old, new)
+        if path is None:
+            sections['historyPose'] = None
+
+    for field in mapdata_pb2.RobotMap.DESCRIPTOR.fields:
+        name = field.name
+        if name in _DIFF_FIELDS:
+            continue
+        value = getattr(new_rm, name)
+        if field.message_type is None:
+            if value != getattr(old_rm, name):
+                sections[name] = value
+        elif _is_repeated(field):
+            if list(value) != list(getattr(old_rm, name)):
+                sections[name] = list(value)
+        elif old_rm.HasField(name) != new_rm.HasField(name) \
+                or value != getattr(old_rm, name):
+            sections[name] = value if new_rm.HasField(name) else None
+
+    return MapDiff(
+        base_version=old.version,
+        version=new.version,
+        head=head,
+        grid=patches[0],
+        room_grid=patches[1],
+        rooms=rooms or ItemChanges([], [], []),
+        virtual_walls=walls or ItemChanges([], [], []),
+        navigation_points=points or ItemChanges([], [], []),
+        charge_station=charge_station,
+        current_pose=current_pose,
+        pose_delta=pose_delta,
+        path=path,
+        sections=sections)
+
+
+def apply_patch(m: 'Map', diff: MapDiff) -> 'Map':
+    """Apply difference to map and return a new map.
+
+    Given map must be the map difference was computed from, `ValueError` is
+    raised otherwise.
+    """
+
+    if m.version != diff.base_version:
+        raise ValueError('Map diff can not be applied to map version ' + m.version)
+
+    rm = mapdata_pb2.RobotMap()
+    rm.CopyFrom(m.robot_map)
+    if diff.head is not None:
+        rm.mapHead.CopyFrom(diff.head.to_pb())
+    size = (rm.mapHead.sizeY, rm.mapHead.sizeX)
+
+    for name, field, grid, patches in (
+            ('mapData', 'mapData', m.grid, diff.grid),
+            ('roomMatrix', 'matrix', m.room_grid, diff.room_grid)):
+        if len(patches) == 0:
+            if grid is not None and len(getattr(getattr(rm, name), field)) == 0:
+                # Grid was set separately from the protobuf message
+                setattr(getattr(rm, name), field, grid.tobytes())
+            continue
+        if grid is None or grid.shape != size:
+            grid = np.zeros(size, dtype=np.uint8)
+        else:
+            grid = grid.copy()
+        for p in patches:
+            h, w = p.cells.shape
+            grid[p.y:p.y + h, p.x:p.x + w] = p.cells
+        setattr(getattr(rm, name), field, grid.tobytes())
+
+    _apply_items(rm.roomDataInfo, diff.rooms, lambda r: r.roomId)
+    _apply_items(rm.virtualWalls, diff.virtual_walls, lambda a: a.areaIndex)
+    _apply_items(rm.navigationPoints, diff.navigation_points, lambda p: p.pointId)
+
+    if diff.charge_station is not None:
+        rm.chargeStation.CopyFrom(diff.charge_station.to_pb())
+    if diff.current_pose is not None:
+        rm.currentPose.CopyFrom(diff.current_pose.to_pb())
+    if diff.path is not None:
+        _apply_path(rm.historyPose, diff.path)
+
+    for name, value in diff.sections.items():
+        field = mapdata_pb2.RobotMap.DESCRIPTOR.fields_by_name[name]
+        if value is None:
+            rm.ClearField(name)
+        elif field.message_type is None:
+            setattr(rm, name, value)
+        elif _is_repeated(field):
+            del getattr(rm, name)[:]
+            getattr(rm, name).extend(value)
+        else:
+            getattr(rm, name).CopyFrom(value)
+
+    return type(m)(rm)
+
+
+def _is_repeated(field) -> bool:
+    if hasattr(field, 'is_repeated'):
+        return field.is_repeated
+    return field.label == field.LABEL_REPEATED
+
+
+def _grid_patches(old: np.ndarray, new: np.ndarray) -> List[GridPatch]:
+    """Group changed cells into patches.
+
+    Grid is split into tiles, and each group of adjacent tiles with changes
+    becomes a single patch trimmed to the changed cells.
+    """
+
+    changed = old != new
+    h, w = changed.shape
+    size = DIFF_TILE_SIZE
+    th, tw = -(-h // size), -(-w // size)
+    padded = np.zeros((th * size, tw * size), dtype=bool)
+    padded[:h, :w] = changed
+    tiles = padded.reshape(th, size, tw, size).any(axis=(1, 3))
+
+    patches = []
+    for group in _tile_groups(tiles):
+        ys, xs = group[:, 0], group[:, 1]
+        y0, y1 = ys.min() * size, min((ys.max() + 1) * size, h)
+        x0, x1 = xs.min() * size, min((xs.max() + 1) * size, w)
+        region = changed[y0:y1, x0:x1]
+        rows = np.flatnonzero(region.any(axis=1))
+        cols = np.flatnonzero(region.any(axis=0))
+        y0, y1 = y0 + rows[0], y0 + rows[-1] + 1
+        x0, x1 = x0 + cols[0], x0 + cols[-1] + 1
+        patches.append(GridPatch(int(x0), int(y0), new[y0:y1, x0:x1].copy()))
+    return patches
+
+
+def _tile_groups(tiles: np.ndarray) -> List[np.ndarray]:
+    """Split changed tiles into 4-connected groups in row-major order."""
+
+    changed = list(zip(*(i.tolist() for i in np.nonzero(tiles))))
+    remaining = set(changed)
+    groups = []
+    for tile in changed:
+        if tile not in remaining:
+            continue
+        remaining.remove(tile)
+        stack = [tile]
+        group = []
+        while len(stack) > 0:
+            y, x = stack.pop()
+            group.append((y, x))
+            for n in ((y - 1, x), (y + 1, x), (y, x - 1), (y, x + 1)):
+                if n in remaining:
+                    remaining.remove(n)
+                    stack.append(n)
+        groups.append(np.array(group))
+    return groups
+
+
+def _item_changes(
+        old: List[Any],
+        new: List[Any],
+        key: Callable[[Any], int]) -> Optional[ItemChanges]:
+    """Match items by key, returns `None` if keys are not unique."""
+
+    old_items = {key(i): i for i in old}
+    new_items = {key(i): i for i in new}
+    if len(old_items) != len(old) or len(new_items) != len(new):
+        return None
+    return ItemChanges(
+        added=[i for k, i in new_items.items() if k not in old_items],
+        removed=[k for k in old_items if k not in new_items],
+        changed=[i for k, i in new_items.items()
+                 if k in old_items and old_items[k] != i])
+
+
+def _apply_items(items, changes: ItemChanges, key: Callable[[Any], int]):
+    removed = set(changes.removed)
+    changed = {key(pb): pb for pb in (i.to_pb() for i in changes.changed)}
+    result = []
+    for pb in items:
+        k = key(pb)
+        if k in removed:
+            continue
+        result.append(changed.get(k, pb))
+    result.extend(i.to_pb() for i in changes.added)
+    del items[:]
+    items.extend(result)
+
+
+def _path_patch(old: 'Map', new: 'Map') -> Optional[PathPatch]:
+    path = new.history_pose
+    if path is None:
+        return None
+    start = 0
+    prev = old.history_pose
+    if prev is not None and prev.pose_id == path.pose_id:
+        n = len(prev.points)
+        if n <= len(path.points) and np.array_equal(prev.points, path.points[:n]) \
+                and np.array_equal(prev.update, path.update[:n]):
+            start = n
+    return PathPatch(path.pose_id, start, path.points[start:], path.update[start:])
+
+
+def _apply_path(pb: mapdata_pb2.DeviceHistoryPoseInfo, path: PathPatch):
+    if path.start > len(pb.points):
+        raise ValueError('Map diff path does not match map path')
+    pb.poseId = path.pose_id
+    del pb.points[path.start:]
+    pb.points.extend(
+        mapdata_pb2.DeviceCoverPointDataInfo(update=u, x=x, y=y)
+        for (x, y), u in zip(path.points.tolist(), path.update.tolist()))
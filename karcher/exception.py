@@ -17,6 +17,18 @@ class KarcherHomeException(Exception):
         super().__init__(self.message)
 
 
+class KarcherHomeHttpError(KarcherHomeException):
+    """Exception raised when server responds with unexpected HTTP status.
+
+    Attributes:
+        status -- HTTP status code
+    """
+
+    def __init__(self, status):
+        self.status = status
+        super().__init__(-1, 'HTTP error: ' + str(status))
+
+
 class KarcherHomeAccessDenied(KarcherHomeException):
     """Exception raised when user has no access for resource.
 
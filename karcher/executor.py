@@ -0,0 +1,139 @@
+# -----------------------------------------------------------
+# Copyright (c) 2023 Lauris BH
+# SPDX-License-Identifier: MIT
+# -----------------------------------------------------------
+
+"""CPU-bound map decoding stages that can run in an executor."""
+
+from asyncio import Future
+from concurrent.futures import Executor, ProcessPoolExecutor
+import json
+from multiprocessing import resource_tracker, shared_memory
+import os
+from typing import Any, Optional, Tuple
+
+import numpy as np
+
+from .consts import Product
+from .map import Map
+from .utils import decrypt_map
+
+# Windows removes shared memory when last handle is closed, so it can not
+# outlive the worker process that created it.
+SHARED_MEMORY_SUPPORTED = os.name == 'posix'
+
+
+def parse_map_data(map: int, data: bytes):
+    if map == 1 or map == 2:
+        return Map.parse(data)
+    else:
+        return json.loads(data)
+
+
+def decode_map(
+        sn: str,
+        mac: str,
+        product_id: Product,
+        map: int,
+        data: bytes,
+        encrypted: bool) -> Tuple[bytes, Any]:
+    if encrypted:
+        data = decrypt_map(sn, mac, product_id, data)
+    return data, parse_map_data(map, data)
+
+
+def decode_map_shared(
+        sn: str,
+        mac: str,
+        product_id: Product,
+        map: int,
+        data: bytes,
+        encrypted: bool,
+        keep_data: bool) -> Tuple[Any, ...]:
+    """Decode map in worker process and return large buffers in shared memory.
+
+    Grids and optionally the decoded payload are copied to a single shared
+    memory segment, while the rest of the map is returned as a small
+    serialized protobuf message.
+    """
+
+    data, result = decode_map(sn, mac, product_id, map, data, encrypted)
+    if not isinstance(result, Map):
+        return None, data if keep_data else None, result
+
+    rm = result.robot_map
+    grid = rm.mapData.mapData
+    room = rm.roomMatrix.matrix
+    sizes = (len(grid), len(room), len(data) if keep_data else 0)
+    shm = shared_memory.SharedMemory(create=True, size=max(sum(sizes), 1))
+    try:
+        offset = 0
+        for buf, size in zip((grid, room, data), sizes):
+            shm.buf[offset:offset + size] = buf[:size]
+            offset += size
+        name = shm.name
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+    shm.close()
+    # Parent process takes over ownership and unlinks the segment
+    resource_tracker.unregister(shm._name, 'shared_memory')
+
+    if len(grid) > 0:
+        rm.mapData.ClearField('mapData')
+    if len(room) > 0:
+        rm.roomMatrix.ClearField('matrix')
+    return (name, sizes), None, rm.SerializeToString()
+
+
+def attach_shared_map(result: Tuple[Any, ...]) -> Tuple[Optional[bytes], Any]:
+    """Build map in parent process from `decode_map_shared` result."""
+
+    segment, data, result = result
+    if segment is None:
+        return data, result
+
+    name, sizes = segment
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        m = Map.parse(result)
+        grids = []
+        offset = 0
+        for size in sizes[:2]:
+            grid = None
+            if size > 0:
+                grid = np.empty(size, dtype=np.uint8)
+                grid[:] = np.frombuffer(shm.buf, np.uint8, size, offset)
+            grids.append(grid)
+            offset += size
+        m.set_grids(grids[0], grids[1])
+        if sizes[2] > 0:
+            data = bytes(shm.buf[offset:offset + sizes[2]])
+    finally:
+        shm.close()
+        shm.unlink()
+    return data, m
+
+
+def release_shared_map(result: Tuple[Any, ...]):
+    """Unlink shared memory of `decode_map_shared` result that is not used."""
+
+    segment = result[0]
+    if segment is None:
+        return
+    shm = shared_memory.SharedMemory(name=segment[0])
+    shm.close()
+    shm.unlink()
+
+
+def release_discarded_map(future: Future):
+    """Done callback of `decode_map_shared` call whose caller has gone away."""
+
+    if future.cancelled() or future.exception() is not None:
+        return
+    release_shared_map(future.result())
+
+
+def is_shared_memory_executor(executor: Executor) -> bool:
+    return SHARED_MEMORY_SUPPORTED and isinstance(executor, ProcessPoolExecutor)
@@ -0,0 +1,227 @@
+# -----------------------------------------------------------
+# Copyright (c) 2023 Lauris BH
+# SPDX-License-Identifier: MIT
+# -----------------------------------------------------------
+
+"""Management of many accounts sharing connections."""
+
+import asyncio
+from concurrent.futures import Executor
+from dataclasses import dataclass
+import threading
+from typing import AsyncIterator, Dict, Optional
+
+from .cache import DomainCache, MapCache
+from .consts import Language, Region
+from .countries import get_region_by_country
+from .device import Device
+from .karcher import KarcherHome
+from .mqtt import MqttHub
+from .pool import HttpPoolManager, PoolConfig
+from .response_cache import ResponseCache
+from .retry import RetryPolicy
+from .scheduler import RequestScheduler
+
+
+@dataclass
+class FleetEvent:
+    """Device event class.
+
+    Attributes:
+        account -- name of the account
+        sn -- device serial number
+        topic -- MQTT topic
+        payload -- raw message payload
+    """
+
+    account: str
+    sn: str
+    topic: str
+    payload: bytes
+
+
+@dataclass
+class FleetResources:
+    """Fleet resource usage class.
+
+    Attributes:
+        accounts -- number of accounts
+        http_pools -- number of HTTP connection pools
+        http_connections -- open HTTP connections, in use and idle
+        mqtt_connections -- open shared MQTT connections
+        threads -- threads in the process
+        dropped_events -- total number of events dropped as nobody read them
+    """
+
+    accounts: int = 0
+    http_pools: int = 0
+    http_connections: int = 0
+    mqtt_connections: int = 0
+    threads: int = 0
+    dropped_events: int = 0
+
+
+class KarcherFleet:
+    """Manager of many accounts.
+
+    Accounts share a single HTTP connection pool manager per region. MQTT
+    connections are shared only by accounts of the same user logged in with
+    the same token, otherwise one MQTT connection is opened per account.
+    Events of subscribed devices of all accounts are delivered through a
+    single stream tagged by account and device.
+    """
+
+    def __init__(
+            self,
+            pool_config: PoolConfig = None,
+            scheduler: RequestScheduler = None,
+            response_cache: ResponseCache = None,
+            domain_cache: DomainCache = None,
+            map_cache: MapCache = None,
+            executor: Executor = None,
+            retry_policy: RetryPolicy = None,
+            mqtt_hub: MqttHub = None,
+            max_events: int = 1000):
+        self._pool_config = pool_config
+        self.scheduler = scheduler
+        self.response_cache = response_cache
+        self.domain_cache = domain_cache
+        self.map_cache = map_cache
+        self.executor = executor
+        self.retry_policy = retry_policy
+        self.mqtt_hub = mqtt_hub or MqttHub()
+        self._pools = {}
+        self._accounts = {}
+        self._max_events = max_events
+        self._events = None
+        self._dropped_events = 0
+        self._loop = None
+
+    @property
+    def accounts(self) -> Dict[str, KarcherHome]:
+        """Accounts by name."""
+        return dict(self._accounts)
+
+    def _pool(self, region: Region) -> HttpPoolManager:
+        pool = self._pools.get(region)
+        if pool is None:
+            pool = self._pools[region] = HttpPoolManager(api=self._pool_config)
+        return pool
+
+    async def add_account(
+            self,
+            account: str,
+            country: str = 'GB',
+            language: Language = Language.EN,
+            username: str = None,
+            password: str = None,
+            auth_token: str = None,
+            mqtt_token: str = None) -> KarcherHome:
+        """Add account and login.
+
+        Account logs in with `username` and `password`, in that case session
+        is renewed before it expires, or with `auth_token` and `mqtt_token`.
+        """
+
+        if account in self._accounts:
+            raise ValueError('Account already exists: ' + account)
+        if auth_token is None and (username is None or password is None):
+            raise ValueError('Must provide either token or username and password')
+
+        self._event_queue()
+        kh = await KarcherHome.create(
+            country=country,
+            language=language,
+            map_cache=self.map_cache,
+            executor=self.executor,
+            pool=self._pool(get_region_by_country(country)),
+            response_cache=self.response_cache,
+            domain_cache=self.domain_cache,
+            renew_session=auth_token is None,
+            retry_policy=self.retry_policy,
+            scheduler=self.scheduler,
+            mqtt_hub=self.mqtt_hub)
+        try:
+            if auth_token is not None:
+                kh.login_token(auth_token, mqtt_token or '')
+            else:
+                await kh.login(username, password)
+        except BaseException:
+            await kh.close()
+            raise
+
+        kh.on_device_message = lambda sn, topic, msg: self._on_message(
+            account, sn, topic, msg)
+        self._accounts[account] = kh
+        return kh
+
+    async def remove_account(self, account: str):
+        """Remove account and close its connections."""
+
+        kh = self._accounts.pop(account)
+        kh.on_device_message = None
+        await kh.close()
+
+    def subscribe_device(self, account: str, dev: Device):
+        """Subscribe to device events of account."""
+        self._accounts[account].subscribe_device(dev)
+
+    def unsubscribe_device(self, account: str, dev: Device):
+        """Unsubscribe from device events of account."""
+        self._accounts[account].unsubscribe_device(dev)
+
+    def _event_queue(self) -> asyncio.Queue:
+        if self._events is None:
+            self._loop = asyncio.get_running_loop()
+            self._events = asyncio.Queue(self._max_events)
+        return self._events
+
+    def _on_message(self, account: str, sn: str, topic: str, msg: bytes):
+        # Called in MQTT network thread
+        event = FleetEvent(account, sn, topic, msg)
+        try:
+            self._loop.call_soon_threadsafe(self._put_event, event)
+        except RuntimeError:
+            # Event loop was closed on shutdown before MQTT connection
+            pass
+
+    def _put_event(self, event: FleetEvent):
+        if self._events.full():
+            # Oldest events are dropped first
+            self._events.get_nowait()
+            self._dropped_events += 1
+        self._events.put_nowait(event)
+
+    async def events(self) -> AsyncIterator[FleetEvent]:
+        """Stream events of subscribed devices of all accounts."""
+        queue = self._event_queue()
+        while True:
+            yield await queue.get()
+
+    def resources(self) -> FleetResources:
+        """Get resource usage of the fleet."""
+
+        connections = 0
+        for pool in self._pools.values():
+            for stats in pool.stats().values():
+                connections += stats.in_use + stats.idle
+        return FleetResources(
+            accounts=len(self._accounts),
+            http_pools=len(self._pools),
+            http_connections=connections,
+            mqtt_connections=self.mqtt_hub.connections,
+            threads=threading.active_count(),
+            dropped_events=self._dropped_events)
+
+    def pool(self, region: Region) -> Optional[HttpPoolManager]:
+        """Get HTTP connection pool manager of region."""
+        return self._pools.get(region)
+
+    async def close(self):
+        """Close all accounts and connections."""
+
+        for account in list(self._accounts.keys()):
+            await self.remove_account(account)
+        for pool in self._pools.values():
+            await pool.close()
+        self._pools = {}
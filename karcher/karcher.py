@@ -3,14 +3,21 @@
 # SPDX-License-Identifier: MIT
 # -----------------------------------------------------------
 
+import asyncio
 import collections
+from concurrent.futures import Executor
+import contextlib
+import copy
 import json
 import threading
-from typing import List, Any
+import time
+from typing import AsyncIterator, Callable, Iterable, List, Any, Optional, Tuple
 import aiohttp
 import urllib.parse
 
 from .auth import Domains, Session
+from .cache import DomainCache, MapCache
+from .coalesce import COALESCED_ENDPOINTS, SingleFlight
 from .countries import get_country_code, get_region_by_country
 from .consts import (
     APP_VERSION_CODE, APP_VERSION_NAME, PROJECT_TYPE, PROTOCOL_VERSION,
@@ -18,15 +25,34 @@ from .consts import (
     Language, Region
 )
 from .device import Device, DeviceProperties
-from .exception import KarcherHomeAccessDenied, KarcherHomeException, handle_error_code
+from .exception import (
+    KarcherHomeAccessDenied, KarcherHomeException, KarcherHomeHttpError,
+    KarcherHomeTokenExpired, handle_error_code
+)
+from .executor import (
+    attach_shared_map, decode_map, decode_map_shared, is_shared_memory_executor,
+    release_discarded_map
+)
 from .map import Map
-from .mqtt import MqttClient, get_device_topic_property_get_reply, get_device_topics
+from .mqtt import (
+    MqttClient, MqttHub, get_device_topic_property_get_reply, get_device_topics
+)
+from .pool import HttpPoolManager
+from .response_cache import ResponseCache
+from .retry import DOWNLOAD_ENDPOINT, LatencyTracker, RetryPolicy, hedged
+from .scheduler import RequestScheduler
+from .session import REPLAYED_ERROR_CODES, SessionManager
 from .user import UserProfile
 from .utils import (
-    decrypt, decrypt_map, encrypt, get_nonce, get_random_string,
+    MapDecoder, decrypt, encrypt, get_nonce, get_random_string,
     get_timestamp, get_timestamp_ms, is_email, md5
 )
 
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Connections are pooled by SSL context, so same fingerprint object is reused
+SSL_FINGERPRINT = aiohttp.Fingerprint(SSL_CERTIFICATE_THUMBPRINT)
+
 
 class KarcherHome:
     """Main class to access Karcher Home Robots API"""
@@ -36,24 +62,83 @@ class KarcherHome:
             cls,
             country: str = 'GB',
             language: Language = Language.EN,
-            session: aiohttp.ClientSession = None):
-        """Create Karcher Home Robots API instance"""
+            session: aiohttp.ClientSession = None,
+            map_cache: MapCache = None,
+            executor: Executor = None,
+            pool: HttpPoolManager = None,
+            coalesce: Iterable[str] = COALESCED_ENDPOINTS,
+            response_cache: ResponseCache = None,
+            domain_cache: DomainCache = None,
+            renew_session: bool = False,
+            retry_policy: RetryPolicy = None,
+            scheduler: RequestScheduler = None,
+            mqtt_hub: MqttHub = None):
+        """Create Karcher Home Robots API instance.
+
+        If `executor` is provided, map decryption and parsing is done in it
+        instead of the event loop. With `ProcessPoolExecutor` map grids are
+        transferred back through shared memory.
+
+        HTTP connections are taken from `pool` if it is provided, it can be
+        shared between instances. Otherwise instance creates its own pool,
+        unless `session` is provided that is then used for all requests.
+
+        Concurrent identical calls to `coalesce` endpoints, named after
+        methods of this class, share a single request.
+
+        If `response_cache` is provided, responses of endpoints that it has
+        TTL for are returned from it while they are fresh.
+
+        If `domain_cache` has domains for the region, they are used without
+        waiting for a request and are revalidated in the background once
+        they are stale.
+
+        If `renew_session` is set, session of `login` is renewed by logging
+        in again before it expires, and requests that fail because of expired
+        token are replayed once after renewal.
+
+        Request timeouts and retries of transient errors follow
+        `retry_policy`, or default `RetryPolicy` if it is not provided.
+
+        API requests are rate limited by `scheduler` if it is provided, it
+        can be shared between instances.
+
+        MQTT connection is taken from `mqtt_hub` if it is provided, so that
+        instances logged in with the same credentials share it.
+        """
 
         self = KarcherHome()
         self._country = country.upper()
         self._base_url = REGION_URLS[get_region_by_country(self._country)]
         self._language = language
+        self._map_cache = map_cache
+        self._executor = executor
+        self.single_flight = SingleFlight(coalesce)
+        self.response_cache = response_cache
+        if retry_policy is not None:
+            self.retry_policy = retry_policy
+        self.scheduler = scheduler
+        self._mqtt_hub = mqtt_hub
+        if renew_session:
+            self.session_manager = SessionManager(self._renew_session)
 
         if session is not None:
-            self._http_external = True
             self._http = session
-
-        data = await self.get_urls()
-        # Update base URLs
-        if data.app_api != '':
-            self._base_url = data.app_api
-        if data.mqtt != '':
-            self._mqtt_url = data.mqtt
+        if pool is not None:
+            self._pool_external = True
+            self._pool = pool
+
+        self._domain_cache = domain_cache
+        if domain_cache is not None:
+            entry = domain_cache.get(get_region_by_country(self._country))
+            if entry is not None:
+                self._set_domains(entry.domains)
+                if domain_cache.is_stale(entry):
+                    self._domains_refresh = asyncio.ensure_future(
+                        self._refresh_domains(background=True))
+                return self
+
+        await self._refresh_domains()
 
         return self
 
@@ -70,24 +155,87 @@ class KarcherHome:
         self._device_props = {}
         self._wait_events = {}
         self._http = None
-        self._http_external = False
+        self._pool = None
+        self._pool_external = False
+        self._map_cache = None
+        self._executor = None
+        self.single_flight = SingleFlight()
+        self.response_cache = None
+        self._domain_cache = None
+        self._domains_refresh = None
+        self.session_manager = None
+        self._credentials = None
+        self.retry_policy = RetryPolicy()
+        self._download_latency = LatencyTracker()
+        self.scheduler = None
+        self._mqtt_hub = None
+        # Called with device serial number, topic and payload of messages
+        # from subscribed devices, in MQTT network thread
+        self.on_device_message = None
 
     async def close(self):
         """Close underlying connections"""
 
+        if self.session_manager is not None:
+            self.session_manager.close()
+
+        if self._domains_refresh is not None:
+            self._domains_refresh.cancel()
+            self._domains_refresh = None
+
         if self._mqtt is not None:
             self._mqtt.disconnect()
             self._mqtt = None
 
+        # External session and shared pool are closed by their owners
+        self._http = None
+        if self._pool is not None:
+            if not self._pool_external:
+                await self._pool.close()
+            self._pool = None
+
+    def _set_domains(self, data: Domains):
+        # Update base URLs
+        if data.app_api != '':
+            self._base_url = data.app_api
+        if data.mqtt != '':
+            self._mqtt_url = data.mqtt
+
+    async def _refresh_domains(self, background: bool = False):
+        region = get_region_by_country(self._country)
+        try:
+            # Cached API domain might be the one that no longer works
+            data = await self._get_urls(REGION_URLS[region])
+        except (KarcherHomeException, aiohttp.ClientError, asyncio.TimeoutError):
+            if not background:
+                raise
+            # Keep using cached domains until next revalidation
+            return
+        finally:
+            if background:
+                self._domains_refresh = None
+        self._set_domains(data)
+        if self._domain_cache is not None:
+            self._domain_cache.put(region, data)
+
+    def _get_session(self, cdn: bool = False) -> aiohttp.ClientSession:
         if self._http is not None:
-            if not self._http_external:
-                await self._http.close()
-            self._http = None
+            return self._http
+        if self._pool is None:
+            self._pool_external = False
+            self._pool = HttpPoolManager()
+        return self._pool.cdn_session if cdn else self._pool.api_session
 
-    async def _request(self, method: str, url: str, **kwargs) -> aiohttp.ClientResponse:
-        if self._http is None:
-            self._http_external = False
-            self._http = aiohttp.ClientSession()
+    async def _request(
+            self,
+            method: str,
+            url: str,
+            endpoint: str = None,
+            base_url: str = None,
+            **kwargs) -> aiohttp.ClientResponse:
+        if self.scheduler is not None:
+            await self.scheduler.acquire(
+                get_region_by_country(self._country), endpoint or url)
 
         headers = {}
         if kwargs.get('headers') is not None:
@@ -134,29 +282,54 @@ class KarcherHome:
         headers['nonce'] = nonce
 
         kwargs['headers'] = headers
-        kwargs['ssl'] = aiohttp.Fingerprint(SSL_CERTIFICATE_THUMBPRINT)
-        return await self._http.request(method, self._base_url + url, **kwargs)
+        kwargs['ssl'] = SSL_FINGERPRINT
+        return await self._get_session().request(
+            method, (base_url or self._base_url) + url, **kwargs)
 
-    async def _download(self, url) -> bytes:
+    async def _download(self, url, decoder: MapDecoder = None) -> bytes:
+        data, _ = await self._download_etag(url, decoder)
+        return data
+
+    async def _download_etag(
+            self,
+            url,
+            decoder: MapDecoder = None,
+            etag: str = None) -> Tuple[Optional[bytes], str]:
         headers = {
             'User-Agent': 'Android_' + TENANT_ID,
         }
+        if etag:
+            headers['If-None-Match'] = etag
 
-        resp = await self._http.get(url, headers=headers)
+        resp = await self._get_session(cdn=True).get(
+            url, headers=headers,
+            timeout=self.retry_policy.client_timeout(DOWNLOAD_ENDPOINT))
+        if resp.status == 304 and etag:
+            resp.close()
+            return None, etag
         if resp.status != 200:
-            raise KarcherHomeException(-1,
-                                       'HTTP error: ' + str(resp.status_code))
+            resp.close()
+            raise KarcherHomeHttpError(resp.status)
 
-        data = await resp.content.read(-1)
-        resp.close()
+        etag = resp.headers.get('ETag', '')
+        if decoder is None:
+            data = await resp.content.read(-1)
+            resp.close()
+            return data, etag
 
-        return data
+        # Decode payload while it is being downloaded
+        try:
+            async for chunk in resp.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                decoder.update(chunk)
+        finally:
+            resp.close()
+
+        return decoder.finalize(), etag
 
     async def _process_response(self, resp: aiohttp.ClientResponse, prop=None) -> Any:
         if resp.status != 200:
             resp.close()
-            raise KarcherHomeException(-1,
-                                       'HTTP error: ' + str(resp.status))
+            raise KarcherHomeHttpError(resp.status)
         data = await resp.json()
         resp.close()
 
@@ -174,6 +347,102 @@ class KarcherHome:
             return json.loads(decrypt(result[prop]))
         return result
 
+    async def _call(
+            self,
+            endpoint: str,
+            method: str,
+            url: str,
+            prop=None,
+            **kwargs) -> Any:
+        """Make API request and process its response.
+
+        Concurrent identical calls are coalesced if enabled for `endpoint`.
+        Transient errors are retried according to retry policy. Call failed
+        because of expired token is replayed once if session is renewed.
+        """
+
+        async def attempt():
+            resp = await self._request(
+                method, url, endpoint,
+                timeout=self.retry_policy.client_timeout(endpoint), **kwargs)
+            return await self._process_response(resp, prop)
+
+        async def call():
+            return await self.retry_policy.run(endpoint, attempt)
+
+        def key():
+            auth = self._session.auth_token if self._session is not None else ''
+            return (method, url, auth, json.dumps(kwargs, sort_keys=True, default=str))
+
+        session = self._session
+        try:
+            return await self.single_flight.run(endpoint, key(), call)
+        except KarcherHomeException as ex:
+            if ex.code not in REPLAYED_ERROR_CODES or self.session_manager is None \
+                    or session is None or endpoint in ('login', 'logout'):
+                raise
+            try:
+                await self.session_manager.renew(session)
+            except KarcherHomeException:
+                raise ex
+        return await self.single_flight.run(endpoint, key(), call)
+
+    async def _cached_call(
+            self,
+            endpoint: str,
+            build: Callable[[Any], Any],
+            method: str,
+            url: str,
+            prop=None,
+            shared: bool = False,
+            **kwargs) -> Any:
+        """Make API call and build result, using response cache if set.
+
+        Built results are cached, so they are not decoded again on hit,
+        and each caller gets its own copy of them. Responses are cached per
+        user unless `shared` is set.
+        """
+
+        cache = self.response_cache
+        if cache is None or not cache.enabled(endpoint):
+            return build(await self._call(endpoint, method, url, prop, **kwargs))
+
+        user_id = ''
+        if not shared and self._session is not None:
+            user_id = self._session.user_id
+        key = json.dumps(
+            [self._base_url, method, url, kwargs], sort_keys=True, default=str)
+        value, raw = await self._cache_io(cache.get, endpoint, key, user_id)
+        if value is not None:
+            return copy.deepcopy(value)
+        if raw is not None:
+            # Loaded from disk
+            value = build(raw)
+            cache.put(endpoint, key, copy.deepcopy(value), raw, False, user_id)
+            return value
+
+        raw = await self._call(endpoint, method, url, prop, **kwargs)
+        value = build(raw)
+        await self._cache_io(
+            cache.put, endpoint, key, copy.deepcopy(value), raw, True, user_id)
+        return value
+
+    def invalidate_cache(self, *endpoints: str):
+        """Invalidate cached responses of given endpoints, or all if none given.
+
+        Should be called after changes that are not made through this
+        instance, for example after binding a new device.
+        """
+
+        if self.response_cache is not None:
+            self.response_cache.invalidate(*endpoints)
+
+    def _invalidate_user_cache(self, user_id: str):
+        # Responses of other users sharing the cache are kept
+        if self.response_cache is not None:
+            self.response_cache.invalidate(
+                'get_user_info', 'get_devices', scope=user_id)
+
     def _mqtt_connect(self, wait_for_connect=False):
         if self._session is None \
                 or self._session.mqtt_token == '' or self._session.user_id == '':
@@ -184,11 +453,18 @@ class KarcherHome:
 
         u = urllib.parse.urlparse("//" + self._mqtt_url)
 
-        self._mqtt = MqttClient(
-            host=u.hostname,
-            port=u.port,
-            username=self._session.user_id,
-            password=self._session.mqtt_token)
+        if self._mqtt_hub is not None:
+            self._mqtt = self._mqtt_hub.client(
+                host=u.hostname,
+                port=u.port,
+                username=self._session.user_id,
+                password=self._session.mqtt_token)
+        else:
+            self._mqtt = MqttClient(
+                host=u.hostname,
+                port=u.port,
+                username=self._session.user_id,
+                password=self._session.mqtt_token)
 
         # Special logic for waiting for connection
         event = None
@@ -206,25 +482,41 @@ class KarcherHome:
     async def get_urls(self) -> Domains:
         """Get URLs for API and MQTT."""
 
-        resp = await self._request('GET', '/network-service/domains/list', params={
-            'tenantId': TENANT_ID,
-            'productModeCode': PROJECT_TYPE,
-            'version': PROTOCOL_VERSION,
-        })
+        return await self._get_urls()
 
-        data = await self._process_response(resp, 'domain')
-        return Domains(**data)
+    async def _get_urls(self, base_url: str = None) -> Domains:
+        return await self._cached_call(
+            'get_urls', lambda data: Domains(**data),
+            'GET', '/network-service/domains/list', 'domain', shared=True,
+            base_url=base_url, params={
+                'tenantId': TENANT_ID,
+                'productModeCode': PROJECT_TYPE,
+                'version': PROTOCOL_VERSION,
+            })
 
     async def login(self, username, password, register_id=None) -> Session:
-        """Login using provided credentials."""
+        """Login using provided credentials.
+
+        If session renewal is enabled, credentials are kept in memory to
+        login again when session expires.
+        """
 
         if register_id is None or register_id == '':
             register_id = get_random_string(19)
 
+        await self._login(username, password, register_id)
+        await self._cache_io(self._invalidate_user_cache, self._session.user_id)
+        if self.session_manager is not None:
+            self._credentials = (username, password)
+            self.session_manager.track(self._session)
+
+        return self._session
+
+    async def _login(self, username, password, register_id) -> Session:
         if not is_email(username):
             username = '86-' + username
 
-        resp = await self._request('POST', '/user-center/auth/login', json={
+        data = await self._call('login', 'POST', '/user-center/auth/login', json={
             'tenantId': TENANT_ID,
             'lang': str(self._language),
             'token': None,
@@ -242,13 +534,17 @@ class KarcherHome:
                 'android': register_id,
             },
         })
-
-        data = await self._process_response(resp)
         self._session = Session(**data)
         self._session.register_id = register_id
 
         return self._session
 
+    async def _renew_session(self) -> Session:
+        if self._credentials is None:
+            raise KarcherHomeTokenExpired()
+        username, password = self._credentials
+        return await self._login(username, password, self._session.register_id)
+
     def login_token(
             self,
             auth_token: str,
@@ -261,6 +557,11 @@ class KarcherHome:
 
         self._session = Session.from_token(auth_token, mqtt_token)
         self._session.register_id = register_id
+        self._invalidate_user_cache(self._session.user_id)
+        if self.session_manager is not None:
+            # Tokens can not be renewed without credentials
+            self._credentials = None
+            self.session_manager.track(None)
 
         return self._session
 
@@ -274,9 +575,13 @@ class KarcherHome:
             self._session = None
             return
 
-        await self._process_response(await self._request(
-            'POST', '/user-center/auth/logout'))
+        await self._call('logout', 'POST', '/user-center/auth/logout')
+        user_id = self._session.user_id
         self._session = None
+        self._credentials = None
+        if self.session_manager is not None:
+            self.session_manager.track(None)
+        await self._cache_io(self._invalidate_user_cache, user_id)
 
         await self.close()
 
@@ -287,12 +592,9 @@ class KarcherHome:
                 or self._session.auth_token == '' or self._session.user_id == '':
             raise KarcherHomeAccessDenied('Not authorized')
 
-        resp = await self._request(
-            'GET',
-            '/user-center/app/user/profile')
-        data = await self._process_response(resp)
-
-        return UserProfile(**data)
+        return await self._cached_call(
+            'get_user_info', lambda data: UserProfile(**data),
+            'GET', '/user-center/app/user/profile')
 
     async def get_devices(self) -> List[Device]:
         """Get all user devices."""
@@ -301,39 +603,171 @@ class KarcherHome:
                 or self._session.auth_token == '' or self._session.user_id == '':
             raise KarcherHomeAccessDenied('Not authorized')
 
-        resp = await self._request(
-            'GET',
+        return await self._cached_call(
+            'get_devices', lambda data: [Device(**d) for d in data], 'GET',
             '/smart-home-service/smartHome/user/getDeviceInfoByUserId/'
             + self._session.user_id)
 
-        return [Device(**d) for d in await self._process_response(resp)]
+    async def get_map_data(self, dev: Device, map: int = 1, upload_date: int = None):
+        """Get device map.
 
-    async def get_map_data(self, dev: Device, map: int = 1):
+        If map cache is configured and `upload_date` matches cached map
+        upload date, map is returned from cache without any requests.
+        Otherwise cached map is revalidated using its ETag.
+        """
+
+        return await self._get_map_data(
+            dev, map, upload_date, offload=self._executor is not None)
+
+    async def get_maps(
+            self,
+            maps: Iterable[Tuple[Device, int]],
+            concurrency: int = 4,
+            return_exceptions: bool = False
+    ) -> AsyncIterator[Tuple[Device, int, Any]]:
+        """Get multiple maps concurrently.
+
+        Yields `(device, map_id, map)` tuples in order of completion. At most
+        `concurrency` maps are requested and downloaded at the same time,
+        decryption and parsing is done outside of the event loop. If
+        `return_exceptions` is set, errors are yielded in place of the map.
+        """
+
+        sem = asyncio.Semaphore(concurrency)
+
+        async def fetch(dev: Device, map_id: int):
+            try:
+                return dev, map_id, await self._get_map_data(
+                    dev, map_id, sem=sem, offload=True)
+            except Exception as ex:
+                if not return_exceptions:
+                    raise
+                return dev, map_id, ex
+
+        tasks = [asyncio.ensure_future(fetch(dev, map_id)) for dev, map_id in maps]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _get_map_data(
+            self,
+            dev: Device,
+            map: int,
+            upload_date: int = None,
+            sem: asyncio.Semaphore = None,
+            offload: bool = False):
+        cache = self._map_cache
+        cached = None
+        # Cache counts a miss on every failed read
+        missed = False
+        if cache is not None:
+            cached = cache.lookup(dev.sn, map)
+            if cached is not None and upload_date is not None \
+                    and cached.upload_date == upload_date:
+                data = await self._cache_io(cache.get, dev.sn, map)
+                if data is not None:
+                    _, result = await self._decode_map(dev, map, data, False, offload)
+                    return result
+                # Cached data is gone, so it can not be revalidated
+                cached = None
+                missed = True
+
+        async with sem or contextlib.nullcontext():
+            data, etag = await self._fetch_map(
+                dev, map, cached.etag if cached is not None else None, offload)
+            if data is None:
+                # Not modified since cached
+                data = await self._cache_io(cache.get, dev.sn, map)
+                if data is not None:
+                    _, result = await self._decode_map(dev, map, data, False, offload)
+                    return result
+                missed = True
+                data, etag = await self._fetch_map(dev, map, None, offload)
+
+        # Payload is decrypted while downloading unless decoding is offloaded
+        data, result = await self._decode_map(dev, map, data, offload, offload)
+        if cache is not None:
+            if not missed:
+                cache.add_miss()
+            upload_date = 0
+            if isinstance(result, Map) and result.ext_info is not None:
+                upload_date = result.ext_info.map_upload_date
+            await self._cache_io(cache.put, dev.sn, map, data, upload_date, etag)
+        return result
+
+    async def _cache_io(self, fn: Callable[..., Any], *args) -> Any:
+        # Caches read and write files, which would block the event loop
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    async def _fetch_map(
+            self,
+            dev: Device,
+            map: int,
+            etag: str = None,
+            raw: bool = False) -> Tuple[Optional[bytes], str]:
         # <tenantId>/<modeType>/<deviceSn>/01-01-2022/map/temp/0046690461_<deviceSn>_1
         mapDir = TENANT_ID + '/' + dev.product_mode_code + '/' +\
             dev.sn + '/01-01-2022/map/temp/0046690461_' + \
             dev.sn + '_' + str(map)
 
-        resp = await self._request('POST',
-                                   '/storage-management/storage/aws/getAccessUrl',
-                                   json={
-                                       'dir': mapDir,
-                                       'countryCode': get_country_code(self._country),
-                                       'serviceType': 2,
-                                       'tenantId': TENANT_ID,
-                                   })
-
-        data = await self._process_response(resp)
+        data = await self._call(
+            'get_map_access_url', 'POST',
+            '/storage-management/storage/aws/getAccessUrl', json={
+                'dir': mapDir,
+                'countryCode': get_country_code(self._country),
+                'serviceType': 2,
+                'tenantId': TENANT_ID,
+            })
         downloadUrl = data['url']
         if 'cdnDomain' in data and data['cdnDomain'] != '':
             downloadUrl = 'https://' + data['cdnDomain'] + '/' + data['dir']
 
-        data = await self._download(downloadUrl)
-        data = decrypt_map(dev.sn, dev.mac, dev.product_id, data)
-        if map == 1 or map == 2:
-            return Map.parse(data)
-        else:
-            return json.loads(data)
+        async def attempt():
+            decoder = None
+            if not raw:
+                decoder = MapDecoder(dev.sn, dev.mac, dev.product_id)
+            start = time.monotonic()
+            result = await self._download_etag(downloadUrl, decoder, etag)
+            self._download_latency.add(time.monotonic() - start)
+            return result
+
+        async def download():
+            delay = None
+            if self.retry_policy.hedge:
+                delay = self._download_latency.percentile(95)
+            return await hedged(attempt, delay)
+
+        return await self.retry_policy.run(DOWNLOAD_ENDPOINT, download)
+
+    async def _decode_map(
+            self,
+            dev: Device,
+            map: int,
+            data: bytes,
+            encrypted: bool,
+            offload: bool) -> Tuple[bytes, Any]:
+        if not offload:
+            return decode_map(dev.sn, dev.mac, dev.product_id, map, data, encrypted)
+
+        loop = asyncio.get_running_loop()
+        if is_shared_memory_executor(self._executor):
+            future = loop.run_in_executor(
+                self._executor, decode_map_shared, dev.sn, dev.mac, dev.product_id,
+                map, data, encrypted, self._map_cache is not None)
+            try:
+                result = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # Worker still completes, its shared memory has to be released
+                future.add_done_callback(release_discarded_map)
+                raise
+            return attach_shared_map(result)
+
+        return await loop.run_in_executor(
+            self._executor, decode_map, dev.sn, dev.mac, dev.product_id,
+            map, data, encrypted)
 
     def subscribe_device(self, dev: Device):
         """Subscribe to device real-time events."""
@@ -372,6 +806,9 @@ class KarcherHome:
                 self._wait_events[topic].set()
             return
 
+        if self.on_device_message is not None:
+            self.on_device_message(sn, topic, msg)
+
         if 'thing/event/property/post' in topic \
                 or 'thing/event/cur_path/post' in topic \
                 or 'upgrade/post' in topic:
@@ -456,3 +893,4 @@ class KarcherHome:
             self.unsubscribe_device(dev)
 
         return props
+
@@ -0,0 +1,64 @@
+# -----------------------------------------------------------
+# Copyright (c) 2023 Lauris BH
+# SPDX-License-Identifier: MIT
+# -----------------------------------------------------------
+
+"""Thread-safe in-memory LRU cache."""
+
+import collections
+import threading
+from typing import Any, Callable, Hashable, List, Optional
+
+
+class LRUCache:
+    """Least recently used cache of at most `max_size` entries.
+
+    Values are computed outside of the lock, so concurrent misses of the same
+    key might compute it more than once, and the last stored value is kept.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Get cached value and mark it as recently used, `None` if missing."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        """Store value, evicting least recently used ones over size limit."""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_or_put(self, key: Hashable, build: Callable[[], Any]) -> Any:
+        """Get cached value or build and store a new one."""
+        value = self.get(key)
+        if value is None:
+            value = build()
+            self.put(key, value)
+        return value
+
+    def pop(self, key: Hashable) -> Optional[Any]:
+        """Remove cached value and return it, `None` if missing."""
+        with self._lock:
+            return self._entries.pop(key, None)
+
+    def remove(self, match: Callable[[Hashable], bool]) -> List[Hashable]:
+        """Remove cached values with keys that `match`, return removed keys."""
+        with self._lock:
+            keys = [k for k in self._entries.keys() if match(k)]
+            for k in keys:
+                del self._entries[k]
+        return keys
@@ -3,23 +3,729 @@
 # SPDX-License-Identifier: MIT
 # -----------------------------------------------------------
 
+import base64
+from dataclasses import dataclass
+from functools import cached_property
+import hashlib
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
 from google.protobuf.json_format import MessageToDict
+import numpy as np
 
 from . import mapdata_pb2
+from .diff import MapDiff, apply_patch, diff_maps
+from .exception import KarcherHomeException
+from .path import simplify_path
+from .rooms import RoomOutline, RoomStats, compute_room_stats, room_outlines
+from .spatial import SpatialIndex
 from .utils import snake_case, snake_case_fields
 
+# Map sections that are part of the map layout version
+LAYOUT_FIELDS = (
+    'virtualWalls', 'areasInfo', 'navigationPoints', 'roomDataInfo',
+    'roomChain', 'objects', 'furnitureInfo',
+)
+
+# Map sections holding large grids
+_GRID_FIELDS = ('mapData', 'roomMatrix')
+
+
+@dataclass
+class MapExtInfo:
+    """Map extended information class."""
+    __slots__ = ('task_begin_date', 'map_upload_date', 'map_valid', 'angle')
+
+    task_begin_date: int
+    map_upload_date: int
+    map_valid: int
+    angle: float
+
+    @staticmethod
+    def from_pb(pb: mapdata_pb2.MapExtInfo):
+        return MapExtInfo(pb.taskBeginDate, pb.mapUploadDate, pb.mapValid, pb.angle)
+
+
+@dataclass
+class MapHead:
+    """Map header class.
+
+    Describes map grid size and its placement in world coordinates.
+    """
+    __slots__ = ('map_head_id', 'size_x', 'size_y', 'min_x', 'min_y',
+                 'max_x', 'max_y', 'resolution')
+
+    map_head_id: int
+    size_x: int
+    size_y: int
+    min_x: float
+    min_y: float
+    max_x: float
+    max_y: float
+    resolution: float
+
+    @staticmethod
+    def from_pb(pb: mapdata_pb2.MapHeadInfo):
+        return MapHead(pb.mapHeadId, pb.sizeX, pb.sizeY, pb.minX, pb.minY,
+                       pb.maxX, pb.maxY, pb.resolution)
+
+    def to_pb(self) -> mapdata_pb2.MapHeadInfo:
+        return mapdata_pb2.MapHeadInfo(
+            mapHeadId=self.map_head_id, sizeX=self.size_x, sizeY=self.size_y,
+            minX=self.min_x, minY=self.min_y, maxX=self.max_x, maxY=self.max_y,
+            resolution=self.resolution)
+
+
+@dataclass
+class MapInfo:
+    """Stored map information class."""
+    __slots__ = ('map_head_id', 'map_name')
+
+    map_head_id: int
+    map_name: str
+
+    @staticmethod
+    def from_pb(pb: mapdata_pb2.AllMapInfo):
+        return MapInfo(pb.mapHeadId, pb.mapName)
+
+
+@dataclass
+class MapPoint:
+    """Map point class."""
+    __slots__ = ('x', 'y')
+
+    x: float
+    y: float
+
+    @staticmethod
+    def from_pb(pb: mapdata_pb2.DevicePointInfo):
+        return MapPoint(pb.x, pb.y)
+
+    def to_pb(self) -> mapdata_pb2.DevicePointInfo:
+        return mapdata_pb2.DevicePointInfo(x=self.x, y=self.y)
+
+
+@dataclass(eq=False)
+class HistoryPose:
+    """Robot path history class.
+
+    Path is stored as `(N, 2)` float32 array of world coordinates, with
+    `update` flags of each point in a matching int32 array.
+    """
+    __slots__ = ('pose_id', 'points', 'update')
+
+    pose_id: int
+    points: np.ndarray
+    update: np.ndarray
+
+    @staticmethod
+    def from_pb(pb: mapdata_pb2.DeviceHistoryPoseInfo):
+        n = len(pb.points)
+        points = np.fromiter(
+            (v for p in pb.points for v in (p.x, p.y)), dtype=np.float32, count=n * 2)
+        update = np.fromiter((p.update for p in pb.points), dtype=np.int32, count=n)
+        return HistoryPose(pb.poseId, points.reshape(n, 2), update)
+
+    def simplify(self, tolerance: float, method: str = 'rdp') -> np.ndarray:
+        """Get simplified path points."""
+        return simplify_path(self.points, tolerance, method)
+
+
+@dataclass
+class Pose:
+    """Pose class."""
+    __slots__ = ('x', 'y', 'phi')
+
+    x: float
+    y: float
+    phi: float
+
+    @staticmethod
+    def from_pb(pb: mapdata_pb2.DevicePoseDataInfo):
+        return Pose(pb.x, pb.y, pb.phi)
+
+    def to_pb(self) -> mapdata_pb2.DevicePoseDataInfo:
+        return mapdata_pb2.DevicePoseDataInfo(x=self.x, y=self.y, phi=self.phi)
+
+
+@dataclass
+class CurrentPose:
+    """Robot current pose class."""
+    __slots__ = ('pose_id', 'update', 'x', 'y', 'phi')
+
+    pose_id: int
+    update: int
+    x: float
+    y: float
+    phi: float
+
+    @staticmethod
+    def from_pb(pb: mapdata_pb2.DeviceCurrentPoseInfo):
+        return CurrentPose(pb.poseId, pb.update, pb.x, pb.y, pb.phi)
+
+    def to_pb(self) -> mapdata_pb2.DeviceCurrentPoseInfo:
+        return mapdata_pb2.DeviceCurrentPoseInfo(
+            poseId=self.pose_id, update=self.update, x=self.x, y=self.y, phi=self.phi)
+
+
+@dataclass
+class Area:
+    """Map area class.
+
+    Used for both virtual walls and restricted areas.
+    """
+    __slots__ = ('status', 'type', 'area_index', 'points')
+
+    status: int
+    type: int
+    area_index: int
+    points: List[MapPoint]
+
+    @staticmethod
+    def from_pb(pb: mapdata_pb2.DeviceAreaDataInfo):
+        return Area(pb.status, pb.type, pb.areaIndex,
+                    [MapPoint.from_pb(p) for p in pb.points])
+
+    def to_pb(self) -> mapdata_pb2.DeviceAreaDataInfo:
+        return mapdata_pb2.DeviceAreaDataInfo(
+            status=self.status, type=self.type, areaIndex=self.area_index,
+            points=[p.to_pb() for p in self.points])
+
+
+@dataclass
+class NavigationPoint:
+    """Navigation point class."""
+    __slots__ = ('point_id', 'status', 'point_type', 'x', 'y', 'phi')
+
+    point_id: int
+    status: int
+    point_type: int
+    x: float
+    y: float
+    phi: float
+
+    @staticmethod
+    def from_pb(pb: mapdata_pb2.DeviceNavigationPointDataInfo):
+        return NavigationPoint(pb.pointId, pb.status, pb.pointType,
+                               pb.x, pb.y, pb.phi)
+
+    def to_pb(self) -> mapdata_pb2.DeviceNavigationPointDataInfo:
+        return mapdata_pb2.DeviceNavigationPointDataInfo(
+            pointId=self.point_id, status=self.status, pointType=self.point_type,
+            x=self.x, y=self.y, phi=self.phi)
+
+
+@dataclass
+class CleanPreference:
+    """Room cleaning preference class."""
+    __slots__ = ('clean_mode', 'water_level', 'wind_power', 'twice_clean')
+
+    clean_mode: int
+    water_level: int
+    wind_power: int
+    twice_clean: int
+
+    @staticmethod
+    def from_pb(pb: mapdata_pb2.CleanPerferenceDataInfo):
+        return CleanPreference(pb.cleanMode, pb.waterLevel, pb.windPower, pb.twiceClean)
+
+    def to_pb(self) -> mapdata_pb2.CleanPerferenceDataInfo:
+        return mapdata_pb2.CleanPerferenceDataInfo(
+            cleanMode=self.clean_mode, waterLevel=self.water_level,
+            windPower=self.wind_power, twiceClean=self.twice_clean)
+
+
+@dataclass
+class Room:
+    """Room class."""
+    __slots__ = ('room_id', 'room_name', 'room_type_id', 'material_id',
+                 'clean_state', 'room_clean', 'room_clean_index',
+                 'room_name_post', 'clean_preference', 'color_id')
+
+    room_id: int
+    room_name: str
+    room_type_id: int
+    material_id: int
+    clean_state: int
+    room_clean: int
+    room_clean_index: int
+    room_name_post: Optional[MapPoint]
+    clean_preference: Optional[CleanPreference]
+    color_id: int
+
+    @staticmethod
+    def from_pb(pb: mapdata_pb2.RoomDataInfo):
+        return Room(
+            pb.roomId, pb.roomName, pb.roomTypeId, pb.meterialId,
+            pb.cleanState, pb.roomClean, pb.roomCleanIndex,
+            MapPoint.from_pb(pb.roomNamePost)
+            if pb.HasField('roomNamePost') else None,
+            CleanPreference.from_pb(pb.cleanPerfer)
+            if pb.HasField('cleanPerfer') else None,
+            pb.colorId)
+
+    def to_pb(self) -> mapdata_pb2.RoomDataInfo:
+        pb = mapdata_pb2.RoomDataInfo(
+            roomId=self.room_id, roomName=self.room_name,
+            roomTypeId=self.room_type_id, meterialId=self.material_id,
+            cleanState=self.clean_state, roomClean=self.room_clean,
+            roomCleanIndex=self.room_clean_index, colorId=self.color_id)
+        if self.room_name_post is not None:
+            pb.roomNamePost.CopyFrom(self.room_name_post.to_pb())
+        if self.clean_preference is not None:
+            pb.cleanPerfer.CopyFrom(self.clean_preference.to_pb())
+        return pb
+
+
+@dataclass
+class ChainPoint:
+    """Room outline chain point class."""
+    __slots__ = ('x', 'y', 'value')
+
+    x: int
+    y: int
+    value: int
+
+    @staticmethod
+    def from_pb(pb: mapdata_pb2.DeviceChainPointDataInfo):
+        return ChainPoint(pb.x, pb.y, pb.value)
+
+
+@dataclass
+class RoomChain:
+    """Room outline chain class."""
+    __slots__ = ('room_id', 'points')
+
+    room_id: int
+    points: List[ChainPoint]
+
+    @staticmethod
+    def from_pb(pb: mapdata_pb2.DeviceRoomChainDataInfo):
+        return RoomChain(pb.roomId, [ChainPoint.from_pb(p) for p in pb.points])
+
+
+@dataclass
+class MapObject:
+    """Recognized object class."""
+    __slots__ = ('object_id', 'object_type_id', 'object_name', 'confirm',
+                 'x', 'y', 'url')
+
+    object_id: int
+    object_type_id: int
+    object_name: str
+    confirm: int
+    x: float
+    y: float
+    url: str
+
+    @staticmethod
+    def from_pb(pb: mapdata_pb2.ObjectDataInfo):
+        return MapObject(pb.objectId, pb.objectTypeId, pb.objectName,
+                         pb.confirm, pb.x, pb.y, pb.url)
+
+
+@dataclass
+class Furniture:
+    """Furniture class."""
+    __slots__ = ('id', 'type_id', 'points', 'url')
+
+    id: int
+    type_id: int
+    points: List[MapPoint]
+    url: str
+
+    @staticmethod
+    def from_pb(pb: mapdata_pb2.FurnitureDataInfo):
+        return Furniture(pb.id, pb.typeId,
+                         [MapPoint.from_pb(p) for p in pb.points], pb.url)
+
+
+@dataclass
+class House:
+    """House class."""
+    __slots__ = ('id', 'name', 'cur_map_count', 'max_map_size', 'maps')
+
+    id: int
+    name: str
+    cur_map_count: int
+    max_map_size: int
+    maps: List[MapInfo]
+
+    @staticmethod
+    def from_pb(pb: mapdata_pb2.HouseInfo):
+        return House(pb.id, pb.name, pb.curMapCount, pb.maxMapSize,
+                     [MapInfo.from_pb(m) for m in pb.maps])
+
 
 class Map:
+    """Map class.
+
+    This class represents a Karcher Home Robots map.
+
+    Map sections are converted from the underlying protobuf message only
+    when they are first accessed and are cached afterwards.
+
+    Map grids are exposed as NumPy arrays of shape `(size_y, size_x)`
+    indexed as `grid[y, x]`, built directly on top of the protobuf bytes.
+    """
+
+    def __init__(self, robot_map: mapdata_pb2.RobotMap = None):
+        if robot_map is None:
+            robot_map = mapdata_pb2.RobotMap()
+        self._map = robot_map
+
     @staticmethod
-    def parse(data: bytes):
-        m = Map()
+    def parse(data: bytes, fields: Optional[Iterable[str]] = None):
+        """Parse serialized map.
+
+        If `fields` is given, only these top-level protobuf fields are
+        decoded. Grids are then kept as views over `data` without copying.
+        """
+        if fields is not None:
+            fields = list(fields)
+            if 'mapHead' not in fields and any(f in _GRID_FIELDS for f in fields):
+                # Grid size is needed to build grids
+                fields.append('mapHead')
+            values = read_map_fields(data, fields)
+            m = Map(values.pop(None))
+            m.set_grids(values.get('mapData'), values.get('roomMatrix'))
+            return m
         rm = mapdata_pb2.RobotMap()
         rm.ParseFromString(data)
+        return Map(rm)
+
+    @property
+    def robot_map(self) -> mapdata_pb2.RobotMap:
+        """Underlying protobuf message."""
+        return self._map
+
+    @cached_property
+    def data(self) -> Dict[str, Any]:
+        """Map data as a dictionary.
+
+        Kept for compatibility, prefer typed map properties instead.
+        """
         d = {}
-        for k, v in MessageToDict(rm).items():
+        for k, v in MessageToDict(self._map).items():
             if k == 'mapData':
-                v = v['mapData']
+                v = v.get('mapData', '')
             v = snake_case_fields(v)
             d[snake_case(k)] = v
-        setattr(m, 'data', d)
-        return m
+        # Grids set separately from the protobuf message
+        # Selectively parsed message has no submessage at all
+        if d.get('map_data') in (None, '') and self.grid is not None:
+            d['map_data'] = base64.b64encode(self.grid).decode()
+        if d.get('room_matrix') in (None, {}) and self.room_grid is not None:
+            d['room_matrix'] = {'matrix': base64.b64encode(self.room_grid).decode()}
+        return d
+
+    @cached_property
+    def version(self) -> str:
+        """Digest of map layout.
+
+        Covers map head, grids, rooms, areas and objects, but not robot
+        pose or path, so it only changes when the map itself changes.
+        """
+        h = hashlib.blake2b(digest_size=16)
+        h.update(self._map.mapHead.SerializeToString())
+        for grid in (self.grid, self.room_grid):
+            if grid is not None:
+                h.update(len(grid.data).to_bytes(8, 'little'))
+                h.update(grid.data)
+            else:
+                h.update(bytes(8))
+        for name in LAYOUT_FIELDS:
+            items = getattr(self._map, name)
+            h.update(len(items).to_bytes(8, 'little'))
+            for item in items:
+                buf = item.SerializeToString()
+                h.update(len(buf).to_bytes(8, 'little'))
+                h.update(buf)
+        return h.hexdigest()
+
+    @property
+    def map_type(self) -> int:
+        return self._map.mapType
+
+    @cached_property
+    def ext_info(self) -> Optional[MapExtInfo]:
+        if not self._map.HasField('mapExtInfo'):
+            return None
+        return MapExtInfo.from_pb(self._map.mapExtInfo)
+
+    @cached_property
+    def head(self) -> Optional[MapHead]:
+        if not self._map.HasField('mapHead'):
+            return None
+        return MapHead.from_pb(self._map.mapHead)
+
+    @cached_property
+    def map_info(self) -> List[MapInfo]:
+        return [MapInfo.from_pb(m) for m in self._map.mapInfo]
+
+    @cached_property
+    def history_pose(self) -> Optional[HistoryPose]:
+        if not self._map.HasField('historyPose'):
+            return None
+        return HistoryPose.from_pb(self._map.historyPose)
+
+    def simplified_history_path(
+            self,
+            tolerance: float = None,
+            method: str = 'rdp') -> Optional[np.ndarray]:
+        """Get simplified robot path.
+
+        Tolerance defaults to map resolution, so only detail smaller than
+        one map cell is dropped.
+        """
+        if self.history_pose is None:
+            return None
+        if tolerance is None:
+            tolerance = self.resolution
+        return self.history_pose.simplify(tolerance, method)
+
+    @cached_property
+    def charge_station(self) -> Optional[Pose]:
+        if not self._map.HasField('chargeStation'):
+            return None
+        return Pose.from_pb(self._map.chargeStation)
+
+    @cached_property
+    def current_pose(self) -> Optional[CurrentPose]:
+        if not self._map.HasField('currentPose'):
+            return None
+        return CurrentPose.from_pb(self._map.currentPose)
+
+    @cached_property
+    def virtual_walls(self) -> List[Area]:
+        return [Area.from_pb(a) for a in self._map.virtualWalls]
+
+    @cached_property
+    def areas(self) -> List[Area]:
+        return [Area.from_pb(a) for a in self._map.areasInfo]
+
+    @cached_property
+    def navigation_points(self) -> List[NavigationPoint]:
+        return [NavigationPoint.from_pb(p) for p in self._map.navigationPoints]
+
+    @cached_property
+    def rooms(self) -> List[Room]:
+        return [Room.from_pb(r) for r in self._map.roomDataInfo]
+
+    @cached_property
+    def room_chains(self) -> List[RoomChain]:
+        return [RoomChain.from_pb(c) for c in self._map.roomChain]
+
+    @cached_property
+    def objects(self) -> List[MapObject]:
+        return [MapObject.from_pb(o) for o in self._map.objects]
+
+    @cached_property
+    def furniture(self) -> List[Furniture]:
+        return [Furniture.from_pb(f) for f in self._map.furnitureInfo]
+
+    @cached_property
+    def houses(self) -> List[House]:
+        return [House.from_pb(h) for h in self._map.houseInfos]
+
+    @cached_property
+    def room_stats(self) -> Dict[int, RoomStats]:
+        """Area, bounding box, centroid and label position for each room."""
+        return compute_room_stats(self)
+
+    def room_outlines(self, tolerance: Optional[float] = None) -> List[RoomOutline]:
+        """Simplified room outline polygons built from room chains."""
+        return room_outlines(self, tolerance)
+
+    @cached_property
+    def spatial_index(self) -> SpatialIndex:
+        """Spatial index shared by all maps of the same version."""
+        return SpatialIndex.for_map(self)
+
+    def diff(self, other: 'Map') -> MapDiff:
+        """Compute changes from this map to a newer `other` map version."""
+        return diff_maps(self, other)
+
+    def apply_patch(self, diff: MapDiff) -> 'Map':
+        """Apply changes computed by `diff` and return the new map."""
+        return apply_patch(self, diff)
+
+    @property
+    def size_x(self) -> int:
+        """Map grid width in cells."""
+        return self._map.mapHead.sizeX
+
+    @property
+    def size_y(self) -> int:
+        """Map grid height in cells."""
+        return self._map.mapHead.sizeY
+
+    @property
+    def resolution(self) -> float:
+        """Map cell size in meters."""
+        return self._map.mapHead.resolution
+
+    @cached_property
+    def grid(self) -> Optional[np.ndarray]:
+        """Map occupancy grid or `None` if map has no grid data."""
+        if not self._map.HasField('mapData'):
+            return None
+        return self._to_grid(self._map.mapData.mapData, 'mapData')
+
+    @cached_property
+    def room_grid(self) -> Optional[np.ndarray]:
+        """Room ID grid or `None` if map has no room matrix."""
+        if not self._map.HasField('roomMatrix'):
+            return None
+        return self._to_grid(self._map.roomMatrix.matrix, 'roomMatrix')
+
+    def set_grids(self, grid: Optional[np.ndarray], room_grid: Optional[np.ndarray]):
+        """Set map grids that are not part of the protobuf message.
+
+        Used when grids are transferred separately, for example through
+        shared memory from a worker process.
+        """
+        if grid is not None:
+            self.grid = self._to_grid(grid, 'mapData')
+        if room_grid is not None:
+            self.room_grid = self._to_grid(room_grid, 'roomMatrix')
+
+    def _to_grid(self, buf, name: str) -> Optional[np.ndarray]:
+        if isinstance(buf, np.ndarray):
+            buf = buf.reshape(-1)
+        if len(buf) == 0:
+            return None
+        if len(buf) != self.size_x * self.size_y:
+            raise KarcherHomeException(
+                -2, 'Invalid map data: ' + name + ' size ' + str(len(buf))
+                + ' does not match ' + str(self.size_x) + 'x' + str(self.size_y))
+        # Read-only view over the buffer, no copy is made
+        grid = np.frombuffer(buf, dtype=np.uint8).reshape(self.size_y, self.size_x)
+        grid.flags.writeable = False
+        return grid
+
+    def world_to_pixel(
+            self,
+            x: Union[float, np.ndarray],
+            y: Union[float, np.ndarray],
+            fractional: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """Convert world coordinates in meters to grid cell indexes.
+
+        If `fractional` is set, float grid coordinates are returned instead,
+        with cell centers at integer values.
+        """
+        head = self._map.mapHead
+        px = (np.asarray(x, dtype=np.float64) - head.minX) / head.resolution
+        py = (np.asarray(y, dtype=np.float64) - head.minY) / head.resolution
+        if fractional:
+            return px - 0.5, py - 0.5
+        return np.floor(px).astype(np.intp), np.floor(py).astype(np.intp)
+
+    def pixel_to_world(
+            self,
+            px: Union[int, np.ndarray],
+            py: Union[int, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """Convert grid cell indexes to world coordinates of cell centers."""
+        head = self._map.mapHead
+        x = head.minX + (np.asarray(px) + 0.5) * head.resolution
+        y = head.minY + (np.asarray(py) + 0.5) * head.resolution
+        return x, y
+
+    def in_bounds(
+            self,
+            px: Union[int, np.ndarray],
+            py: Union[int, np.ndarray]) -> np.ndarray:
+        """Check if grid cell indexes are inside of the map grid."""
+        px = np.asarray(px)
+        py = np.asarray(py)
+        return (px >= 0) & (px < self.size_x) & (py >= 0) & (py < self.size_y)
+
+
+def _read_varint(data, pos: int) -> Tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        if pos >= len(data) or shift > 63:
+            raise KarcherHomeException(-2, 'Invalid map data: truncated varint')
+        b = data[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def scan_fields(
+        data,
+        start: int = 0,
+        end: Optional[int] = None) -> Dict[int, List[Tuple[int, int, int]]]:
+    """Scan protobuf wire format without decoding field values.
+
+    Returns `(offset, value_offset, end)` byte ranges of each top-level field
+    occurrence by field number, where `offset` is the start of the field tag.
+    For length-delimited fields value starts after the length prefix.
+    """
+
+    if end is None:
+        end = len(data)
+    fields = {}
+    pos = start
+    while pos < end:
+        offset = pos
+        tag, pos = _read_varint(data, pos)
+        number, wire_type = tag >> 3, tag & 7
+        if wire_type == 0:
+            _, value_end = _read_varint(data, pos)
+        elif wire_type == 1:
+            value_end = pos + 8
+        elif wire_type == 2:
+            length, pos = _read_varint(data, pos)
+            value_end = pos + length
+        elif wire_type == 5:
+            value_end = pos + 4
+        else:
+            raise KarcherHomeException(
+                -2, 'Invalid map data: unsupported wire type ' + str(wire_type))
+        if value_end > end:
+            raise KarcherHomeException(-2, 'Invalid map data: truncated field')
+        fields.setdefault(number, []).append((offset, pos, value_end))
+        pos = value_end
+    return fields
+
+
+def read_map_fields(data, fields: Iterable[str]) -> Dict[Optional[str], Any]:
+    """Decode only requested top-level `RobotMap` fields.
+
+    Other fields are skipped without being decoded. `mapData` and
+    `roomMatrix` grids are returned as `memoryview` slices of `data`, all
+    other fields are returned as protobuf values. Fields that are not
+    present in `data` are omitted. The partially decoded `RobotMap` message
+    is returned under `None` key.
+    """
+
+    descriptor = mapdata_pb2.RobotMap.DESCRIPTOR
+    view = memoryview(data)
+    offsets = scan_fields(view)
+    values = {}
+    parts = []
+    for name in fields:
+        field = descriptor.fields_by_name.get(name)
+        if field is None:
+            raise ValueError('Unknown map field: ' + name)
+        occurrences = offsets.get(field.number, [])
+        if name in _GRID_FIELDS:
+            for _, start, end in occurrences:
+                # Inner grid field of the message, last occurrence wins
+                inner = scan_fields(view, start, end).get(1, ())
+                for _, value_start, value_end in inner:
+                    values[name] = view[value_start:value_end]
+        else:
+            parts.extend(view[offset:end] for offset, _, end in occurrences)
+
+    rm = mapdata_pb2.RobotMap()
+    rm.ParseFromString(b''.join(parts))
+    for name in fields:
+        number = descriptor.fields_by_name[name].number
+        if name not in _GRID_FIELDS and number in offsets:
+            values[name] = getattr(rm, name)
+    values[None] = rm
+    return values
@@ -1,6 +1,7 @@
-from typing import List
+from typing import Callable, List
 import ssl
-from paho.mqtt.client import Client, MQTTv311
+import threading
+from paho.mqtt.client import Client, MQTTv311, topic_matches_sub
 
 from .utils import get_random_device_id
 
@@ -77,6 +78,153 @@ class MqttClient:
         self.disconnect()
 
 
+class MqttHub:
+    """Shares MQTT connections between clients with same credentials.
+
+    Connections are keyed by broker, user ID and MQTT token, so only clients
+    of the same account logged in with the same token share a connection,
+    and each account gets a connection of its own otherwise. Connection
+    keeps the credentials it was opened with, so clients created after
+    session renewal get a new connection.
+
+    Each shared connection has a single network thread no matter how many
+    clients use it. Clients get only messages of topics they have
+    subscribed to.
+    """
+
+    def __init__(self, client_factory: Callable[..., MqttClient] = MqttClient):
+        self._client_factory = client_factory
+        self._lock = threading.Lock()
+        self._connections = {}
+
+    @property
+    def connections(self) -> int:
+        """Number of shared connections."""
+        with self._lock:
+            return len(self._connections)
+
+    def client(self, host, port, username, password) -> 'MqttHubClient':
+        """Get client using shared connection."""
+        key = (host, port, username, password)
+        with self._lock:
+            conn = self._connections.get(key)
+            if conn is None:
+                conn = self._connections[key] = _MqttConnection(
+                    self._client_factory(host, port, username, password))
+            client = MqttHubClient(self, conn)
+            conn.clients.append(client)
+        return client
+
+    def _release(self, client: 'MqttHubClient'):
+        conn = client._conn
+        with self._lock:
+            if client not in conn.clients:
+                return
+            conn.clients.remove(client)
+            topics = conn.remove_topics(client.topics)
+            last = len(conn.clients) == 0
+            if last:
+                for k, v in list(self._connections.items()):
+                    if v is conn:
+                        del self._connections[k]
+        if last:
+            if conn.started:
+                conn.client.disconnect()
+        elif len(topics) > 0:
+            conn.client.unsubscribe(topics)
+
+
+class _MqttConnection:
+
+    def __init__(self, client: MqttClient):
+        self.client = client
+        self.clients = []
+        self.topics = {}
+        self.started = False
+        self.connected = False
+        client.on_connect = self._on_connect
+        client.on_message = self._on_message
+
+    def add_topics(self, topics) -> List[str]:
+        added = []
+        for topic in topics:
+            self.topics[topic] = self.topics.get(topic, 0) + 1
+            if self.topics[topic] == 1:
+                added.append(topic)
+        return added
+
+    def remove_topics(self, topics) -> List[str]:
+        removed = []
+        for topic in topics:
+            self.topics[topic] -= 1
+            if self.topics[topic] == 0:
+                del self.topics[topic]
+                removed.append(topic)
+        return removed
+
+    def _on_connect(self):
+        self.connected = True
+        for client in list(self.clients):
+            if client.on_connect is not None:
+                client.on_connect()
+
+    def _on_message(self, topic, payload):
+        for client in list(self.clients):
+            if client.on_message is not None \
+                    and any(topic_matches_sub(t, topic) for t in client.topics):
+                client.on_message(topic, payload)
+
+
+class MqttHubClient:
+    """MQTT client using connection shared by `MqttHub`."""
+
+    def __init__(self, hub: MqttHub, conn: _MqttConnection):
+        self._hub = hub
+        self._conn = conn
+        self.topics = []
+        self.on_message = None
+        self.on_connect = None
+
+    def connect(self):
+        conn = self._conn
+        with self._hub._lock:
+            start = not conn.started
+            conn.started = True
+        if start:
+            try:
+                conn.client.connect()
+            except BaseException:
+                # Let next client try to connect again
+                with self._hub._lock:
+                    conn.started = False
+                raise
+        elif conn.connected and self.on_connect is not None:
+            self.on_connect()
+
+    def disconnect(self):
+        self._hub._release(self)
+
+    def subscribe(self, topics):
+        with self._hub._lock:
+            topics = [t for t in topics if t not in self.topics]
+            self.topics.extend(topics)
+            added = self._conn.add_topics(topics)
+        if len(added) > 0:
+            self._conn.client.subscribe(added)
+
+    def unsubscribe(self, topics):
+        with self._hub._lock:
+            topics = [t for t in topics if t in self.topics]
+            for t in topics:
+                self.topics.remove(t)
+            removed = self._conn.remove_topics(topics)
+        if len(removed) > 0:
+            self._conn.client.unsubscribe(removed)
+
+    def publish(self, topic, payload):
+        self._conn.client.publish(topic, payload)
+
+
 def get_device_topics(product_id: str, sn: str) -> List[str]:
     return [
         '/mqtt/' + product_id + '/' + sn + '/thing/event/property/post',
@@ -0,0 +1,104 @@
+# -----------------------------------------------------------
+# Copyright (c) 2023 Lauris BH
+# SPDX-License-Identifier: MIT
+# -----------------------------------------------------------
+
+"""Robot path simplification."""
+
+import numpy as np
+
+
+def simplify_rdp(points: np.ndarray, tolerance: float) -> np.ndarray:
+    """Simplify path using Ramer-Douglas-Peucker algorithm.
+
+    Removes points that are closer than `tolerance` to the line between
+    kept points. Returns a new `(M, 2)` array.
+    """
+
+    points = np.asarray(points)
+    n = len(points)
+    if n < 3:
+        return points.copy()
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while len(stack) > 0:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        a = points[start].astype(np.float64)
+        ab = points[end] - a
+        ap = points[start + 1:end] - a
+        length = np.hypot(ab[0], ab[1])
+        if length == 0:
+            dist = np.hypot(ap[:, 0], ap[:, 1])
+        else:
+            dist = np.abs(ab[0] * ap[:, 1] - ab[1] * ap[:, 0]) / length
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            i += start + 1
+            keep[i] = True
+            stack.append((start, i))
+            stack.append((i, end))
+    return points[keep]
+
+
+def simplify_radial(points: np.ndarray, tolerance: float) -> np.ndarray:
+    """Simplify path by dropping points closer than `tolerance` to the
+    previously kept point. Last point is always kept.
+    """
+
+    points = np.asarray(points)
+    n = len(points)
+    if n < 3:
+        return points.copy()
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    tolerance *= tolerance
+    coords = points.tolist()
+    lx, ly = coords[0]
+    for i in range(1, n - 1):
+        x, y = coords[i]
+        if (x - lx) * (x - lx) + (y - ly) * (y - ly) > tolerance:
+            keep[i] = True
+            lx, ly = x, y
+    return points[keep]
+
+
+def simplify_path(
+        points: np.ndarray,
+        tolerance: float,
+        method: str = 'rdp') -> np.ndarray:
+    """Simplify path using `rdp` or `radial` method."""
+
+    if method == 'rdp':
+        return simplify_rdp(points, tolerance)
+    elif method == 'radial':
+        return simplify_radial(points, tolerance)
+    raise ValueError('Unknown path simplification method: ' + method)
+
+
+def pack_path(points) -> np.ndarray:
+    """Convert flat `[x1, y1, x2, y2, ...]` list to `(N, 2)` float32 array.
+
+    Can be used to simplify device `cur_path` property.
+    """
+
+    return np.asarray(points, dtype=np.float32).reshape(-1, 2)
+
+
+def sample_polyline(path: np.ndarray) -> np.ndarray:
+    """Sample points along polyline in cell coordinates so that no cell is
+    skipped.
+    """
+    if len(path) == 1:
+        return path
+    start = path[:-1]
+    delta = path[1:] - start
+    steps = np.maximum(np.ceil(np.abs(delta).max(axis=1) * 2), 1).astype(np.intp)
+    seg = np.repeat(np.arange(len(steps)), steps)
+    offset = np.arange(len(seg)) - np.repeat(np.cumsum(steps) - steps, steps)
+    t = (offset / steps[seg])[:, np.newaxis]
+    return np.concatenate((start[seg] + delta[seg] * t, path[-1:]))
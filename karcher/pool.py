@@ -0,0 +1,170 @@
+# -----------------------------------------------------------
+# Copyright (c) 2023 Lauris BH
+# SPDX-License-Identifier: MIT
+# -----------------------------------------------------------
+
+"""Shared HTTP connection pools."""
+
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import aiohttp
+
+
+@dataclass
+class PoolConfig:
+    """HTTP connection pool configuration class.
+
+    Attributes:
+        limit -- maximum number of open connections, 0 for no limit
+        limit_per_host -- maximum number of open connections to a single
+            host, 0 for no limit
+        dns_ttl -- DNS cache TTL in seconds, `None` to cache forever
+        keepalive_timeout -- seconds to keep idle connections open
+    """
+
+    limit: int = 100
+    limit_per_host: int = 0
+    dns_ttl: Optional[int] = 10
+    keepalive_timeout: float = 15.0
+
+
+@dataclass
+class PoolStats:
+    """HTTP connection pool statistics class.
+
+    Attributes:
+        in_use -- connections used by requests that have not yet received
+            response headers
+        idle -- open connections waiting to be reused, read from connector
+            internals as there is no trace signal for them, 0 if missing
+        waiting -- requests currently waiting for a free connection
+        waits -- total number of requests that had to wait for a connection
+        created -- total number of opened connections
+        reused -- total number of requests served by idle connections
+        dns_cache_hits -- total number of DNS cache hits
+        dns_cache_misses -- total number of DNS cache misses
+    """
+
+    in_use: int = 0
+    idle: int = 0
+    waiting: int = 0
+    waits: int = 0
+    created: int = 0
+    reused: int = 0
+    dns_cache_hits: int = 0
+    dns_cache_misses: int = 0
+
+
+class _Pool:
+
+    def __init__(self, config: PoolConfig):
+        self.config = config
+        self.session = None
+        self.stats = PoolStats()
+
+    def get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            trace = aiohttp.TraceConfig()
+            trace.on_request_start.append(self._on_request_start)
+            trace.on_request_redirect.append(self._on_release)
+            trace.on_request_end.append(self._on_release)
+            trace.on_request_exception.append(self._on_release)
+            trace.on_connection_queued_start.append(self._on_queued_start)
+            trace.on_connection_queued_end.append(self._on_queued_end)
+            trace.on_connection_create_end.append(self._on_create)
+            trace.on_connection_reuseconn.append(self._on_reuse)
+            trace.on_dns_cache_hit.append(self._on_dns_hit)
+            trace.on_dns_cache_miss.append(self._on_dns_miss)
+            connector = aiohttp.TCPConnector(
+                limit=self.config.limit,
+                limit_per_host=self.config.limit_per_host,
+                use_dns_cache=True,
+                ttl_dns_cache=self.config.dns_ttl,
+                keepalive_timeout=self.config.keepalive_timeout)
+            self.session = aiohttp.ClientSession(
+                connector=connector, trace_configs=[trace])
+        return self.session
+
+    def get_stats(self) -> PoolStats:
+        stats = PoolStats(**vars(self.stats))
+        if self.session is not None and not self.session.closed:
+            conns = getattr(self.session.connector, '_conns', None)
+            if conns is not None:
+                stats.idle = sum(len(c) for c in conns.values())
+        return stats
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def _on_queued_start(self, session, ctx, params):
+        self.stats.waiting += 1
+        self.stats.waits += 1
+
+    async def _on_queued_end(self, session, ctx, params):
+        self.stats.waiting -= 1
+
+    async def _on_request_start(self, session, ctx, params):
+        ctx.acquired = False
+
+    async def _on_release(self, session, ctx, params):
+        # Redirected request takes a new connection
+        if ctx.acquired:
+            ctx.acquired = False
+            self.stats.in_use -= 1
+
+    def _acquire(self, ctx):
+        ctx.acquired = True
+        self.stats.in_use += 1
+
+    async def _on_create(self, session, ctx, params):
+        self.stats.created += 1
+        self._acquire(ctx)
+
+    async def _on_reuse(self, session, ctx, params):
+        self.stats.reused += 1
+        self._acquire(ctx)
+
+    async def _on_dns_hit(self, session, ctx, params):
+        self.stats.dns_cache_hits += 1
+
+    async def _on_dns_miss(self, session, ctx, params):
+        self.stats.dns_cache_misses += 1
+
+
+class HttpPoolManager:
+    """HTTP connection pool manager.
+
+    Keeps separate connection pools for the API and for map downloads from
+    the CDN, so that large downloads do not hold up API requests. Single
+    manager can be shared by many `KarcherHome` instances, in that case it
+    must be closed by its owner after all instances are closed.
+    """
+
+    def __init__(self, api: PoolConfig = None, cdn: PoolConfig = None):
+        self._api = _Pool(api or PoolConfig(limit_per_host=20))
+        self._cdn = _Pool(cdn or PoolConfig(limit_per_host=8, keepalive_timeout=30.0))
+
+    @property
+    def api_session(self) -> aiohttp.ClientSession:
+        """Session for API requests."""
+        return self._api.get_session()
+
+    @property
+    def cdn_session(self) -> aiohttp.ClientSession:
+        """Session for map downloads."""
+        return self._cdn.get_session()
+
+    def stats(self) -> Dict[str, PoolStats]:
+        """Get statistics of `api` and `cdn` pools."""
+        return {
+            'api': self._api.get_stats(),
+            'cdn': self._cdn.get_stats(),
+        }
+
+    async def close(self):
+        """Close all pooled connections."""
+        await self._api.close()
+        await self._cdn.close()
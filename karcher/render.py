@@ -0,0 +1,220 @@
+# -----------------------------------------------------------
+# Copyright (c) 2023 Lauris BH
+# SPDX-License-Identifier: MIT
+# -----------------------------------------------------------
+
+"""Map rendering to RGBA images."""
+
+import struct
+from typing import Dict, Optional, Sequence, Tuple, Union
+import zlib
+
+import numpy as np
+
+from .lru import LRUCache
+from .map import Map
+from .path import sample_polyline
+
+Color = Tuple[int, int, int, int]
+
+ROOM_COLORS = [
+    (171, 199, 248, 255),
+    (255, 213, 154, 255),
+    (166, 227, 192, 255),
+    (244, 179, 190, 255),
+    (203, 185, 244, 255),
+    (250, 237, 160, 255),
+    (163, 222, 230, 255),
+    (221, 199, 171, 255),
+]
+WALL_COLOR: Color = (228, 38, 38, 255)
+CHARGE_STATION_COLOR: Color = (38, 166, 91, 255)
+ROBOT_COLOR: Color = (38, 98, 228, 255)
+
+
+def default_palette() -> np.ndarray:
+    """Default occupancy grid palette.
+
+    Value 0 (unknown) is transparent, other values are shades of gray
+    getting darker with higher value.
+    """
+    palette = np.zeros((256, 4), dtype=np.uint8)
+    shade = 255 - np.arange(256)
+    palette[:, 0] = palette[:, 1] = palette[:, 2] = shade
+    palette[1:, 3] = 255
+    return palette
+
+
+class MapRenderer:
+    """Map renderer.
+
+    Renders map occupancy grid, rooms and virtual walls to an RGBA image
+    and keeps a pyramid of downsampled levels for each map version in an
+    LRU cache. Level 0 is full resolution, each next level halves the size.
+    Charge station and current robot pose are drawn on top on each render.
+
+    Images are flipped vertically, so that the first row is maximum Y.
+    """
+
+    def __init__(
+            self,
+            palette: Union[np.ndarray, Dict[int, Color]] = None,
+            room_colors: Sequence[Color] = None,
+            cache_size: int = 16,
+            tile_size: int = 256):
+        self._palette = default_palette()
+        if isinstance(palette, dict):
+            for k, v in palette.items():
+                self._palette[k] = v
+        elif palette is not None:
+            self._palette = np.asarray(palette, dtype=np.uint8).reshape(256, 4)
+        self._room_colors = np.asarray(room_colors or ROOM_COLORS, dtype=np.uint8)
+        self._tile_size = tile_size
+        self._cache = LRUCache(cache_size)
+
+    def levels(self, m: Map) -> int:
+        """Number of pyramid levels until map fits in a single tile."""
+        size = max(m.size_x, m.size_y, 1)
+        n = 1
+        while size > self._tile_size:
+            size = (size + 1) // 2
+            n += 1
+        return n
+
+    def render(self, m: Map, level: int = 0, overlays: bool = True) -> np.ndarray:
+        """Render map to `(height, width, 4)` RGBA image."""
+        image = self._level(m, level)
+        if not overlays:
+            return image
+        image = image.copy()
+        self._draw_overlays(m, image, level)
+        return image
+
+    def tile(
+            self,
+            m: Map,
+            level: int,
+            tx: int,
+            ty: int,
+            overlays: bool = True) -> np.ndarray:
+        """Render single tile of given pyramid level.
+
+        Tiles at the image edge are padded with transparent pixels.
+        """
+        size = self._tile_size
+        base = self._level(m, level)
+        tile = np.zeros((size, size, 4), dtype=np.uint8)
+        part = base[ty * size:(ty + 1) * size, tx * size:(tx + 1) * size]
+        tile[:part.shape[0], :part.shape[1]] = part
+        if overlays:
+            self._draw_overlays(m, tile, level, (tx * size, ty * size))
+        return tile
+
+    def _level(self, m: Map, level: int) -> np.ndarray:
+        return self._cache.get_or_put(
+            (m.version, level), lambda: self._build_level(m, level))
+
+    def _build_level(self, m: Map, level: int) -> np.ndarray:
+        if level == 0:
+            image = self._render_base(m)
+        else:
+            image = _downsample(self._level(m, level - 1))
+        image.flags.writeable = False
+        return image
+
+    def _render_base(self, m: Map) -> np.ndarray:
+        image = np.zeros((m.size_y, m.size_x, 4), dtype=np.uint8)
+        if m.grid is not None:
+            image = self._palette[m.grid]
+
+        if m.room_grid is not None:
+            colors = np.zeros((256, 4), dtype=np.uint8)
+            colors[1:] = self._room_colors[np.arange(255) % len(self._room_colors)]
+            for room in m.rooms:
+                if 0 < room.room_id < 256:
+                    colors[room.room_id] = \
+                        self._room_colors[room.color_id % len(self._room_colors)]
+            rooms = m.room_grid > 0
+            image[rooms] = colors[m.room_grid[rooms]]
+
+        for wall in m.virtual_walls:
+            points = np.array([(p.x, p.y) for p in wall.points], dtype=np.float64)
+            if len(points) == 0:
+                continue
+            if len(points) > 2:
+                points = np.concatenate((points, points[:1]))
+            px, py = m.world_to_pixel(points[:, 0], points[:, 1], True)
+            cells = np.rint(sample_polyline(np.stack((px, py), axis=1))).astype(np.intp)
+            ok = m.in_bounds(cells[:, 0], cells[:, 1])
+            image[cells[ok, 1], cells[ok, 0]] = WALL_COLOR
+
+        return image[::-1]
+
+    def _draw_overlays(
+            self,
+            m: Map,
+            image: np.ndarray,
+            level: int,
+            origin: Tuple[int, int] = (0, 0)):
+        scale = 1 << level
+        for pose, color in ((m.charge_station, CHARGE_STATION_COLOR),
+                            (m.current_pose, ROBOT_COLOR)):
+            if pose is None:
+                continue
+            px, py = m.world_to_pixel(pose.x, pose.y, True)
+            x = (px + 0.5) / scale - 0.5 - origin[0]
+            y = (m.size_y - py - 0.5) / scale - 0.5 - origin[1]
+            _draw_disc(image, x, y, 3, color)
+
+
+def _draw_disc(image: np.ndarray, x: float, y: float, r: float, color: Color):
+    h, w = image.shape[:2]
+    x0, x1 = max(int(x - r), 0), min(int(x + r) + 1, w)
+    y0, y1 = max(int(y - r), 0), min(int(y + r) + 1, h)
+    if x0 >= x1 or y0 >= y1:
+        return
+    yy, xx = np.mgrid[y0:y1, x0:x1]
+    inside = (xx - x) ** 2 + (yy - y) ** 2 <= r * r
+    image[y0:y1, x0:x1][inside] = color
+
+
+def _downsample(image: np.ndarray) -> np.ndarray:
+    """Halve image size averaging 2x2 blocks weighted by alpha."""
+    h, w = image.shape[:2]
+    padded = np.zeros((h + h % 2, w + w % 2, 4), dtype=np.uint32)
+    padded[:h, :w] = image
+    blocks = padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2, 4)
+    alpha = blocks[..., 3:4]
+    alpha_sum = alpha.sum(axis=(1, 3))
+    rgb = (blocks[..., :3] * alpha).sum(axis=(1, 3))
+    out = np.zeros((blocks.shape[0], blocks.shape[2], 4), dtype=np.uint8)
+    ok = alpha_sum[..., 0] > 0
+    out[ok, :3] = rgb[ok] // alpha_sum[ok]
+    out[..., 3] = alpha_sum[..., 0] // 4
+    return out
+
+
+def encode_png(image: np.ndarray, level: int = 6) -> bytes:
+    """Encode RGBA image as PNG."""
+
+    image = np.ascontiguousarray(image, dtype=np.uint8)
+    h, w = image.shape[:2]
+    raw = np.zeros((h, w * 4 + 1), dtype=np.uint8)
+    raw[:, 1:] = image.reshape(h, w * 4)
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data \
+            + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    return b'\x89PNG\r\n\x1a\n' \
+        + chunk(b'IHDR', struct.pack('>IIBBBBB', w, h, 8, 6, 0, 0, 0)) \
+        + chunk(b'IDAT', zlib.compress(raw.tobytes(), level)) \
+        + chunk(b'IEND', b'')
+
+
+def render_png(m: Map, renderer: Optional[MapRenderer] = None, level: int = 0) -> bytes:
+    """Render map to PNG image."""
+
+    if renderer is None:
+        renderer = MapRenderer(cache_size=1)
+    return encode_png(renderer.render(m, level))
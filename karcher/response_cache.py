@@ -0,0 +1,163 @@
+# -----------------------------------------------------------
+# Copyright (c) 2023 Lauris BH
+# SPDX-License-Identifier: MIT
+# -----------------------------------------------------------
+
+"""Cache of rarely changing API responses."""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from .lru import LRUCache
+
+# Default time to live of cached responses in seconds by endpoint
+DEFAULT_RESPONSE_TTLS = {
+    'get_urls': 24 * 3600,
+    'get_user_info': 300,
+    'get_devices': 60,
+}
+
+
+class ResponseCache:
+    """API response cache.
+
+    Keeps decoded responses in an in-memory LRU, each endpoint with its own
+    time to live. Endpoints without TTL are not cached. If `path` is set,
+    raw response data is also stored on disk, so it survives restarts.
+    Stored responses contain account data, so they are readable only by
+    the owner.
+
+    Responses are grouped by `scope`, usually user ID, so that responses
+    of a single user can be invalidated. Methods doing disk I/O are
+    thread-safe, so they can be run outside of the event loop.
+
+    Attributes:
+        hits -- number of responses served from cache
+        misses -- number of responses that had to be requested
+    """
+
+    def __init__(
+            self,
+            ttls: Dict[str, float] = None,
+            max_entries: int = 256,
+            path: Optional[str] = None):
+        self.ttls = dict(DEFAULT_RESPONSE_TTLS if ttls is None else ttls)
+        self._path = path
+        self._lock = threading.Lock()
+        self._entries = LRUCache(max_entries)
+        self.hits = 0
+        self.misses = 0
+
+        if path is not None:
+            os.makedirs(path, mode=0o700, exist_ok=True)
+
+    def enabled(self, endpoint: str) -> bool:
+        return self.ttls.get(endpoint, 0) > 0
+
+    def _scope_dir(self, scope: str) -> str:
+        digest = hashlib.sha256(scope.encode()).hexdigest()
+        return os.path.join(self._path, digest)
+
+    def _file(self, endpoint: str, key: str, scope: str) -> str:
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self._scope_dir(scope), endpoint + '-' + digest + '.json')
+
+    def get(
+            self,
+            endpoint: str,
+            key: str,
+            scope: str = '') -> Tuple[Optional[Any], Optional[Any]]:
+        """Get cached `(value, raw)` response.
+
+        Value is `None` if response was loaded from disk and has to be
+        decoded from raw data again. Both are `None` if there is no fresh
+        response in cache.
+        """
+
+        if not self.enabled(endpoint):
+            return None, None
+
+        entry = self._entries.get((endpoint, scope, key))
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                with self._lock:
+                    self.hits += 1
+                return entry[1], entry[2]
+            self._entries.pop((endpoint, scope, key))
+
+        raw = self._load(endpoint, key, scope)
+        with self._lock:
+            if raw is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return None, raw
+
+    def put(
+            self,
+            endpoint: str,
+            key: str,
+            value: Any,
+            raw: Any,
+            store: bool = True,
+            scope: str = ''):
+        """Cache decoded response value and its raw data.
+
+        Raw data is written to disk only if `store` is set.
+        """
+
+        ttl = self.ttls.get(endpoint, 0)
+        if ttl <= 0:
+            return
+        self._entries.put((endpoint, scope, key), (time.monotonic() + ttl, value, raw))
+        if store and self._path is not None:
+            os.makedirs(self._scope_dir(scope), mode=0o700, exist_ok=True)
+            path = self._file(endpoint, key, scope)
+            fd = os.open(path + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'stored_time': time.time(), 'data': raw}, f)
+            os.replace(path + '.tmp', path)
+
+    def _load(self, endpoint: str, key: str, scope: str) -> Optional[Any]:
+        if self._path is None:
+            return None
+        try:
+            with open(self._file(endpoint, key, scope), 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry['stored_time'] + self.ttls[endpoint] <= time.time():
+            return None
+        return entry['data']
+
+    def invalidate(self, *endpoints: str, scope: Optional[str] = None):
+        """Remove cached responses of given endpoints, or all if none given.
+
+        If `scope` is set, only responses of that scope are removed.
+        """
+
+        self._entries.remove(
+            lambda k: (len(endpoints) == 0 or k[0] in endpoints)
+            and (scope is None or k[1] == scope))
+        if self._path is None:
+            return
+        if scope is not None:
+            dirs = [self._scope_dir(scope)]
+        else:
+            dirs = [os.path.join(self._path, name) for name in os.listdir(self._path)]
+        for path in dirs:
+            try:
+                names = os.listdir(path)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            for name in names:
+                endpoint = name.rsplit('-', 1)[0]
+                if len(endpoints) == 0 or endpoint in endpoints:
+                    try:
+                        os.remove(os.path.join(path, name))
+                    except FileNotFoundError:
+                        pass
@@ -0,0 +1,132 @@
+# -----------------------------------------------------------
+# Copyright (c) 2023 Lauris BH
+# SPDX-License-Identifier: MIT
+# -----------------------------------------------------------
+
+"""Request timeouts, retries and hedging."""
+
+import asyncio
+import collections
+from dataclasses import dataclass, field
+import random
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import aiohttp
+
+from .exception import KarcherHomeHttpError
+
+# Endpoint name of map downloads from the CDN
+DOWNLOAD_ENDPOINT = 'download_map'
+
+# Endpoints that are safe to retry
+RETRIED_ENDPOINTS = (
+    'get_urls', 'get_user_info', 'get_devices', 'get_map_access_url', DOWNLOAD_ENDPOINT,
+)
+
+# HTTP statuses of transient errors
+RETRIED_STATUSES = (429, 500, 502, 503, 504)
+
+_REQUEST_ERRORS = (asyncio.TimeoutError, aiohttp.ClientError, KarcherHomeHttpError)
+
+
+@dataclass
+class RetryPolicy:
+    """Request timeout and retry policy class.
+
+    Attributes:
+        timeout -- total request timeout in seconds, `None` for no timeout
+        timeouts -- request timeouts by endpoint, overriding `timeout`
+        attempts -- maximum number of attempts of retried endpoints
+        base_delay -- maximum delay before first retry in seconds, doubled
+            for each next retry
+        max_delay -- maximum delay between retries in seconds
+        endpoints -- endpoints that are retried, named after methods of
+            `KarcherHome` and `download_map` for map downloads
+        hedge -- start second map download if first has not completed in
+            95th percentile latency of recent downloads
+    """
+
+    timeout: Optional[float] = 30.0
+    timeouts: Dict[str, Optional[float]] = field(
+        default_factory=lambda: {DOWNLOAD_ENDPOINT: 120.0})
+    attempts: int = 3
+    base_delay: float = 0.2
+    max_delay: float = 5.0
+    endpoints: Tuple[str, ...] = RETRIED_ENDPOINTS
+    hedge: bool = False
+
+    def client_timeout(self, endpoint: str) -> aiohttp.ClientTimeout:
+        """Get client timeout for endpoint requests."""
+        return aiohttp.ClientTimeout(total=self.timeouts.get(endpoint, self.timeout))
+
+    def delay(self, retry: int) -> float:
+        """Get jittered delay before retry, counting from 0."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+
+    async def run(self, endpoint: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run call, retrying it on transient errors if enabled for endpoint."""
+
+        attempts = self.attempts if endpoint in self.endpoints else 1
+        for retry in range(attempts):
+            try:
+                return await fn()
+            except _REQUEST_ERRORS as ex:
+                if retry + 1 >= attempts or not is_transient(ex):
+                    raise
+            await asyncio.sleep(self.delay(retry))
+
+
+def is_transient(ex: Exception) -> bool:
+    """Check if request error is worth retrying."""
+    if isinstance(ex, KarcherHomeHttpError):
+        return ex.status in RETRIED_STATUSES
+    if isinstance(ex, aiohttp.ClientResponseError):
+        return ex.status in RETRIED_STATUSES
+    return True
+
+
+class LatencyTracker:
+    """Latencies of recent requests."""
+
+    def __init__(self, window: int = 100, min_samples: int = 20):
+        self._samples = collections.deque(maxlen=window)
+        self._min_samples = min_samples
+
+    def add(self, latency: float):
+        self._samples.append(latency)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Get latency percentile, `None` until there are enough samples."""
+        if len(self._samples) < self._min_samples:
+            return None
+        samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, int(len(samples) * q / 100))]
+
+
+async def hedged(fn: Callable[[], Awaitable[Any]], delay: Optional[float]) -> Any:
+    """Run call and start second one if first has not completed in `delay`.
+
+    Result of the first successful call is returned and the other one is
+    cancelled. If both fail, the last error is raised.
+    """
+
+    if delay is None:
+        return await fn()
+
+    first = asyncio.ensure_future(fn())
+    tasks = {first}
+    try:
+        await asyncio.wait(tasks, timeout=delay)
+        if first.done():
+            return first.result()
+        tasks.add(asyncio.ensure_future(fn()))
+        while True:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+            if len(tasks) == 0:
+                return done.pop().result()
+    finally:
+        for task in tasks:
+            task.cancel()
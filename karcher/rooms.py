@@ -0,0 +1,208 @@
+# -----------------------------------------------------------
+# Copyright (c) 2023 Lauris BH
+# SPDX-License-Identifier: MIT
+# -----------------------------------------------------------
+
+"""Room geometry computed from the map room matrix and room chains."""
+
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+from xml.sax.saxutils import quoteattr
+
+import numpy as np
+
+from .lru import LRUCache
+from .path import simplify_rdp
+
+if TYPE_CHECKING:
+    from .map import Map
+
+ROOM_OUTLINE_CACHE_SIZE = 16
+
+_outline_cache = LRUCache(ROOM_OUTLINE_CACHE_SIZE)
+
+
+@dataclass
+class RoomStats:
+    """Room statistics class.
+
+    Pixel bounding box is inclusive and in grid cell indexes, all other
+    coordinates are in world coordinates.
+    """
+    __slots__ = ('room_id', 'cells', 'area', 'pixel_bbox', 'bbox',
+                 'centroid', 'label_position')
+
+    room_id: int
+    cells: int
+    area: float
+    pixel_bbox: Tuple[int, int, int, int]
+    bbox: Tuple[float, float, float, float]
+    centroid: Tuple[float, float]
+    label_position: Tuple[float, float]
+
+
+@dataclass(eq=False)
+class RoomOutline:
+    """Room outline class.
+
+    `points` is a closed `(N, 2)` polygon in world coordinates, with the
+    first point repeated at the end.
+    """
+    __slots__ = ('room_id', 'points')
+
+    room_id: int
+    points: np.ndarray
+
+
+def compute_room_stats(m: 'Map') -> Dict[int, RoomStats]:
+    """Compute statistics for all rooms in single pass over room matrix."""
+
+    grid = m.room_grid
+    if grid is None:
+        return {}
+
+    size_y, size_x = grid.shape
+    ids = grid.ravel()
+    cells = np.bincount(ids, minlength=256)
+    xs = np.tile(np.arange(size_x, dtype=np.float64), size_y)
+    ys = np.repeat(np.arange(size_y, dtype=np.float64), size_x)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cx = np.bincount(ids, weights=xs, minlength=256) / cells
+        cy = np.bincount(ids, weights=ys, minlength=256) / cells
+
+    # Which columns and rows each room occupies
+    cols = np.zeros((256, size_x), dtype=bool)
+    cols[grid, np.arange(size_x)[np.newaxis, :]] = True
+    rows = np.zeros((256, size_y), dtype=bool)
+    rows[grid, np.arange(size_y)[:, np.newaxis]] = True
+    min_x = cols.argmax(axis=1)
+    max_x = size_x - 1 - cols[:, ::-1].argmax(axis=1)
+    min_y = rows.argmax(axis=1)
+    max_y = size_y - 1 - rows[:, ::-1].argmax(axis=1)
+
+    room_ids = [r.room_id for r in m.rooms if 0 < r.room_id < 256]
+    if len(room_ids) == 0:
+        room_ids = np.nonzero(cells[1:])[0] + 1
+    labels = {r.room_id: r.room_name_post for r in m.rooms
+              if r.room_name_post is not None}
+
+    res = m.resolution
+    wx0, wy0 = m.pixel_to_world(min_x, min_y)
+    wx1, wy1 = m.pixel_to_world(max_x, max_y)
+    wcx, wcy = m.pixel_to_world(cx, cy)
+
+    stats = {}
+    for i in room_ids:
+        i = int(i)
+        if cells[i] == 0:
+            continue
+        centroid = (float(wcx[i]), float(wcy[i]))
+        if i in labels:
+            label = (labels[i].x, labels[i].y)
+        else:
+            label = _label_position(m, grid, i, cx[i], cy[i])
+        stats[i] = RoomStats(
+            room_id=i,
+            cells=int(cells[i]),
+            area=float(cells[i] * res * res),
+            pixel_bbox=(int(min_x[i]), int(min_y[i]), int(max_x[i]), int(max_y[i])),
+            bbox=(float(wx0[i] - res / 2), float(wy0[i] - res / 2),
+                  float(wx1[i] + res / 2), float(wy1[i] + res / 2)),
+            centroid=centroid,
+            label_position=label)
+    return stats
+
+
+def _label_position(
+        m: 'Map',
+        grid: np.ndarray,
+        room_id: int,
+        cx: float,
+        cy: float) -> Tuple[float, float]:
+    px, py = int(round(cx)), int(round(cy))
+    if grid[py, px] != room_id:
+        # Centroid is outside of concave room, use nearest room cell instead
+        ys, xs = np.nonzero(grid == room_id)
+        i = np.argmin((xs - cx) ** 2 + (ys - cy) ** 2)
+        px, py = xs[i], ys[i]
+    x, y = m.pixel_to_world(px, py)
+    return float(x), float(y)
+
+
+def room_outlines(m: 'Map', tolerance: Optional[float] = None) -> List[RoomOutline]:
+    """Room outline polygons built from map room chains.
+
+    Chains are closed and simplified with `tolerance` in meters, map
+    resolution by default. Results are cached by map version, returned
+    arrays are read-only.
+    """
+
+    if tolerance is None:
+        tolerance = m.resolution
+    return _outline_cache.get_or_put(
+        (m.version, tolerance), lambda: _build_outlines(m, tolerance))
+
+
+def _build_outlines(m: 'Map', tolerance: float) -> List[RoomOutline]:
+    outlines = []
+    for chain in m.robot_map.roomChain:
+        if len(chain.points) < 3:
+            continue
+        px = np.fromiter((p.x for p in chain.points), dtype=np.float64)
+        py = np.fromiter((p.y for p in chain.points), dtype=np.float64)
+        x, y = m.pixel_to_world(px, py)
+        points = np.stack((x, y), axis=1)
+        if not np.array_equal(points[0], points[-1]):
+            points = np.concatenate((points, points[:1]))
+        points = simplify_rdp(points, tolerance)
+        if len(points) < 4:
+            continue
+        points.flags.writeable = False
+        outlines.append(RoomOutline(chain.roomId, points))
+    return outlines
+
+
+def outlines_to_geojson(m: 'Map', outlines: List[RoomOutline]) -> Dict[str, Any]:
+    """Convert room outlines to GeoJSON feature collection.
+
+    Coordinates are map world coordinates in meters, not longitude and
+    latitude.
+    """
+
+    names = {r.room_id: r.room_name for r in m.rooms}
+    return {
+        'type': 'FeatureCollection',
+        'features': [{
+            'type': 'Feature',
+            'geometry': {
+                'type': 'Polygon',
+                'coordinates': [o.points.round(3).tolist()],
+            },
+            'properties': {
+                'room_id': o.room_id,
+                'room_name': names.get(o.room_id, ''),
+            },
+        } for o in outlines],
+    }
+
+
+def outlines_to_svg(m: 'Map', outlines: List[RoomOutline]) -> str:
+    """Convert room outlines to SVG image with one path per room.
+
+    SVG units are meters, Y axis is flipped so that it points up.
+    """
+
+    names = {r.room_id: r.room_name for r in m.rooms}
+    head = m.robot_map.mapHead
+    width = head.sizeX * head.resolution
+    height = head.sizeY * head.resolution
+    lines = [
+        '<svg xmlns="http://www.w3.org/2000/svg" viewBox="%g %g %g %g">'
+        % (head.minX, -(head.minY + height), width, height),
+    ]
+    for o in outlines:
+        d = 'M' + ' L'.join('%.3f,%.3f' % (x, -y) for x, y in o.points[:-1]) + ' Z'
+        lines.append('<path id="room-%d" data-name=%s d="%s"/>'
+                     % (o.room_id, quoteattr(names.get(o.room_id, '')), d))
+    lines.append('</svg>')
+    return '\n'.join(lines)
@@ -0,0 +1,206 @@
+# -----------------------------------------------------------
+# Copyright (c) 2023 Lauris BH
+# SPDX-License-Identifier: MIT
+# -----------------------------------------------------------
+
+"""Rate limiting of API requests."""
+
+import asyncio
+import contextlib
+import contextvars
+from dataclasses import dataclass, replace
+from enum import IntEnum
+import itertools
+import time
+from typing import Dict, Iterator, Optional
+
+from .consts import Region
+
+
+class Priority(IntEnum):
+    """Request priority enum.
+
+    Requests of lower value are sent first.
+    """
+    INTERACTIVE = 0
+    DEFAULT = 1
+    BACKGROUND = 2
+
+
+@dataclass
+class RateLimit:
+    """Token bucket rate limit class.
+
+    Attributes:
+        rate -- requests per second
+        burst -- maximum number of requests sent at once
+    """
+
+    rate: float
+    burst: int = 1
+
+
+@dataclass
+class SchedulerStats:
+    """Request scheduler statistics class.
+
+    Attributes:
+        requests -- total number of scheduled requests
+        delayed -- total number of requests that had to wait
+        waiting -- requests currently waiting
+        total_wait -- total time requests have waited in seconds
+        max_wait -- longest time a request has waited in seconds
+    """
+
+    requests: int = 0
+    delayed: int = 0
+    waiting: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+
+_priority = contextvars.ContextVar('karcher_request_priority', default=Priority.DEFAULT)
+
+
+@contextlib.contextmanager
+def request_priority(priority: Priority) -> Iterator[None]:
+    """Set priority of requests made in this context."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class _Bucket:
+
+    def __init__(self, limit: RateLimit):
+        self.limit = limit
+        self.tokens = float(limit.burst)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        if now <= self.updated:
+            return
+        self.tokens = min(
+            self.limit.burst, self.tokens + (now - self.updated) * self.limit.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        return max(0.0, (1 - self.tokens) / self.limit.rate)
+
+
+class _Waiter:
+
+    def __init__(self, priority: Priority, seq: int, region: str, endpoint: str):
+        self.priority = priority
+        self.seq = seq
+        self.region = region
+        self.endpoint = endpoint
+        self.queued = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class RequestScheduler:
+    """Token bucket request scheduler.
+
+    Limits rate of requests to each region and optionally to each endpoint
+    in a region. Waiting requests are sent in priority order, and in order
+    of arrival within same priority. Single scheduler can be shared by many
+    `KarcherHome` instances running in the same event loop.
+    """
+
+    def __init__(
+            self,
+            region_limit: RateLimit = None,
+            endpoint_limits: Dict[str, RateLimit] = None):
+        self.region_limit = region_limit or RateLimit(rate=5.0, burst=10)
+        self.endpoint_limits = dict(endpoint_limits or {})
+        self._buckets = {}
+        self._waiters = []
+        self._seq = itertools.count()
+        self._timer = None
+        self._stats = {p: SchedulerStats() for p in Priority}
+
+    def _bucket(self, key, limit: RateLimit) -> _Bucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(limit)
+        return bucket
+
+    def _region_bucket(self, region: str) -> _Bucket:
+        return self._bucket(region, self.region_limit)
+
+    def _endpoint_bucket(self, region: str, endpoint: str) -> Optional[_Bucket]:
+        limit = self.endpoint_limits.get(endpoint)
+        if limit is None:
+            return None
+        return self._bucket((region, endpoint), limit)
+
+    async def acquire(self, region: Region, endpoint: str, priority: Priority = None):
+        """Wait until request to endpoint in region can be sent.
+
+        If `priority` is not provided, priority set by `request_priority`
+        context is used.
+        """
+
+        if priority is None:
+            priority = _priority.get()
+        stats = self._stats[priority]
+        stats.requests += 1
+
+        waiter = _Waiter(priority, next(self._seq), Region(region).value, endpoint)
+        self._waiters.append(waiter)
+        self._dispatch()
+        if waiter.future.done():
+            return
+
+        stats.delayed += 1
+        stats.waiting += 1
+        try:
+            await waiter.future
+        finally:
+            stats.waiting -= 1
+            if waiter in self._waiters:
+                # Cancelled while waiting
+                self._waiters.remove(waiter)
+                self._dispatch()
+        wait = time.monotonic() - waiter.queued
+        stats.total_wait += wait
+        stats.max_wait = max(stats.max_wait, wait)
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        now = time.monotonic()
+        blocked = set()
+        delay = None
+        for waiter in sorted(self._waiters, key=lambda w: (w.priority, w.seq)):
+            # Requests to a region are not reordered past higher priority ones
+            if waiter.region in blocked:
+                continue
+            buckets = [self._region_bucket(waiter.region)]
+            endpoint_bucket = self._endpoint_bucket(waiter.region, waiter.endpoint)
+            if endpoint_bucket is not None:
+                buckets.append(endpoint_bucket)
+            for bucket in buckets:
+                bucket.refill(now)
+            wait = max(bucket.wait_time() for bucket in buckets)
+            if wait > 0:
+                if buckets[0].wait_time() > 0:
+                    blocked.add(waiter.region)
+                delay = wait if delay is None else min(delay, wait)
+                continue
+            for bucket in buckets:
+                bucket.tokens -= 1
+            self._waiters.remove(waiter)
+            waiter.future.set_result(None)
+
+        if delay is not None:
+            self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def stats(self) -> Dict[str, SchedulerStats]:
+        """Get statistics by priority name."""
+        return {p.name.lower(): replace(s) for p, s in self._stats.items()}
@@ -0,0 +1,129 @@
+# -----------------------------------------------------------
+# Copyright (c) 2023 Lauris BH
+# SPDX-License-Identifier: MIT
+# -----------------------------------------------------------
+
+"""User session renewal."""
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Optional
+
+import aiohttp
+
+from .auth import Session
+from .exception import KarcherHomeException, KarcherHomeHttpError
+
+# Seconds before auth token expiry to renew session
+SESSION_RENEW_MARGIN = 300
+
+# Seconds before retrying background renewal that failed on network error
+SESSION_RENEW_RETRY_DELAY = 30
+
+# Error codes of requests that are replayed after session renewal
+REPLAYED_ERROR_CODES = (609, 613)
+
+_TRANSIENT_ERRORS = (asyncio.TimeoutError, aiohttp.ClientError, KarcherHomeHttpError)
+
+
+class SessionManager:
+    """Keeps user session valid.
+
+    Session is renewed by `renew` in the background `margin` seconds before
+    its auth token expires, or on demand when a request fails because of
+    expired or invalid token. Concurrent callers share a single renewal.
+    Background renewal that fails on network error is retried after
+    `retry_delay` seconds. Nothing is renewed after `close` until a new
+    session is tracked.
+
+    Attributes:
+        renewals -- number of completed session renewals
+    """
+
+    def __init__(
+            self,
+            renew: Callable[[], Awaitable[Session]],
+            margin: float = SESSION_RENEW_MARGIN,
+            retry_delay: float = SESSION_RENEW_RETRY_DELAY):
+        self.margin = margin
+        self.retry_delay = retry_delay
+        self.renewals = 0
+        self._renew = renew
+        self._session = None
+        self._running = None
+        self._timer = None
+        self._closed = False
+
+    @property
+    def session(self) -> Optional[Session]:
+        """Current session."""
+        return self._session
+
+    def track(self, session: Optional[Session]):
+        """Set current session and schedule its renewal before expiry."""
+
+        self._closed = False
+        self._session = session
+        self._schedule(session)
+
+    def _schedule(self, session: Optional[Session], delay: float = None):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._closed or session is None or session.expires_at == 0:
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if delay is None:
+            delay = max(0.0, session.expires_at - self.margin - time.time())
+        self._timer = asyncio.ensure_future(self._renew_later(session, delay))
+
+    async def _renew_later(self, session: Session, delay: float):
+        await asyncio.sleep(delay)
+        # Timer is not cancelled by renewal it starts itself
+        self._timer = None
+        try:
+            await self.renew(session)
+        except _TRANSIENT_ERRORS:
+            self._schedule(session, self.retry_delay)
+        except KarcherHomeException:
+            # Requests renew again if token has expired meanwhile
+            pass
+
+    async def renew(self, expired: Session = None) -> Session:
+        """Renew session.
+
+        If `expired` session is provided and it has already been replaced,
+        current session is returned without renewing it again.
+        """
+
+        if self._running is None:
+            if expired is not None and self._session is not None \
+                    and self._session.auth_token != expired.auth_token:
+                return self._session
+            self._running = asyncio.ensure_future(self._run())
+        return await asyncio.shield(self._running)
+
+    async def _run(self) -> Session:
+        try:
+            session = await self._renew()
+        finally:
+            self._running = None
+        self.renewals += 1
+        self._session = session
+        self._schedule(session)
+        return session
+
+    def close(self):
+        """Stop scheduled and running renewal."""
+
+        self._closed = True
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._running is not None:
+            self._running.cancel()
+            self._running = None
+        self._session = None
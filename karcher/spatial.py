@@ -0,0 +1,229 @@
+# -----------------------------------------------------------
+# Copyright (c) 2023 Lauris BH
+# SPDX-License-Identifier: MIT
+# -----------------------------------------------------------
+
+"""Spatial queries over map rooms, areas, virtual walls and objects."""
+
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .lru import LRUCache
+
+if TYPE_CHECKING:
+    from .map import Area, Map, MapObject
+
+SPATIAL_INDEX_CACHE_SIZE = 8
+
+
+class SpatialIndex:
+    """Spatial index of a map.
+
+    Areas and virtual walls are bucketed into a uniform grid of `cell_size`
+    meters, so that single point and segment queries only test geometry in
+    the cells they touch. Batch queries test all geometry at once using
+    vectorized operations. Areas with three or more points are treated as
+    polygons, all areas and walls are used for segment intersection.
+
+    Rooms are looked up from the map room matrix. Objects are few, so they
+    are kept in flat arrays.
+
+    Use `SpatialIndex.for_map` to share the index between maps of the same
+    version.
+    """
+
+    _cache = LRUCache(SPATIAL_INDEX_CACHE_SIZE)
+
+    def __init__(self, m: 'Map', cell_size: float = 1.0):
+        self._map = m
+        self._cell_size = cell_size
+
+        self.areas: List['Area'] = m.areas + m.virtual_walls
+        self._polygons = []
+        self._polygon_owner = []
+        edges = []
+        edge_owner = []
+        for i, area in enumerate(self.areas):
+            points = np.array([(p.x, p.y) for p in area.points], dtype=np.float64)
+            if len(points) == 0:
+                continue
+            if len(points) >= 3:
+                self._polygons.append(points)
+                self._polygon_owner.append(i)
+                points = np.concatenate((points, points[:1]))
+            if len(points) == 1:
+                points = np.concatenate((points, points))
+            edges.append(np.concatenate((points[:-1], points[1:]), axis=1))
+            edge_owner.append(np.full(len(points) - 1, i, dtype=np.intp))
+        self._edges = np.concatenate(edges) if len(edges) > 0 \
+            else np.zeros((0, 4), dtype=np.float64)
+        self._edge_owner = np.concatenate(edge_owner) if len(edge_owner) > 0 \
+            else np.zeros(0, dtype=np.intp)
+
+        self._polygon_cells = self._bucket(
+            [(p[:, 0].min(), p[:, 1].min(), p[:, 0].max(), p[:, 1].max())
+             for p in self._polygons])
+        self._edge_cells = self._bucket(
+            np.stack((np.minimum(self._edges[:, 0], self._edges[:, 2]),
+                      np.minimum(self._edges[:, 1], self._edges[:, 3]),
+                      np.maximum(self._edges[:, 0], self._edges[:, 2]),
+                      np.maximum(self._edges[:, 1], self._edges[:, 3])), axis=1))
+
+        self.objects: List['MapObject'] = m.objects
+        self._objects = np.array(
+            [(o.x, o.y) for o in self.objects], dtype=np.float64).reshape(-1, 2)
+
+    @classmethod
+    def for_map(cls, m: 'Map') -> 'SpatialIndex':
+        """Get cached index for map version or build a new one."""
+        return cls._cache.get_or_put(m.version, lambda: cls(m))
+
+    def _cell(self, x: float, y: float) -> Tuple[int, int]:
+        return int(np.floor(x / self._cell_size)), int(np.floor(y / self._cell_size))
+
+    def _bucket(self, boxes) -> Dict[Tuple[int, int], List[int]]:
+        cells = {}
+        for i, (x0, y0, x1, y1) in enumerate(boxes):
+            cx0, cy0 = self._cell(x0, y0)
+            cx1, cy1 = self._cell(x1, y1)
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(cy0, cy1 + 1):
+                    cells.setdefault((cx, cy), []).append(i)
+        return cells
+
+    def room_at(self, x: float, y: float) -> int:
+        """Room ID at world coordinates, 0 if outside of any room."""
+        return int(self.rooms_at(np.array([[x, y]]))[0])
+
+    def rooms_at(self, points: np.ndarray) -> np.ndarray:
+        """Room IDs at `(N, 2)` world coordinates, 0 if outside of any room."""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        result = np.zeros(len(points), dtype=np.uint8)
+        grid = self._map.room_grid
+        if grid is None:
+            return result
+        px, py = self._map.world_to_pixel(points[:, 0], points[:, 1])
+        ok = self._map.in_bounds(px, py)
+        result[ok] = grid[py[ok], px[ok]]
+        return result
+
+    def areas_at(self, x: float, y: float) -> List['Area']:
+        """Areas containing point."""
+        result = []
+        for i in self._polygon_cells.get(self._cell(x, y), ()):
+            if _in_polygon(np.array([x]), np.array([y]), self._polygons[i])[0]:
+                result.append(self.areas[self._polygon_owner[i]])
+        return result
+
+    def in_areas(self, points: np.ndarray) -> np.ndarray:
+        """Check which of `(N, 2)` points are inside of any area."""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        result = np.zeros(len(points), dtype=bool)
+        for polygon in self._polygons:
+            lo = polygon.min(axis=0)
+            hi = polygon.max(axis=0)
+            candidates = ~result & np.all((points >= lo) & (points <= hi), axis=1)
+            idx = np.flatnonzero(candidates)
+            if len(idx) > 0:
+                result[idx] = _in_polygon(points[idx, 0], points[idx, 1], polygon)
+        return result
+
+    def nearest_object(
+            self,
+            x: float,
+            y: float,
+            max_distance: Optional[float] = None
+    ) -> Optional[Tuple['MapObject', float]]:
+        """Nearest object and its distance, `None` if there is none."""
+        idx, dist = self.nearest_objects(np.array([[x, y]]), max_distance)
+        if idx[0] < 0:
+            return None
+        return self.objects[idx[0]], float(dist[0])
+
+    def nearest_objects(
+            self,
+            points: np.ndarray,
+            max_distance: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Indexes of nearest objects in `objects` for `(N, 2)` points and
+        their distances. Index is -1 if no object is found.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        idx = np.full(len(points), -1, dtype=np.intp)
+        dist = np.full(len(points), np.inf)
+        if len(self._objects) == 0:
+            return idx, dist
+        d = np.hypot(points[:, np.newaxis, 0] - self._objects[np.newaxis, :, 0],
+                     points[:, np.newaxis, 1] - self._objects[np.newaxis, :, 1])
+        nearest = d.argmin(axis=1)
+        dist = d[np.arange(len(points)), nearest]
+        if max_distance is not None:
+            dist[dist > max_distance] = np.inf
+        ok = np.isfinite(dist)
+        idx[ok] = nearest[ok]
+        return idx, dist
+
+    def objects_within(self, x: float, y: float, radius: float) -> List['MapObject']:
+        """Objects within `radius` meters of point, nearest first."""
+        d = np.hypot(self._objects[:, 0] - x, self._objects[:, 1] - y)
+        return [self.objects[i] for i in np.argsort(d, kind='stable') if d[i] <= radius]
+
+    def crossed_areas(self, x0: float, y0: float, x1: float, y1: float) -> List['Area']:
+        """Areas and walls crossed by segment."""
+        candidates = set()
+        cx0, cy0 = self._cell(min(x0, x1), min(y0, y1))
+        cx1, cy1 = self._cell(max(x0, x1), max(y0, y1))
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                candidates.update(self._edge_cells.get((cx, cy), ()))
+        if len(candidates) == 0:
+            return []
+        idx = np.fromiter(candidates, dtype=np.intp)
+        hits = _segments_intersect(np.array([[x0, y0, x1, y1]]), self._edges[idx])[0]
+        owners = np.unique(self._edge_owner[idx[hits]])
+        return [self.areas[i] for i in owners]
+
+    def crosses_areas(self, segments: np.ndarray) -> np.ndarray:
+        """Check which of `(N, 4)` `x0, y0, x1, y1` segments cross any area
+        or wall.
+        """
+        segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+        result = np.zeros(len(segments), dtype=bool)
+        # Limit temporary arrays to about a million elements
+        step = max(1, 1_000_000 // max(len(segments), 1))
+        for i in range(0, len(self._edges), step):
+            hits = _segments_intersect(segments, self._edges[i:i + step])
+            result |= hits.any(axis=1)
+        return result
+
+
+def _in_polygon(x: np.ndarray, y: np.ndarray, polygon: np.ndarray) -> np.ndarray:
+    """Even-odd rule point in polygon test for arrays of points."""
+    x0, y0 = polygon[:, 0], polygon[:, 1]
+    x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+    y = y[:, np.newaxis]
+    spans = (y0 > y) != (y1 > y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cross_x = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+    crossings = spans & (x[:, np.newaxis] < cross_x)
+    return np.count_nonzero(crossings, axis=1) % 2 == 1
+
+
+def _segments_intersect(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Test each of `(N, 4)` segments against each of `(M, 4)` segments."""
+    ax0, ay0, ax1, ay1 = (a[:, i, np.newaxis] for i in range(4))
+    bx0, by0, bx1, by1 = (b[np.newaxis, :, i] for i in range(4))
+
+    def orient(px, py, qx, qy, rx, ry):
+        return np.sign((qx - px) * (ry - py) - (qy - py) * (rx - px))
+
+    d1 = orient(ax0, ay0, ax1, ay1, bx0, by0)
+    d2 = orient(ax0, ay0, ax1, ay1, bx1, by1)
+    d3 = orient(bx0, by0, bx1, by1, ax0, ay0)
+    d4 = orient(bx0, by0, bx1, by1, ax1, ay1)
+    # Bounding box overlap rules out disjoint collinear segments
+    overlap = (np.minimum(ax0, ax1) <= np.maximum(bx0, bx1)) \
+        & (np.minimum(bx0, bx1) <= np.maximum(ax0, ax1)) \
+        & (np.minimum(ay0, ay1) <= np.maximum(by0, by1)) \
+        & (np.minimum(by0, by1) <= np.maximum(ay0, ay1))
+    return (d1 * d2 <= 0) & (d3 * d4 <= 0) & overlap
@@ -0,0 +1,206 @@
+# -----------------------------------------------------------
+# Copyright (c) 2023 Lauris BH
+# SPDX-License-Identifier: MIT
+# -----------------------------------------------------------
+
+"""Seeded generator of synthetic robot maps for tests and benchmarks."""
+
+import math
+import random
+
+import numpy as np
+
+from . import mapdata_pb2
+
+# Synthetic occupancy grid values
+GRID_UNKNOWN = 0
+GRID_FLOOR = 1
+GRID_WALL = 2
+GRID_OBSTACLE = 3
+
+
+def generate_map(
+        seed: int = 0,
+        size_x: int = 800,
+        size_y: int = 800,
+        resolution: float = 0.05,
+        rooms: int = 8,
+        objects: int = 20,
+        path_points: int = 20000,
+        virtual_walls: int = 4,
+        areas: int = 2,
+        navigation_points: int = 3) -> mapdata_pb2.RobotMap:
+    """Generate map with rectangular rooms laid out on a grid.
+
+    Same seed and arguments always produce the same map.
+    """
+
+    rnd = random.Random(seed)
+    rm = mapdata_pb2.RobotMap()
+    rm.mapType = 1
+    rm.mapExtInfo.taskBeginDate = 1700000000 + seed
+    rm.mapExtInfo.mapUploadDate = 1700000000 + seed + 3600
+    rm.mapExtInfo.mapValid = 1
+
+    head = rm.mapHead
+    head.mapHeadId = seed + 1
+    head.sizeX = size_x
+    head.sizeY = size_y
+    head.resolution = resolution
+    head.minX = -size_x * resolution / 2
+    head.minY = -size_y * resolution / 2
+    head.maxX = head.minX + size_x * resolution
+    head.maxY = head.minY + size_y * resolution
+
+    def to_world(px, py):
+        return head.minX + (px + 0.5) * resolution, head.minY + (py + 0.5) * resolution
+
+    grid = np.full((size_y, size_x), GRID_UNKNOWN, dtype=np.uint8)
+    room_grid = np.zeros((size_y, size_x), dtype=np.uint8)
+
+    # Split house outline into columns and rows of rooms with random sizes
+    cols = max(1, math.ceil(math.sqrt(rooms)))
+    rows = max(1, math.ceil(rooms / cols))
+    margin = max(2, min(size_x, size_y) // 20)
+    xs = _cuts(rnd, margin, size_x - margin, cols)
+    ys = _cuts(rnd, margin, size_y - margin, rows)
+    rects = []
+    for i in range(rooms):
+        r, c = divmod(i, cols)
+        x0, x1, y0, y1 = xs[c], xs[c + 1], ys[r], ys[r + 1]
+        rects.append((x0, y0, x1, y1))
+        grid[y0:y1 + 1, x0:x1 + 1] = GRID_WALL
+        grid[y0 + 1:y1, x0 + 1:x1] = GRID_FLOOR
+        room_grid[y0 + 1:y1, x0 + 1:x1] = i + 1
+
+        room = rm.roomDataInfo.add()
+        room.roomId = i + 1
+        room.roomName = 'Room ' + str(i + 1)
+        room.roomTypeId = rnd.randrange(10)
+        room.meterialId = rnd.randrange(3)
+        room.colorId = i % 8
+        post = room.roomNamePost
+        post.x, post.y = to_world((x0 + x1) / 2, (y0 + y1) / 2)
+        room.cleanPerfer.cleanMode = rnd.randrange(3)
+        room.cleanPerfer.windPower = rnd.randrange(4)
+
+        chain = rm.roomChain.add()
+        chain.roomId = i + 1
+        for px, py in _outline(x0, y0, x1, y1, 5):
+            chain.points.add(x=px, y=py, value=0)
+
+    # Doors between neighbouring rooms in the same row
+    for i in range(rooms - 1):
+        if (i + 1) % cols == 0:
+            continue
+        x0, y0, x1, y1 = rects[i]
+        y = rnd.randrange(y0 + 2, y1 - 1) if y1 - y0 > 3 else (y0 + y1) // 2
+        grid[max(y - 8, y0 + 1):min(y + 8, y1), x1] = GRID_FLOOR
+
+    # Furniture legs and other small obstacles
+    floor = np.flatnonzero(room_grid.ravel() > 0)
+    if len(floor) > 0:
+        nrnd = np.random.default_rng(seed)
+        obstacles = nrnd.choice(floor, size=min(len(floor) // 200, 2000), replace=False)
+        grid.ravel()[obstacles] = GRID_OBSTACLE
+
+    rm.mapData.mapData = grid.tobytes()
+    rm.roomMatrix.matrix = room_grid.tobytes()
+
+    rm.chargeStation.x, rm.chargeStation.y = to_world(xs[0] + 3, ys[0] + 3)
+    rm.chargeStation.phi = math.pi / 2
+
+    path = _coverage_path(rnd, rects, max(1, int(0.3 / resolution)), path_points)
+    rm.historyPose.poseId = seed + 1
+    for px, py in path:
+        x, y = to_world(px, py)
+        rm.historyPose.points.add(x=x, y=y, update=0)
+    if len(path) > 0:
+        pose = rm.currentPose
+        pose.poseId = seed + 1
+        pose.x, pose.y = to_world(*path[-1])
+        pose.phi = rnd.uniform(-math.pi, math.pi)
+
+    for i in range(virtual_walls):
+        x0, y0, x1, y1 = rnd.choice(rects)
+        wall = rm.virtualWalls.add()
+        wall.status = 1
+        wall.areaIndex = i + 1
+        for px, py in ((rnd.randint(x0, x1), y0), (rnd.randint(x0, x1), y1)):
+            p = wall.points.add()
+            p.x, p.y = to_world(px, py)
+
+    for i in range(areas):
+        x0, y0, x1, y1 = rnd.choice(rects)
+        w, h = (x1 - x0) // 4, (y1 - y0) // 4
+        ax, ay = rnd.randint(x0, x1 - w), rnd.randint(y0, y1 - h)
+        area = rm.areasInfo.add()
+        area.status = 1
+        area.type = rnd.randrange(2)
+        area.areaIndex = virtual_walls + i + 1
+        for px, py in ((ax, ay), (ax + w, ay), (ax + w, ay + h), (ax, ay + h)):
+            p = area.points.add()
+            p.x, p.y = to_world(px, py)
+
+    for i in range(navigation_points):
+        x0, y0, x1, y1 = rnd.choice(rects)
+        point = rm.navigationPoints.add()
+        point.pointId = i + 1
+        point.status = 1
+        point.x, point.y = to_world(rnd.uniform(x0, x1), rnd.uniform(y0, y1))
+        point.phi = rnd.uniform(-math.pi, math.pi)
+
+    for i in range(objects):
+        x0, y0, x1, y1 = rnd.choice(rects)
+        obj = rm.objects.add()
+        obj.objectId = i + 1
+        obj.objectTypeId = rnd.randrange(20)
+        obj.objectName = 'object-' + str(obj.objectTypeId)
+        obj.confirm = rnd.randrange(2)
+        obj.x, obj.y = to_world(rnd.uniform(x0, x1), rnd.uniform(y0, y1))
+        obj.url = 'https://example.com/objects/' + str(i + 1) + '.jpg'
+
+    info = rm.mapInfo.add()
+    info.mapHeadId = head.mapHeadId
+    info.mapName = 'Home'
+    return rm
+
+
+def _cuts(rnd: random.Random, start: int, end: int, count: int):
+    """Split range into `count` parts of random size."""
+    weights = [rnd.uniform(0.7, 1.3) for _ in range(count)]
+    total = sum(weights)
+    cuts = [start]
+    for w in weights:
+        cuts.append(cuts[-1] + (end - start) * w / total)
+    return [int(round(c)) for c in cuts]
+
+
+def _outline(x0: int, y0: int, x1: int, y1: int, step: int):
+    """Rectangle outline points every `step` cells."""
+    points = []
+    for ax, ay, bx, by in ((x0, y0, x1, y0), (x1, y0, x1, y1),
+                           (x1, y1, x0, y1), (x0, y1, x0, y0)):
+        n = max(1, max(abs(bx - ax), abs(by - ay)) // step)
+        for k in range(n):
+            points.append((ax + (bx - ax) * k // n, ay + (by - ay) * k // n))
+    return points
+
+
+def _coverage_path(rnd: random.Random, rects, spacing: int, count: int):
+    """Back and forth cleaning path over rooms, `count` points long."""
+    path = []
+    while len(path) < count:
+        for x0, y0, x1, y1 in rects:
+            for i, y in enumerate(range(y0 + 2, y1 - 1, spacing)):
+                row = range(x0 + 2, x1 - 1, spacing)
+                if i % 2 == 1:
+                    row = reversed(row)
+                for x in row:
+                    path.append(
+                        (x + rnd.uniform(-0.5, 0.5), y + rnd.uniform(-0.5, 0.5)))
+                    if len(path) == count:
+                        return path
+        if len(path) == 0:
+            break
+    return path
@@ -4,12 +4,14 @@
 # -----------------------------------------------------------
 
 import base64
+import binascii
 import hashlib
 import random
 import re
 import string
 import time
-from typing import Final
+from functools import lru_cache
+from typing import Final, Iterable, List
 import zlib
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 
@@ -17,6 +19,7 @@ from .consts import TENANT_ID, Product
 
 
 EMAIL_REGEX: Final = "^\\w+([-+.]\\w+)*@\\w+([-.]\\w+)*\\.\\w+([-.]\\w+)*$"
+MAP_KEY_CACHE_SIZE: Final = 256
 
 
 def get_random_string(length: int) -> str:
@@ -40,6 +43,7 @@ def get_timestamp_ms() -> int:
     return int(time.time() * 1000)
 
 
+@lru_cache(maxsize=1)
 def get_enc_key() -> bytes:
     m = hashlib.md5()
     m.update(bytes(TENANT_ID, 'utf-8'))
@@ -47,20 +51,47 @@ def get_enc_key() -> bytes:
     return bytes(h[8:24], 'utf-8')
 
 
+@lru_cache(maxsize=1)
+def _get_cipher() -> Cipher:
+    return Cipher(algorithms.AES128(get_enc_key()), modes.ECB())
+
+
 def decrypt(data) -> str:
-    cipher = Cipher(algorithms.AES128(get_enc_key()), modes.ECB())
-    buf = cipher.decryptor().update(base64.b64decode(data))
-    return str(buf[:-ord(buf[-1:])], 'utf-8')
+    return decrypt_many([data])[0]
 
 
 def encrypt(data) -> str:
-    cipher = Cipher(algorithms.AES128(get_enc_key()), modes.ECB())
-    buf = bytes(data, 'utf-8')
-    pad_len = 16 - (len(buf) % 16)
-    buf = buf + bytes([pad_len]) * pad_len
-    return base64.b64encode(cipher.encryptor().update(buf)).decode()
+    return encrypt_many([data])[0]
+
+
+def decrypt_many(data: Iterable) -> List[str]:
+    """Decrypt multiple values reusing single cipher context."""
+
+    decryptor = _get_cipher().decryptor()
+    result = []
+    for d in data:
+        buf = base64.b64decode(d)
+        if len(buf) == 0 or len(buf) % 16 != 0:
+            raise ValueError('Invalid encrypted data length')
+        buf = decryptor.update(buf)
+        result.append(str(buf[:-ord(buf[-1:])], 'utf-8'))
+    return result
+
 
+def encrypt_many(data: Iterable[str]) -> List[str]:
+    """Encrypt multiple values reusing single cipher context."""
 
+    encryptor = _get_cipher().encryptor()
+    result = []
+    for d in data:
+        buf = bytes(d, 'utf-8')
+        pad_len = 16 - (len(buf) % 16)
+        buf = buf + bytes([pad_len]) * pad_len
+        result.append(base64.b64encode(encryptor.update(buf)).decode())
+    return result
+
+
+@lru_cache(maxsize=MAP_KEY_CACHE_SIZE)
 def get_map_enc_key(sn: str, mac: str, product_id: Product) -> bytes:
     sub_key = mac.replace(':', '').lower() + str(product_id.value)
     cipher = Cipher(algorithms.AES128(bytes(sub_key[0:16], 'utf-8')), modes.ECB())
@@ -76,14 +107,141 @@ def get_map_enc_key(sn: str, mac: str, product_id: Product) -> bytes:
     return bytes(h[8:24], 'utf-8')
 
 
+@lru_cache(maxsize=MAP_KEY_CACHE_SIZE)
+def get_map_cipher(sn: str, mac: str, product_id: Product) -> Cipher:
+    return Cipher(algorithms.AES128(get_map_enc_key(sn, mac, product_id)), modes.ECB())
+
+
+def encrypt_map(
+        sn: str,
+        mac: str,
+        product_id: Product,
+        data: bytes,
+        compress: bool = True) -> bytes:
+    cipher = get_map_cipher(sn, mac, product_id)
+    if compress:
+        data = zlib.compress(data)
+    buf = binascii.hexlify(data)
+    pad_len = 16 - (len(buf) % 16)
+    buf = buf + bytes([pad_len]) * pad_len
+    return base64.b64encode(cipher.encryptor().update(buf))
+
+
 def decrypt_map(sn: str, mac: str, product_id: Product, data: bytes) -> bytes:
-    key = get_map_enc_key(sn, mac, product_id)
-    cipher = Cipher(algorithms.AES128(key), modes.ECB())
-    buf = cipher.decryptor().update(base64.b64decode(data))
-    try:
-        return zlib.decompress(bytes.fromhex(str(buf[:-ord(buf[-1:])], 'utf-8')))
-    except Exception:
-        return bytes.fromhex(str(buf[:-ord(buf[-1:])], 'utf-8'))
+    decoder = MapDecoder(sn, mac, product_id)
+    decoder.update(data)
+    return bytes(decoder.finalize())
+
+
+class MapDecoder:
+    """Streaming map payload decoder.
+
+    Decodes map payload chunk by chunk as it is downloaded, going through
+    base64, AES, hex and zlib stages without keeping full size intermediate
+    copies of the payload. Only small carry-over buffers between chunks
+    and the decoded output are held in memory.
+    """
+
+    def __init__(self, sn: str, mac: str, product_id: Product):
+        self._decryptor = get_map_cipher(sn, mac, product_id).decryptor()
+        self._b64_tail = b''
+        self._aes_tail = b''
+        self._hex_tail = b''
+        self._zlib = None
+        self._compressed = None
+        # Raw data kept until it is confirmed that payload is compressed
+        self._head = bytearray()
+        self._out = bytearray()
+
+    def update(self, chunk: bytes):
+        """Feed next chunk of the downloaded payload."""
+
+        buf = self._b64_tail + chunk.translate(None, b' \t\r\n')
+        n = len(buf) - len(buf) % 4
+        self._b64_tail = buf[n:]
+        if n == 0:
+            return
+
+        buf = self._aes_tail + self._decryptor.update(base64.b64decode(buf[:n]))
+        # Hold back last block as it contains padding
+        n = max(len(buf) - 16, 0)
+        self._aes_tail = buf[n:]
+        self._unhex(buf[:n])
+
+    def finalize(self) -> bytearray:
+        """Finish decoding and return decoded map data."""
+
+        if len(self._b64_tail) > 0:
+            self._aes_tail += self._decryptor.update(base64.b64decode(self._b64_tail))
+        buf = self._aes_tail + self._decryptor.finalize()
+        self._b64_tail = self._aes_tail = b''
+        if len(buf) == 0 or buf[-1] < 1 or buf[-1] > 16:
+            raise ValueError('Invalid map data padding')
+        self._unhex(buf[:-buf[-1]])
+        if len(self._hex_tail) > 0:
+            raise ValueError('Invalid map data length')
+
+        if self._compressed is None:
+            # Too short to detect compression
+            self._out += self._head
+        elif self._compressed:
+            try:
+                self._inflate(self._zlib.flush())
+            except zlib.error:
+                self._fallback()
+            else:
+                if not self._zlib.eof:
+                    # Compressed stream was cut short
+                    self._fallback()
+        self._head = None
+        return self._out
+
+    def _unhex(self, buf: bytes):
+        buf = self._hex_tail + buf
+        n = len(buf) - len(buf) % 2
+        self._hex_tail = buf[n:]
+        if n == 0:
+            return
+        buf = binascii.unhexlify(buf[:n])
+
+        if self._compressed is None:
+            self._head += buf
+            if len(self._head) < 2:
+                return
+            self._compressed = _is_zlib_header(self._head)
+            if not self._compressed:
+                self._out += self._head
+                self._head = None
+                return
+            self._zlib = zlib.decompressobj()
+            buf = bytes(self._head)
+        elif not self._compressed:
+            self._out += buf
+            return
+        elif self._head is not None:
+            self._head += buf
+
+        try:
+            self._inflate(self._zlib.decompress(buf))
+        except zlib.error:
+            self._fallback()
+
+    def _inflate(self, buf: bytes):
+        if len(buf) > 0:
+            self._out += buf
+            self._head = None
+
+    def _fallback(self):
+        if self._head is None:
+            raise ValueError('Invalid map data compression')
+        # Looked like zlib header but payload is not compressed
+        self._compressed = False
+        self._out = self._head
+        self._head = None
+
+
+def _is_zlib_header(buf: bytes) -> bool:
+    return buf[0] & 0x0f == 8 and buf[0] >> 4 <= 7 and (buf[0] << 8 | buf[1]) % 31 == 0
 
 
 def md5(data: str) -> str:
@@ -22,6 +22,7 @@ setup(
         'aiohttp',
         'paho-mqtt<2',
         'cryptography',
+        'numpy',
         'protobuf'
     ],
     entry_points='''
@@ -0,0 +1,59 @@
+import os
+import tempfile
+import unittest
+
+from karcher import mapdata_pb2
+from karcher.archive import MapArchive
+from karcher.map import Map
+
+
+def make_map(head_id: int, fill: int) -> Map:
+    rm = mapdata_pb2.RobotMap()
+    rm.mapHead.mapHeadId = head_id
+    rm.mapHead.sizeX = 5
+    rm.mapHead.sizeY = 3
+    rm.mapHead.resolution = 0.05
+    rm.mapData.mapData = bytes([fill] * 15)
+    rm.chargeStation.x = float(fill)
+    return Map(rm)
+
+
+class TestMapArchive(unittest.TestCase):
+
+    def test_append_and_load(self):
+        with tempfile.TemporaryDirectory() as path:
+            with MapArchive(path) as archive:
+                self.assertEqual(archive.append(make_map(1, 7), 100), 0)
+                self.assertEqual(archive.append(make_map(2, 9), 200), 1)
+                self.assertEqual(archive.grid(0)[2, 4], 7)
+                self.assertIsNone(archive.room_grid(0))
+
+            with MapArchive(path) as archive:
+                self.assertEqual(len(archive), 2)
+                self.assertEqual(archive.index['map_head_id'].tolist(), [1, 2])
+                self.assertEqual(archive.find(150), 0)
+                self.assertIsNone(archive.find(50))
+                m = archive.load(1)
+                self.assertIsInstance(m, Map)
+                self.assertEqual(m.charge_station.x, 9.0)
+                self.assertEqual(m.grid.shape, (3, 5))
+                self.assertEqual(m.grid[0, 0], 9)
+                self.assertFalse(m.grid.flags.writeable)
+                del m
+                archive.append(make_map(3, 11), 300)
+                self.assertEqual(archive.load(2).grid[1, 1], 11)
+
+    def test_partial_index_record(self):
+        with tempfile.TemporaryDirectory() as path:
+            with MapArchive(path) as archive:
+                archive.append(make_map(1, 7), 100)
+            with open(os.path.join(path, MapArchive.INDEX_FILE), 'ab') as f:
+                f.write(b'\x01\x02')
+            with MapArchive(path) as archive:
+                self.assertEqual(len(archive), 1)
+                self.assertEqual(archive.append(make_map(2, 9), 200), 1)
+            with MapArchive(path) as archive:
+                self.assertEqual(archive.index['timestamp'].tolist(), [100, 200])
+                self.assertEqual(archive.index['map_head_id'].tolist(), [1, 2])
+                self.assertEqual(archive.load(0).grid[0, 0], 7)
+                self.assertEqual(archive.load(1).grid[0, 0], 9)
@@ -0,0 +1,86 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from karcher.cache import MapCache
+from karcher.lru import LRUCache
+
+
+class TestMapCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = self.dir.name
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_get_put(self):
+        cache = MapCache(self.path)
+        self.assertIsNone(cache.get('SN1', 1))
+        cache.put('SN1', 1, b'map', upload_date=10, etag='"abc"')
+        self.assertEqual(cache.get('SN1', 1), b'map')
+        self.assertEqual(cache.get('SN1', 1, upload_date=10), b'map')
+        self.assertIsNone(cache.get('SN1', 1, upload_date=11))
+        self.assertEqual(cache.lookup('SN1', 1).etag, '"abc"')
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+        # Index is persisted
+        self.assertEqual(MapCache(self.path).get('SN1', 1), b'map')
+
+    def test_content_addressed(self):
+        cache = MapCache(self.path)
+        cache.put('SN1', 1, b'same')
+        cache.put('SN2', 1, b'same')
+        self.assertEqual(cache.size, 4)
+        self.assertEqual(len([f for f in os.listdir(self.path) if f.endswith('.bin')]), 1)
+        cache.invalidate('SN1')
+        self.assertIsNone(cache.lookup('SN1', 1))
+        self.assertEqual(cache.get('SN2', 1), b'same')
+
+    def test_lru_eviction(self):
+        cache = MapCache(self.path, max_size=10)
+        cache.put('SN1', 1, b'1234')
+        cache.put('SN2', 1, b'5678')
+        cache.get('SN1', 1)
+        cache.put('SN3', 1, b'9012')
+        self.assertIsNotNone(cache.lookup('SN1', 1))
+        self.assertIsNone(cache.lookup('SN2', 1))
+        self.assertIsNotNone(cache.lookup('SN3', 1))
+        self.assertEqual(cache.size, 8)
+        self.assertEqual(len([f for f in os.listdir(self.path) if f.endswith('.bin')]), 2)
+
+    def test_get_keeps_index(self):
+        cache = MapCache(self.path, max_size=10)
+        cache.put('SN1', 1, b'1234')
+        cache.put('SN2', 1, b'5678')
+        with mock.patch.object(cache, '_save') as save:
+            cache.get('SN1', 1)
+            save.assert_not_called()
+
+        # Recency is stored with next change
+        cache.put('SN3', 1, b'9012')
+        cache = MapCache(self.path, max_size=10)
+        self.assertIsNone(cache.lookup('SN2', 1))
+        cache.put('SN4', 1, b'3456')
+        self.assertIsNotNone(cache.lookup('SN3', 1))
+        self.assertIsNone(cache.lookup('SN1', 1))
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_eviction(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get_or_put('a', lambda: 0), 1)
+        self.assertEqual(cache.get_or_put('d', lambda: 4), 4)
+        self.assertEqual(len(cache), 2)
+
+        self.assertEqual(cache.remove(lambda k: k == 'a'), ['a'])
+        self.assertEqual(cache.pop('d'), 4)
+        self.assertEqual(len(cache), 0)
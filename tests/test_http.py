@@ -0,0 +1,825 @@
+import asyncio
+import base64
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import aiohttp
+from aiohttp import web
+
+from karcher import mapdata_pb2
+from karcher.auth import Domains, Session
+from karcher.cache import DomainCache, MapCache
+from karcher.consts import Product, Region
+from karcher.device import Device
+from karcher.fleet import KarcherFleet
+from karcher.karcher import KarcherHome
+from karcher.mqtt import MqttHub, get_device_topics
+from karcher.pool import HttpPoolManager, PoolConfig
+from karcher.response_cache import ResponseCache
+from karcher.executor import SHARED_MEMORY_SUPPORTED
+from karcher.exception import KarcherHomeHttpError, KarcherHomeTokenExpired
+from karcher.retry import RetryPolicy, hedged
+from karcher.scheduler import Priority, RateLimit, RequestScheduler, request_priority
+from karcher.session import SessionManager
+from karcher.utils import encrypt, encrypt_map
+
+SN = 'SN1'
+MAC = 'AA:BB:CC:DD:EE:FF'
+
+
+def make_device() -> Device:
+    return Device(deviceId='1', sn=SN, mac=MAC, productId=Product.RCV5.value,
+                  productModeCode='x', status=1, versions='[]')
+
+
+def make_token(user_id: str, ttl: float = 3600, n: int = 0) -> str:
+    payload = json.dumps({
+        'value': json.dumps({'id': user_id}),
+        'exp': int(time.time() + ttl),
+        'n': n,
+    })
+    return 'h.' + base64.b64encode(payload.encode()).decode().rstrip('=') + '.s'
+
+
+class FakeMqttClient:
+    """Records MQTT client calls instead of connecting."""
+
+    def __init__(self, host, port, username, password):
+        self.username = username
+        self.topics = []
+        self.connects = 0
+        self.fail_connect = False
+        self.disconnected = False
+        self.on_message = None
+        self.on_connect = None
+
+    def connect(self):
+        self.connects += 1
+        if self.fail_connect:
+            self.fail_connect = False
+            raise OSError('Connection refused')
+        self.on_connect()
+
+    def disconnect(self):
+        self.disconnected = True
+
+    def subscribe(self, topics):
+        self.topics.extend(topics)
+
+    def unsubscribe(self, topics):
+        for t in topics:
+            self.topics.remove(t)
+
+    def publish(self, topic, payload):
+        pass
+
+
+class FakeApiTestCase(unittest.IsolatedAsyncioTestCase):
+    """Runs local fake API and CDN server."""
+
+    async def asyncSetUp(self):
+        rm = mapdata_pb2.RobotMap()
+        rm.mapExtInfo.mapUploadDate = 77
+        rm.mapHead.sizeX = 2
+        rm.mapHead.sizeY = 2
+        rm.mapData.mapData = b'\x00\x01\x02\x03'
+        self.map_payload = encrypt_map(SN, MAC, Product.RCV5, rm.SerializeToString())
+        self.calls = {}
+        self.expired_tokens = set()
+        self.expire_all = False
+        self.failures = {}
+        self.download_delays = []
+        self.domains_delay = 0.05
+        self.token_ttls = []
+
+        app = web.Application()
+        app.router.add_get('/network-service/domains/list', self.domains)
+        app.router.add_post('/storage-management/storage/aws/getAccessUrl', self.access)
+        app.router.add_get('/map', self.download)
+        app.router.add_post('/user-center/auth/login', self.login)
+        app.router.add_get(
+            '/smart-home-service/smartHome/user/getDeviceInfoByUserId/{user}',
+            self.devices)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        self.base_url = 'http://127.0.0.1:' + str(self.runner.addresses[0][1])
+
+        patcher = mock.patch.dict('karcher.karcher.REGION_URLS', {
+            Region.EU: self.base_url, Region.US: self.base_url})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # Clients get domains from cache unless test provides its own
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.domain_cache = DomainCache(tmp.name)
+        domains = Domains()
+        domains.app_api = self.base_url
+        domains.mqtt = 'mqtt.example.com:1883'
+        for region in (Region.EU, Region.US):
+            self.domain_cache.put(region, domains)
+
+    async def asyncTearDown(self):
+        await self.runner.cleanup()
+
+    def count(self, name: str):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def failing(self, name: str) -> bool:
+        if self.failures.get(name, 0) > 0:
+            self.failures[name] -= 1
+            return True
+        return False
+
+    async def domains(self, req):
+        self.count('domains')
+        if self.failing('domains'):
+            return web.Response(status=503)
+        # Give concurrent calls time to overlap
+        await asyncio.sleep(self.domains_delay)
+        domain = encrypt(json.dumps({
+            'app_api': req.url.host + ':' + str(req.url.port),
+            'mqtt': 'mqtt.example.com:1883',
+        }))
+        return web.json_response({'code': 0, 'result': {'domain': domain}})
+
+    async def access(self, req):
+        self.count('access')
+        return web.json_response(
+            {'code': 0, 'result': {'url': str(req.url.with_path('/map'))}})
+
+    async def download(self, req):
+        self.count('download')
+        if len(self.download_delays) > 0:
+            await asyncio.sleep(self.download_delays.pop(0))
+        if req.headers.get('If-None-Match') == '"v1"':
+            return web.Response(status=304)
+        return web.Response(body=self.map_payload, headers={'ETag': '"v1"'})
+
+    async def login(self, req):
+        self.count('login')
+        if self.failing('login'):
+            return web.Response(status=503)
+        # Tokens expire in an hour unless test sets other TTLs
+        ttl = self.token_ttls.pop(0) if len(self.token_ttls) > 0 else 3600
+        token = make_token('u1', ttl, self.calls['login'])
+        return web.json_response(
+            {'code': 0, 'result': {'id': 'u1', 'auth': token, 'emq_token': 'm'}})
+
+    async def devices(self, req):
+        self.count('devices')
+        if self.expire_all or req.headers.get('authorization') in self.expired_tokens:
+            return web.json_response({'code': 609, 'msg': 'Token expired'})
+        return web.json_response({'code': 0, 'result': [{
+            'deviceId': '1', 'sn': SN, 'mac': MAC, 'productId': Product.RCV5.value,
+            'productModeCode': 'x', 'status': 1, 'versions': '[]',
+        }]})
+
+    async def client(self, **kwargs) -> KarcherHome:
+        kwargs.setdefault('domain_cache', self.domain_cache)
+        return await KarcherHome.create(**kwargs)
+
+
+class TestHttpPool(FakeApiTestCase):
+
+    async def test_shared_pool(self):
+        pool = HttpPoolManager(api=PoolConfig(limit_per_host=1))
+        first = await self.client(pool=pool)
+        second = await self.client(pool=pool)
+
+        m = await first.get_map_data(make_device())
+        self.assertEqual(m.grid.tolist(), [[0, 1], [2, 3]])
+        await second.get_urls()
+        await first.close()
+        await second.get_urls()
+
+        stats = pool.stats()
+        self.assertEqual(stats['api'].created, 1)
+        self.assertEqual(stats['api'].reused, 2)
+        self.assertEqual(stats['api'].idle, 1)
+        self.assertEqual(stats['api'].in_use, 0)
+        self.assertEqual(stats['cdn'].created, 1)
+        self.assertEqual(self.calls, {'access': 1, 'download': 1, 'domains': 2})
+
+        await second.close()
+        self.assertFalse(pool.api_session.closed)
+        await pool.close()
+
+    async def test_in_use(self):
+        pool = HttpPoolManager()
+        kh = await self.client(pool=pool)
+        self.download_delays = [0.1]
+        task = asyncio.ensure_future(kh.get_map_data(make_device()))
+        while self.calls.get('download', 0) == 0:
+            await asyncio.sleep(0.001)
+        self.assertEqual(pool.stats()['cdn'].in_use, 1)
+        await task
+        stats = pool.stats()['cdn']
+        self.assertEqual((stats.in_use, stats.idle), (0, 1))
+        await kh.close()
+        await pool.close()
+
+    async def test_own_pool(self):
+        kh = await self.client()
+        await kh.get_urls()
+        pool = kh._pool
+        self.assertEqual(pool.stats()['api'].created, 1)
+        await kh.close()
+        self.assertIsNone(pool._api.session)
+
+
+class TestMapCache(FakeApiTestCase):
+
+    async def test_hits_and_misses(self):
+        with tempfile.TemporaryDirectory() as path:
+            cache = MapCache(path)
+            kh = await self.client(map_cache=cache)
+            dev = make_device()
+
+            await kh.get_map_data(dev)
+            self.assertEqual((cache.hits, cache.misses), (0, 1))
+            # Revalidated with ETag
+            await kh.get_map_data(dev)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+            # Served without requests
+            m = await kh.get_map_data(dev, upload_date=77)
+            self.assertEqual(m.grid.tolist(), [[0, 1], [2, 3]])
+            self.assertEqual((cache.hits, cache.misses), (2, 1))
+            self.assertEqual(self.calls['download'], 2)
+
+            # Lost map data is counted once and downloaded again
+            for name in os.listdir(path):
+                if name.endswith('.bin'):
+                    os.remove(os.path.join(path, name))
+            await kh.get_map_data(dev, upload_date=77)
+            self.assertEqual((cache.hits, cache.misses), (2, 2))
+            self.assertEqual(self.calls['download'], 3)
+            self.assertIsNotNone(cache.get(dev.sn, 1))
+            await kh.close()
+
+
+def shared_memory_segments():
+    return set(n for n in os.listdir('/dev/shm') if n.startswith('psm_'))
+
+
+@unittest.skipUnless(
+    SHARED_MEMORY_SUPPORTED and os.path.isdir('/dev/shm'), 'needs POSIX shared memory')
+class TestSharedMemoryExecutor(FakeApiTestCase):
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.executor = ProcessPoolExecutor(1)
+        self.addCleanup(self.executor.shutdown)
+
+    async def shutdown(self):
+        await asyncio.get_running_loop().run_in_executor(None, self.executor.shutdown)
+        # Let done callbacks of finished worker calls run
+        await asyncio.sleep(0.05)
+
+    async def test_decode(self):
+        before = shared_memory_segments()
+        kh = await self.client(executor=self.executor)
+        m = await kh.get_map_data(make_device())
+        self.assertEqual(m.grid.tolist(), [[0, 1], [2, 3]])
+        await kh.close()
+        await self.shutdown()
+        self.assertEqual(shared_memory_segments(), before)
+
+    async def test_cancelled_decode(self):
+        before = shared_memory_segments()
+        kh = await self.client(executor=self.executor)
+        # Decoding is queued to the busy worker and can not be cancelled
+        self.executor.submit(time.sleep, 0.3)
+        task = asyncio.ensure_future(kh.get_map_data(make_device()))
+        while self.calls.get('download', 0) == 0:
+            await asyncio.sleep(0.001)
+        await asyncio.sleep(0.05)
+        self.assertFalse(task.done())
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        await kh.close()
+        await self.shutdown()
+        self.assertEqual(shared_memory_segments(), before)
+
+
+class TestCoalescing(FakeApiTestCase):
+
+    async def test_concurrent_calls(self):
+        kh = await self.client()
+        results = await asyncio.gather(*(kh.get_urls() for _ in range(5)))
+        self.assertEqual(len(results), 5)
+        self.assertEqual(self.calls['domains'], 1)
+        stats = kh.single_flight.stats()['get_urls']
+        self.assertEqual((stats.calls, stats.coalesced), (5, 4))
+
+        # Completed call is not reused
+        await kh.get_urls()
+        self.assertEqual(self.calls['domains'], 2)
+        await kh.close()
+
+    async def test_disabled_endpoint(self):
+        kh = await self.client(coalesce=())
+        await asyncio.gather(*(kh.get_urls() for _ in range(3)))
+        self.assertEqual(self.calls['domains'], 3)
+        self.assertEqual(kh.single_flight.stats()['get_urls'].coalesced, 0)
+        await kh.close()
+
+    async def test_cancelled_caller(self):
+        kh = await self.client()
+        first = asyncio.ensure_future(kh.get_urls())
+        second = asyncio.ensure_future(kh.get_urls())
+        await asyncio.sleep(0.01)
+        first.cancel()
+        self.assertIsNotNone(await second)
+        self.assertEqual(self.calls['domains'], 1)
+        await kh.close()
+
+
+class TestResponseCache(FakeApiTestCase):
+
+    def sign_in(self, kh: KarcherHome, user_id: str = 'u1'):
+        kh.login_token(make_token(user_id), 'mqtt')
+
+    async def test_memory_cache(self):
+        kh = await self.client(response_cache=ResponseCache())
+        self.sign_in(kh)
+
+        first = await kh.get_devices()
+        second = await kh.get_devices()
+        self.assertEqual(self.calls['devices'], 1)
+        self.assertEqual(second[0].sn, SN)
+        # Callers get their own copies of decoded objects
+        self.assertIsNot(first, second)
+        self.assertIsNot(first[0], second[0])
+        first[0].sn = 'changed'
+        self.assertEqual((await kh.get_devices())[0].sn, SN)
+
+        await kh.get_urls()
+        await kh.get_urls()
+        self.assertEqual(self.calls['domains'], 1)
+        self.assertEqual((kh.response_cache.hits, kh.response_cache.misses), (3, 2))
+
+        # Other user has separate entries
+        self.sign_in(kh, 'u2')
+        await kh.get_devices()
+        self.assertEqual(self.calls['devices'], 2)
+
+        kh.invalidate_cache('get_devices')
+        await kh.get_devices()
+        await kh.get_urls()
+        self.assertEqual(self.calls, {'devices': 3, 'domains': 1})
+        await kh.close()
+
+    async def test_expired(self):
+        kh = await self.client(response_cache=ResponseCache(ttls={'get_urls': 0.01}))
+        await kh.get_urls()
+        await asyncio.sleep(0.02)
+        await kh.get_urls()
+        self.assertEqual(self.calls['domains'], 2)
+
+        # Endpoints without TTL are not cached
+        self.sign_in(kh)
+        await kh.get_devices()
+        await kh.get_devices()
+        self.assertEqual(self.calls['devices'], 2)
+        await kh.close()
+
+    async def test_disk_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'responses')
+            kh = await self.client(response_cache=ResponseCache(path=path))
+            self.sign_in(kh)
+            await kh.get_devices()
+            await kh.close()
+
+            # Stored account data is private
+            for root, dirs, files in os.walk(path):
+                self.assertEqual(os.stat(root).st_mode & 0o777, 0o700)
+                for name in files:
+                    mode = os.stat(os.path.join(root, name)).st_mode
+                    self.assertEqual(mode & 0o777, 0o600)
+
+            # Signing in invalidates responses of previous session
+            kh = await self.client()
+            self.sign_in(kh)
+            kh.response_cache = ResponseCache(path=path)
+            devices = await kh.get_devices()
+            self.assertEqual(devices[0].product_id, Product.RCV5)
+            self.assertEqual(self.calls['devices'], 1)
+
+            # Invalidation removes responses on disk too
+            kh.invalidate_cache('get_devices')
+            kh.response_cache = ResponseCache(path=path)
+            await kh.get_devices()
+            self.assertEqual(self.calls['devices'], 2)
+            await kh.close()
+
+    async def test_user_invalidation(self):
+        with tempfile.TemporaryDirectory() as path:
+            cache = ResponseCache(path=path)
+            first = await self.client(response_cache=cache)
+            self.sign_in(first, 'u1')
+            await first.get_devices()
+
+            # Other user signing in keeps responses of the first one
+            second = await self.client(response_cache=cache)
+            self.sign_in(second, 'u2')
+            await second.get_devices()
+            await first.get_devices()
+            self.assertEqual(self.calls['devices'], 2)
+
+            # Also on disk
+            await first.close()
+            first = await self.client()
+            self.sign_in(first, 'u1')
+            first.response_cache = ResponseCache(path=path)
+            await first.get_devices()
+            self.assertEqual(self.calls['devices'], 2)
+
+            # Signing in again invalidates own responses only
+            self.sign_in(second, 'u2')
+            await second.get_devices()
+            await first.get_devices()
+            self.assertEqual(self.calls['devices'], 3)
+            for kh in (first, second):
+                await kh.close()
+
+
+class TestDomainCache(FakeApiTestCase):
+
+    async def create(self, cache: DomainCache, **kwargs) -> KarcherHome:
+        return await KarcherHome.create(country='LV', domain_cache=cache, **kwargs)
+
+    async def test_cold_and_warm(self):
+        with tempfile.TemporaryDirectory() as path:
+            kh = await self.create(DomainCache(path))
+            self.assertEqual(self.calls['domains'], 1)
+            await kh.close()
+
+            kh = await self.create(DomainCache(path))
+            self.assertEqual(kh._mqtt_url, 'mqtt.example.com:1883')
+            self.assertIsNone(kh._domains_refresh)
+            self.assertEqual(self.calls['domains'], 1)
+            await kh.close()
+
+            # Other regions are not shared
+            self.assertIsNone(DomainCache(path).get(Region.US))
+
+    async def test_stale(self):
+        with tempfile.TemporaryDirectory() as path:
+            cache = DomainCache(path, ttl=0)
+            domains = Domains()
+            domains.app_api = self.base_url
+            domains.mqtt = 'old.example.com:1883'
+            cache.put(Region.EU, domains)
+
+            kh = await self.create(cache)
+            # Stale domains are used until revalidated
+            self.assertEqual(kh._mqtt_url, 'old.example.com:1883')
+            self.assertNotIn('domains', self.calls)
+            await kh._domains_refresh
+            self.assertEqual(kh._mqtt_url, 'mqtt.example.com:1883')
+            self.assertEqual(cache.get(Region.EU).mqtt, 'mqtt.example.com:1883')
+            await kh.close()
+
+    async def test_dead_api_domain(self):
+        with tempfile.TemporaryDirectory() as path:
+            cache = DomainCache(path, ttl=0)
+            domains = Domains()
+            domains.app_api = self.base_url + '/missing'
+            domains.mqtt = 'old.example.com:1883'
+            cache.put(Region.EU, domains)
+
+            # Dead cached API domain is revalidated through regional one
+            kh = await self.create(cache)
+            await kh._domains_refresh
+            self.assertEqual(kh._mqtt_url, 'mqtt.example.com:1883')
+            self.assertNotEqual(cache.get(Region.EU).app_api, domains.app_api)
+            self.assertEqual(self.calls['domains'], 1)
+            await kh.close()
+
+    async def test_failed_revalidation(self):
+        with tempfile.TemporaryDirectory() as path:
+            cache = DomainCache(path, ttl=0)
+            domains = Domains()
+            domains.app_api = self.base_url
+            domains.mqtt = 'old.example.com:1883'
+            cache.put(Region.EU, domains)
+
+            policy = RetryPolicy(timeouts={'get_urls': 0.01}, attempts=1)
+            kh = await self.create(cache, retry_policy=policy)
+            refresh = kh._domains_refresh
+            await refresh
+            self.assertIsNone(refresh.exception())
+            self.assertEqual(kh._mqtt_url, 'old.example.com:1883')
+            self.assertIsNone(kh._domains_refresh)
+            await kh.close()
+
+
+class TestSessionRenewal(FakeApiTestCase):
+
+    async def test_replay(self):
+        kh = await self.client(renew_session=True, coalesce=())
+        session = await kh.login('user@example.com', 'secret')
+        self.assertGreater(session.expires_at, time.time())
+        self.expired_tokens.add(session.auth_token)
+
+        # Concurrent failed calls share a single renewal
+        results = await asyncio.gather(*(kh.get_devices() for _ in range(3)))
+        self.assertEqual([len(r) for r in results], [1, 1, 1])
+        self.assertEqual(self.calls['login'], 2)
+        self.assertEqual(self.calls['devices'], 6)
+        self.assertEqual(kh.session_manager.renewals, 1)
+        self.assertNotEqual(kh._session.auth_token, session.auth_token)
+        await kh.close()
+
+    async def test_replay_once(self):
+        kh = await self.client(renew_session=True)
+        await kh.login('user@example.com', 'secret')
+        self.expire_all = True
+        with self.assertRaises(KarcherHomeTokenExpired):
+            await kh.get_devices()
+        self.assertEqual(self.calls, {'login': 2, 'devices': 2})
+        await kh.close()
+
+    async def test_background_renewal(self):
+        self.token_ttls = [60]
+        kh = await self.client(renew_session=True)
+        session = await kh.login('user@example.com', 'secret')
+        # Token expires within renewal margin
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.calls['login'], 2)
+        self.assertNotEqual(kh._session.auth_token, session.auth_token)
+        self.assertIs(kh.session_manager.session, kh._session)
+        await kh.close()
+
+    async def test_disabled(self):
+        kh = await self.client()
+        session = await kh.login('user@example.com', 'secret')
+        self.expired_tokens.add(session.auth_token)
+        with self.assertRaises(KarcherHomeTokenExpired):
+            await kh.get_devices()
+        self.assertEqual(self.calls, {'login': 1, 'devices': 1})
+        await kh.close()
+
+    async def test_token_login(self):
+        kh = await self.client(renew_session=True)
+        session = await kh.login('user@example.com', 'secret')
+        kh.login_token(session.auth_token, session.mqtt_token)
+        self.expired_tokens.add(session.auth_token)
+        # Token session can not be renewed
+        with self.assertRaises(KarcherHomeTokenExpired):
+            await kh.get_devices()
+        self.assertEqual(self.calls['login'], 1)
+        await kh.close()
+
+
+class TestSessionManager(unittest.IsolatedAsyncioTestCase):
+
+    async def test_close_stops_running_renewal(self):
+        calls = []
+
+        async def renew():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            # Renewed token would be renewed again right away
+            return Session.from_token(make_token('u1', 1, len(calls)), 'm')
+
+        manager = SessionManager(renew)
+        manager.track(Session.from_token(make_token('u1', 1), 'm'))
+        await asyncio.sleep(0.01)
+        manager.close()
+        await asyncio.sleep(0.1)
+        self.assertEqual((len(calls), manager.renewals), (1, 0))
+        self.assertIsNone(manager.session)
+
+    async def test_background_network_error(self):
+        calls = []
+
+        async def renew():
+            calls.append(1)
+            if len(calls) == 1:
+                raise aiohttp.ClientConnectionError('refused')
+            if len(calls) == 2:
+                raise asyncio.TimeoutError()
+            return Session.from_token(make_token('u1', 3600, len(calls)), 'm')
+
+        manager = SessionManager(renew, retry_delay=0.01)
+        manager.track(Session.from_token(make_token('u1', 1), 'm'))
+        await asyncio.sleep(0.1)
+        self.assertEqual((len(calls), manager.renewals), (3, 1))
+        self.assertGreater(manager.session.expires_at, time.time() + 3000)
+        manager.close()
+
+
+class TestRetry(FakeApiTestCase):
+
+    async def test_transient_error(self):
+        kh = await self.client(retry_policy=RetryPolicy(base_delay=0.001))
+        self.failures['domains'] = 2
+        await kh.get_urls()
+        self.assertEqual(self.calls['domains'], 3)
+
+        self.failures['domains'] = 3
+        with self.assertRaises(KarcherHomeHttpError) as cm:
+            await kh.get_urls()
+        self.assertEqual(cm.exception.status, 503)
+        self.assertEqual(self.calls['domains'], 6)
+        await kh.close()
+
+    async def test_not_retried(self):
+        kh = await self.client(retry_policy=RetryPolicy(base_delay=0.001))
+        self.failures['login'] = 1
+        with self.assertRaises(KarcherHomeHttpError):
+            await kh.login('user@example.com', 'secret')
+        self.assertEqual(self.calls['login'], 1)
+        await kh.close()
+
+    async def test_timeout(self):
+        # Each attempt has time to reach the server even on a busy host
+        self.domains_delay = 0.5
+        kh = await self.client(retry_policy=RetryPolicy(
+            timeouts={'get_urls': 0.2}, attempts=2, base_delay=0.001))
+        with self.assertRaises(asyncio.TimeoutError):
+            await kh.get_urls()
+        self.assertEqual(self.calls['domains'], 2)
+        await kh.close()
+
+    async def test_hedged_download(self):
+        kh = await self.client(retry_policy=RetryPolicy(hedge=True))
+        for _ in range(20):
+            kh._download_latency.add(0.01)
+        self.download_delays = [1, 0]
+        m = await asyncio.wait_for(kh.get_map_data(make_device()), 0.5)
+        self.assertEqual(m.grid.tolist(), [[0, 1], [2, 3]])
+        self.assertEqual(self.calls['download'], 2)
+        await kh.close()
+
+    async def test_hedged_errors(self):
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError('failed')
+
+        with self.assertRaises(ValueError):
+            await hedged(fail, 0.001)
+        # Without delay there is a single call
+        self.assertEqual(await hedged(lambda: asyncio.sleep(0, 'ok'), None), 'ok')
+
+
+class TestScheduler(FakeApiTestCase):
+
+    async def test_shared(self):
+        scheduler = RequestScheduler(RateLimit(rate=20, burst=1))
+        first = await self.client(scheduler=scheduler, coalesce=())
+        second = await self.client(scheduler=scheduler)
+
+        start = asyncio.get_running_loop().time()
+        await asyncio.gather(first.get_urls(), first.get_urls(), second.get_urls())
+        self.assertGreaterEqual(asyncio.get_running_loop().time() - start, 0.09)
+        stats = scheduler.stats()['default']
+        self.assertEqual((stats.requests, stats.delayed, stats.waiting), (3, 2, 0))
+        self.assertGreater(stats.max_wait, 0.04)
+        await first.close()
+        await second.close()
+
+    async def test_priority(self):
+        scheduler = RequestScheduler(RateLimit(rate=50, burst=1))
+        await scheduler.acquire('eu', 'a')
+        order = []
+
+        async def request(name: str):
+            await scheduler.acquire('eu', 'a')
+            order.append(name)
+
+        with request_priority(Priority.BACKGROUND):
+            background = asyncio.ensure_future(request('background'))
+        await asyncio.sleep(0)
+        interactive = asyncio.ensure_future(request('interactive'))
+        await asyncio.sleep(0)
+        default = asyncio.ensure_future(request('default'))
+        await asyncio.gather(background, interactive, default)
+        self.assertEqual(order, ['interactive', 'default', 'background'])
+        self.assertEqual(scheduler.stats()['background'].delayed, 1)
+
+    async def test_endpoint_limit(self):
+        scheduler = RequestScheduler(
+            RateLimit(rate=1000, burst=10), {'a': RateLimit(rate=1, burst=1)})
+        await scheduler.acquire('eu', 'a')
+        limited = asyncio.ensure_future(scheduler.acquire('eu', 'a'))
+        # Other endpoints and regions are not held up
+        await asyncio.wait_for(scheduler.acquire('eu', 'b'), 0.1)
+        await asyncio.wait_for(scheduler.acquire('us', 'a'), 0.1)
+        self.assertFalse(limited.done())
+
+        limited.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await limited
+        self.assertEqual(scheduler._waiters, [])
+        self.assertEqual(scheduler.stats()['default'].waiting, 0)
+
+
+class TestFleet(FakeApiTestCase):
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.clients = []
+
+    def mqtt_client(self, *args) -> FakeMqttClient:
+        client = FakeMqttClient(*args)
+        self.clients.append(client)
+        return client
+
+    async def test_shared_connections(self):
+        fleet = KarcherFleet(
+            domain_cache=self.domain_cache, mqtt_hub=MqttHub(self.mqtt_client))
+        first = await fleet.add_account('first', 'LV', auth_token=make_token('u1'), mqtt_token='m')
+        same = await fleet.add_account(
+            'same', 'LV', auth_token=first._session.auth_token, mqtt_token='m')
+        other = await fleet.add_account('other', 'US', auth_token=make_token('u2'), mqtt_token='m')
+        for kh in (first, same, other):
+            await kh.get_devices()
+
+        dev = make_device()
+        for account in ('first', 'same', 'other'):
+            fleet.subscribe_device(account, dev)
+
+        res = fleet.resources()
+        self.assertEqual((res.accounts, res.http_pools, res.mqtt_connections), (3, 2, 2))
+        self.assertEqual(res.http_connections, 2)
+        # Same credentials share connection and its subscriptions
+        self.assertEqual([c.connects for c in self.clients], [1, 1])
+        self.assertEqual(self.clients[0].topics, get_device_topics(dev.product_id, SN))
+
+        with self.assertRaises(ValueError):
+            await fleet.add_account('other', 'US', auth_token=make_token('u2'), mqtt_token='m')
+
+        await fleet.remove_account('same')
+        self.assertFalse(self.clients[0].disconnected)
+        fleet.unsubscribe_device('first', dev)
+        self.assertEqual(self.clients[0].topics, [])
+        await fleet.close()
+        self.assertTrue(all(c.disconnected for c in self.clients))
+        self.assertEqual(fleet.resources().http_pools, 0)
+
+    async def test_failed_connect(self):
+        hub = MqttHub(self.mqtt_client)
+        first = hub.client('mqtt.example.com', 1883, 'u1', 'm')
+        self.clients[0].fail_connect = True
+        with self.assertRaises(OSError):
+            first.connect()
+
+        # Next client of the connection connects again
+        connected = threading.Event()
+        second = hub.client('mqtt.example.com', 1883, 'u1', 'm')
+        second.on_connect = connected.set
+        second.connect()
+        self.assertTrue(connected.is_set())
+        self.assertEqual(self.clients[0].connects, 2)
+        self.assertEqual(hub.connections, 1)
+        first.disconnect()
+        second.disconnect()
+        self.assertTrue(self.clients[0].disconnected)
+
+    async def test_events(self):
+        fleet = KarcherFleet(
+            domain_cache=self.domain_cache, mqtt_hub=MqttHub(self.mqtt_client),
+            max_events=2)
+        for account in ('first', 'second'):
+            await fleet.add_account(
+                account, 'LV', auth_token=make_token('u1'), mqtt_token='m')
+            fleet.subscribe_device(account, make_device())
+        self.assertEqual(len(self.clients), 1)
+
+        topic = get_device_topics(Product.RCV5.value, SN)[0]
+        thread = threading.Thread(
+            target=self.clients[0].on_message, args=(topic, b'{}'))
+        thread.start()
+        thread.join()
+
+        events = fleet.events()
+        received = [await events.__anext__(), await events.__anext__()]
+        self.assertEqual(sorted(e.account for e in received), ['first', 'second'])
+        self.assertEqual(
+            [(e.sn, e.topic, e.payload) for e in received], [(SN, topic, b'{}')] * 2)
+
+        # Oldest unread events are dropped
+        for _ in range(2):
+            self.clients[0].on_message(topic, b'{}')
+        await asyncio.sleep(0.01)
+        self.assertEqual(fleet.resources().dropped_events, 2)
+
+        # Messages arriving after event loop is closed are ignored
+        closed = asyncio.new_event_loop()
+        closed.close()
+        with mock.patch.object(fleet, '_loop', closed):
+            self.clients[0].on_message(topic, b'{}')
+        await fleet.close()
@@ -0,0 +1,387 @@
+import unittest
+
+import numpy as np
+
+from karcher import mapdata_pb2
+from karcher.consts import Product
+from karcher.coverage import CoverageMap
+from karcher.exception import KarcherHomeException
+from karcher.executor import attach_shared_map, decode_map_shared
+from karcher.map import Map, read_map_fields, scan_fields
+from karcher.render import CHARGE_STATION_COLOR, MapRenderer, render_png
+from karcher.rooms import outlines_to_geojson, outlines_to_svg
+from karcher.synthetic import generate_map
+from karcher.utils import decrypt_map, encrypt_map
+
+
+def make_map(size_x=4, size_y=3) -> bytes:
+    rm = mapdata_pb2.RobotMap()
+    rm.mapHead.mapHeadId = 1
+    rm.mapHead.sizeX = size_x
+    rm.mapHead.sizeY = size_y
+    rm.mapHead.minX = -1.0
+    rm.mapHead.minY = -2.0
+    rm.mapHead.resolution = 0.5
+    rm.mapData.mapData = bytes(i % 256 for i in range(size_x * size_y))
+    half = size_x // 2
+    rm.roomMatrix.matrix = bytes(([1] * half + [2] * (size_x - half)) * size_y)
+    return rm.SerializeToString()
+
+
+class TestMapGrid(unittest.TestCase):
+
+    def test_grid(self):
+        m = Map.parse(make_map())
+        self.assertEqual(m.grid.shape, (3, 4))
+        self.assertEqual(m.grid.dtype, np.uint8)
+        self.assertEqual(m.grid[1, 2], 6)
+        self.assertFalse(m.grid.flags.writeable)
+        self.assertEqual(m.room_grid[2, 3], 2)
+
+    def test_coordinates(self):
+        m = Map.parse(make_map())
+        px, py = m.world_to_pixel(0.1, -1.1)
+        self.assertEqual((int(px), int(py)), (2, 1))
+        x, y = m.pixel_to_world(2, 1)
+        self.assertAlmostEqual(float(x), 0.25)
+        self.assertAlmostEqual(float(y), -1.25)
+        px, py = m.world_to_pixel(np.array([-1.0, 1.0]), np.array([-2.0, -0.4]))
+        self.assertEqual(list(m.in_bounds(px, py)), [True, False])
+
+
+class TestMapSections(unittest.TestCase):
+
+    def test_typed_sections(self):
+        rm = mapdata_pb2.RobotMap()
+        rm.ParseFromString(make_map())
+        rm.chargeStation.x = 1.5
+        room = rm.roomDataInfo.add()
+        room.roomId = 3
+        room.roomName = 'Kitchen'
+        room.meterialId = 2
+        m = Map.parse(rm.SerializeToString())
+
+        self.assertEqual(m.charge_station.x, 1.5)
+        self.assertIsNone(m.current_pose)
+        self.assertEqual(m.head.size_x, 4)
+        self.assertEqual(m.rooms[0].room_name, 'Kitchen')
+        self.assertEqual(m.rooms[0].material_id, 2)
+        self.assertIsNone(m.rooms[0].clean_preference)
+        self.assertIs(m.rooms, m.rooms)
+        self.assertEqual(m.virtual_walls, [])
+
+    def test_data_compat(self):
+        m = Map.parse(make_map())
+        self.assertEqual(m.data['map_head']['size_x'], 4)
+        self.assertEqual(m.data['room_matrix']['matrix'], 'AQECAgEBAgIBAQIC')
+
+
+class TestSharedMap(unittest.TestCase):
+
+    def test_shared_memory_roundtrip(self):
+        data = make_map()
+        enc = encrypt_map('SN1', 'AA:BB:CC:DD:EE:FF', Product.RCV5, data)
+        result = decode_map_shared('SN1', 'AA:BB:CC:DD:EE:FF', Product.RCV5, 1, enc, True, True)
+        self.assertLess(len(result[2]), len(data))
+        payload, m = attach_shared_map(result)
+        self.assertEqual(payload, data)
+        self.assertEqual(m.grid.tolist(), Map.parse(data).grid.tolist())
+        self.assertEqual(m.room_grid[2, 3], 2)
+        self.assertEqual(m.data['room_matrix']['matrix'], 'AQECAgEBAgIBAQIC')
+
+
+class TestRoomStats(unittest.TestCase):
+
+    def test_room_stats(self):
+        rm = mapdata_pb2.RobotMap()
+        rm.mapHead.sizeX = 5
+        rm.mapHead.sizeY = 4
+        rm.mapHead.resolution = 0.5
+        rm.roomMatrix.matrix = bytes([
+            1, 1, 1, 2, 2,
+            1, 0, 0, 2, 2,
+            1, 1, 1, 0, 0,
+            0, 0, 0, 0, 0,
+        ])
+        m = Map.parse(rm.SerializeToString())
+        stats = m.room_stats
+        self.assertIs(stats, m.room_stats)
+        self.assertEqual(sorted(stats.keys()), [1, 2])
+
+        self.assertEqual(stats[2].cells, 4)
+        self.assertAlmostEqual(stats[2].area, 1.0)
+        self.assertEqual(stats[2].pixel_bbox, (3, 0, 4, 1))
+        self.assertEqual(stats[2].bbox, (1.5, 0.0, 2.5, 1.0))
+        self.assertEqual(stats[2].centroid, (2.0, 0.5))
+
+        # Centroid of concave room is outside of it, label is placed inside
+        self.assertEqual(stats[1].pixel_bbox, (0, 0, 2, 2))
+        self.assertEqual(m.room_grid[1, 1], 0)
+        self.assertAlmostEqual(stats[1].centroid[1], 0.75)
+        px, py = m.world_to_pixel(*stats[1].label_position)
+        self.assertEqual(m.room_grid[py, px], 1)
+
+
+class TestCoverage(unittest.TestCase):
+
+    def make_map(self, points):
+        rm = mapdata_pb2.RobotMap()
+        rm.mapHead.sizeX = 10
+        rm.mapHead.sizeY = 10
+        rm.mapHead.resolution = 0.1
+        rm.roomMatrix.matrix = bytes([1] * 50 + [2] * 50)
+        rm.historyPose.poseId = 1
+        for x, y in points:
+            p = rm.historyPose.points.add()
+            p.x = x
+            p.y = y
+        return Map.parse(rm.SerializeToString())
+
+    def test_path_coverage(self):
+        m = self.make_map([(0.05, 0.05), (0.95, 0.05)])
+        c = CoverageMap.from_map(m, brush_width=0.1)
+        self.assertEqual(c.mask[0].tolist(), [True] * 10)
+        self.assertEqual(np.count_nonzero(c.mask), 10)
+        self.assertAlmostEqual(c.coverage, 0.1)
+        self.assertEqual(c.room_coverage(), {1: 0.2, 2: 0.0})
+
+    def test_incremental_update(self):
+        c = CoverageMap.from_map(self.make_map([(0.05, 0.05), (0.95, 0.05)]), 0.1)
+        c.update_from_map(self.make_map([(0.05, 0.05), (0.95, 0.05), (0.95, 0.95)]))
+        self.assertEqual(np.count_nonzero(c.mask), 19)
+        self.assertEqual(c.mask[:, 9].tolist(), [True] * 10)
+        self.assertEqual(np.count_nonzero(c.room_mask(2)), 5)
+
+
+class TestRender(unittest.TestCase):
+
+    def test_render(self):
+        rm = mapdata_pb2.RobotMap()
+        rm.ParseFromString(make_map(600, 300))
+        rm.roomMatrix.matrix = bytes(600 * 300)
+        rm.chargeStation.x = 260.5
+        rm.chargeStation.y = 72.5
+        m = Map.parse(rm.SerializeToString())
+        renderer = MapRenderer(palette={205: (255, 0, 0, 255)}, tile_size=256)
+
+        image = renderer.render(m, overlays=False)
+        self.assertEqual(image.shape, (300, 600, 4))
+        # First image row is the last grid row
+        self.assertEqual(m.grid[299, 5], 205)
+        self.assertEqual(tuple(image[0, 5]), (255, 0, 0, 255))
+        self.assertIs(renderer.render(m, overlays=False), image)
+
+        self.assertEqual(renderer.levels(m), 3)
+        self.assertEqual(renderer.render(m, 2, overlays=False).shape, (75, 150, 4))
+        tile = renderer.tile(m, 1, 1, 0)
+        self.assertEqual(tile.shape, (256, 256, 4))
+        self.assertEqual(tile[200, 100, 3], 0)
+        self.assertEqual(tuple(tile[75, 5]), CHARGE_STATION_COLOR)
+
+        png = render_png(m, renderer, 2)
+        self.assertTrue(png.startswith(b'\x89PNG\r\n\x1a\n'))
+
+    def test_room_colors(self):
+        m = Map.parse(make_map())
+        image = MapRenderer(room_colors=[(1, 2, 3, 255), (4, 5, 6, 255)]).render(m)
+        self.assertEqual(tuple(image[0, 0]), (1, 2, 3, 255))
+        self.assertEqual(tuple(image[0, 3]), (4, 5, 6, 255))
+
+
+class TestMapDiff(unittest.TestCase):
+
+    def make_maps(self):
+        rm = mapdata_pb2.RobotMap()
+        rm.ParseFromString(make_map(100, 80))
+        rm.roomDataInfo.add(roomId=1, roomName='Kitchen')
+        rm.roomDataInfo.add(roomId=2, roomName='Hall')
+        rm.navigationPoints.add(pointId=7, x=1.0)
+        rm.currentPose.x = 1.0
+        rm.historyPose.poseId = 3
+        rm.historyPose.points.add(x=0.5, y=0.5)
+        old = Map(rm)
+
+        rm = mapdata_pb2.RobotMap()
+        rm.CopyFrom(old.robot_map)
+        grid = bytearray(rm.mapData.mapData)
+        grid[5 * 100 + 3] = 255
+        grid[70 * 100 + 90:70 * 100 + 92] = b'\xff\xff'
+        rm.mapData.mapData = bytes(grid)
+        rm.roomDataInfo[0].roomName = 'Bathroom'
+        del rm.roomDataInfo[1]
+        rm.roomDataInfo.add(roomId=4, roomName='Office')
+        rm.virtualWalls.add(areaIndex=1).points.add(x=1.0, y=2.0)
+        rm.currentPose.x = 1.5
+        rm.currentPose.phi = 0.1
+        rm.historyPose.points.add(x=1.0, y=0.5, update=1)
+        rm.mapType = 2
+        return old, Map(rm)
+
+    def test_diff(self):
+        old, new = self.make_maps()
+        diff = old.diff(new)
+        self.assertIsNone(diff.head)
+        self.assertEqual([(p.x, p.y, p.cells.shape) for p in diff.grid],
+                         [(3, 5, (1, 1)), (90, 70, (1, 2))])
+        self.assertEqual(diff.room_grid, [])
+        self.assertEqual([r.room_name for r in diff.rooms.changed], ['Bathroom'])
+        self.assertEqual(diff.rooms.removed, [2])
+        self.assertEqual([r.room_id for r in diff.rooms.added], [4])
+        self.assertEqual(len(diff.virtual_walls.added), 1)
+        self.assertFalse(diff.navigation_points)
+        self.assertAlmostEqual(diff.pose_delta[0], 0.5)
+        self.assertEqual((diff.path.start, len(diff.path.points)), (1, 1))
+        self.assertEqual(diff.sections, {'mapType': 2})
+        self.assertTrue(new.diff(new).empty)
+
+    def test_apply_patch(self):
+        old, new = self.make_maps()
+        patched = old.apply_patch(old.diff(new))
+        self.assertEqual(patched.version, new.version)
+        self.assertEqual(patched.robot_map, new.robot_map)
+        with self.assertRaises(ValueError):
+            new.apply_patch(old.diff(new))
+
+    def test_resize(self):
+        old, new = self.make_maps()
+        rm = mapdata_pb2.RobotMap()
+        rm.ParseFromString(make_map(4, 3))
+        diff = old.diff(Map(rm))
+        self.assertEqual(diff.head.size_x, 4)
+        self.assertEqual(diff.grid[0].cells.shape, (3, 4))
+        self.assertEqual(old.apply_patch(diff).robot_map.mapData, rm.mapData)
+
+
+class TestWireScan(unittest.TestCase):
+
+    def test_scan_fields(self):
+        rm = mapdata_pb2.RobotMap()
+        rm.ParseFromString(make_map())
+        rm.mapType = 1
+        rm.chargeStation.x = 1.5
+        data = rm.SerializeToString()
+        fields = scan_fields(data)
+        self.assertEqual(sorted(fields), [1, 3, 4, 7, 13])
+        offset, start, end = fields[7][0]
+        pose = mapdata_pb2.DevicePoseDataInfo()
+        pose.ParseFromString(data[start:end])
+        self.assertEqual(pose.x, 1.5)
+        with self.assertRaises(KarcherHomeException):
+            scan_fields(data[:-1])
+
+    def test_read_map_fields(self):
+        rm = mapdata_pb2.RobotMap()
+        rm.ParseFromString(make_map())
+        rm.currentPose.x = 2.0
+        rm.mapExtInfo.mapUploadDate = 1234
+        data = rm.SerializeToString()
+        values = read_map_fields(data, ['currentPose', 'mapExtInfo', 'mapData', 'houseInfos'])
+        self.assertEqual(values['currentPose'].x, 2.0)
+        self.assertEqual(values['mapExtInfo'].mapUploadDate, 1234)
+        self.assertIsInstance(values['mapData'], memoryview)
+        self.assertEqual(bytes(values['mapData']), rm.mapData.mapData)
+        self.assertNotIn('houseInfos', values)
+        self.assertFalse(values[None].HasField('roomMatrix'))
+
+    def test_parse_fields(self):
+        m = Map.parse(make_map(), fields=['mapData'])
+        self.assertEqual(m.grid[1, 2], 6)
+        self.assertIsNone(m.room_grid)
+        self.assertEqual(m.robot_map.mapData.mapData, b'')
+
+    def test_parse_fields_data(self):
+        full = Map.parse(make_map()).data
+        data = Map.parse(make_map(), fields=['mapData', 'roomMatrix']).data
+        self.assertEqual(data['map_data'], full['map_data'])
+        self.assertEqual(data['room_matrix'], full['room_matrix'])
+        self.assertNotIn('room_matrix', Map.parse(make_map(), fields=['mapData']).data)
+
+
+class TestSpatialIndex(unittest.TestCase):
+
+    def make_map(self):
+        rm = mapdata_pb2.RobotMap()
+        rm.ParseFromString(make_map())
+        area = rm.areasInfo.add(areaIndex=1)
+        for x, y in ((0.0, 0.0), (2.0, 0.0), (2.0, 2.0), (0.0, 2.0)):
+            area.points.add(x=x, y=y)
+        wall = rm.virtualWalls.add(areaIndex=2)
+        wall.points.add(x=5.0, y=-1.0)
+        wall.points.add(x=5.0, y=1.0)
+        rm.objects.add(objectId=1, x=1.0, y=1.0)
+        rm.objects.add(objectId=2, x=4.0, y=0.0)
+        return Map(rm)
+
+    def test_point_queries(self):
+        index = self.make_map().spatial_index
+        self.assertEqual(index.room_at(-0.9, -1.9), 1)
+        self.assertEqual(index.room_at(0.9, -1.9), 2)
+        self.assertEqual(index.room_at(10.0, 10.0), 0)
+        self.assertEqual([a.area_index for a in index.areas_at(1.5, 0.5)], [1])
+        self.assertEqual(index.areas_at(3.0, 0.5), [])
+        self.assertEqual(index.in_areas([[1.5, 0.5], [3.0, 0.5], [-0.1, 1.0]]).tolist(),
+                         [True, False, False])
+
+    def test_nearest_objects(self):
+        index = self.make_map().spatial_index
+        obj, dist = index.nearest_object(3.0, 0.0)
+        self.assertEqual((obj.object_id, dist), (2, 1.0))
+        self.assertIsNone(index.nearest_object(10.0, 0.0, max_distance=1.0))
+        idx, _ = index.nearest_objects([[0.0, 0.0], [10.0, 0.0]], max_distance=2.0)
+        self.assertEqual(idx.tolist(), [0, -1])
+        self.assertEqual([o.object_id for o in index.objects_within(3.0, 0.5, 2.5)], [2, 1])
+
+    def test_segment_queries(self):
+        m = self.make_map()
+        index = m.spatial_index
+        self.assertIs(Map(m.robot_map).spatial_index, index)
+        self.assertEqual([a.area_index for a in index.crossed_areas(4.0, 0.0, 6.0, 0.0)], [2])
+        self.assertEqual(index.crossed_areas(3.0, 0.0, 4.0, 0.0), [])
+        self.assertEqual(index.crosses_areas([[4, 0, 6, 0], [3, 0, 4, 0], [1, 1, 3, 1]]).tolist(),
+                         [True, False, True])
+
+
+class TestRoomOutlines(unittest.TestCase):
+
+    def test_room_outlines(self):
+        rm = mapdata_pb2.RobotMap()
+        rm.ParseFromString(make_map(10, 10))
+        rm.roomDataInfo.add(roomId=1, roomName='Kitchen & Hall')
+        chain = rm.roomChain.add(roomId=1)
+        for x, y in ((0, 0), (2, 0), (4, 0), (4, 3), (0, 3)):
+            chain.points.add(x=x, y=y)
+        rm.roomChain.add(roomId=2).points.add(x=1, y=1)
+        m = Map(rm)
+
+        outlines = m.room_outlines()
+        self.assertEqual(len(outlines), 1)
+        self.assertEqual(outlines[0].room_id, 1)
+        self.assertEqual(outlines[0].points.tolist(),
+                         [[-0.75, -1.75], [1.25, -1.75], [1.25, -0.25],
+                          [-0.75, -0.25], [-0.75, -1.75]])
+        self.assertIs(Map(rm).room_outlines(), outlines)
+
+        geojson = outlines_to_geojson(m, outlines)
+        feature = geojson['features'][0]
+        self.assertEqual(feature['properties']['room_name'], 'Kitchen & Hall')
+        self.assertEqual(len(feature['geometry']['coordinates'][0]), 5)
+
+        svg = outlines_to_svg(m, outlines)
+        self.assertIn('viewBox="-1 -3 5 5"', svg)
+        self.assertIn('data-name="Kitchen &amp; Hall"', svg)
+        self.assertIn('d="M-0.750,1.750 L1.250,1.750 L1.250,0.250 L-0.750,0.250 Z"', svg)
+
+
+class TestGenerator(unittest.TestCase):
+
+    def test_generate_map(self):
+        rm = generate_map(seed=3, size_x=120, size_y=100, rooms=5, path_points=200)
+        self.assertEqual(rm.SerializeToString(), generate_map(
+            seed=3, size_x=120, size_y=100, rooms=5, path_points=200).SerializeToString())
+        data = rm.SerializeToString()
+        enc = encrypt_map('SN1', 'AA:BB:CC:DD:EE:FF', Product.RCV5, data)
+        m = Map.parse(decrypt_map('SN1', 'AA:BB:CC:DD:EE:FF', Product.RCV5, enc))
+        self.assertEqual(m.grid.shape, (100, 120))
+        self.assertEqual(sorted(m.room_stats), [1, 2, 3, 4, 5])
+        self.assertEqual(len(m.history_pose.points), 200)
+        self.assertEqual(len(m.room_outlines()), 5)
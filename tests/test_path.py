@@ -0,0 +1,39 @@
+from array import array
+import unittest
+
+import numpy as np
+
+from karcher import mapdata_pb2
+from karcher.device import DeviceProperties
+from karcher.map import Map
+from karcher.path import pack_path, simplify_radial, simplify_rdp
+
+
+class TestPath(unittest.TestCase):
+
+    def test_simplify_rdp(self):
+        points = np.array([[0, 0], [1, 0.01], [2, -0.01], [3, 0], [3, 1], [3, 2]])
+        self.assertEqual(simplify_rdp(points, 0.05).tolist(), [[0, 0], [3, 0], [3, 2]])
+        self.assertEqual(len(simplify_rdp(points, 0.001)), 5)
+
+    def test_simplify_radial(self):
+        points = np.array([[0, 0], [0.1, 0], [0.2, 0], [1, 0], [1.05, 0]])
+        self.assertEqual(simplify_radial(points, 0.5).tolist(), [[0, 0], [1, 0], [1.05, 0]])
+
+    def test_history_pose(self):
+        rm = mapdata_pb2.RobotMap()
+        rm.mapHead.resolution = 0.05
+        for i in range(100):
+            p = rm.historyPose.points.add()
+            p.x = i * 0.01
+            p.y = 1.0
+        m = Map.parse(rm.SerializeToString())
+        self.assertEqual(m.history_pose.points.shape, (100, 2))
+        self.assertEqual(m.history_pose.points.dtype, np.float32)
+        self.assertEqual(len(m.simplified_history_path()), 2)
+
+    def test_cur_path(self):
+        props = DeviceProperties(cur_path=[1.0, 2.0, 3.0, 4.0])
+        self.assertEqual(props.cur_path, array('f', [1.0, 2.0, 3.0, 4.0]))
+        self.assertFalse(props.update({'cur_path': [1.0, 2.0, 3.0, 4.0]}))
+        self.assertEqual(pack_path(props.cur_path).tolist(), [[1.0, 2.0], [3.0, 4.0]])